@@ -2,23 +2,38 @@
 Alert Service - Environmental Alert & Notification System
 Monitors thresholds and sends alerts to citizens and authorities
 """
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import select, func, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from datetime import datetime, timedelta
 from typing import Optional, List
+import asyncio
+import time
 import sys
 import os
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from shared.database import get_db, init_db, Alert, SensorReading
+from shared.database import (
+    get_db, get_async_db, init_db, SessionLocal, Alert, SensorReading, MonitorState
+)
 from shared.models import AlertCreate
 from shared.firebase_config import db as firestore_db
+from shared.pubsub import EventBroker, parse_filter, sse_response, TooManySubscribers
+from shared.pagination import after_key, clamp_limit, decode_cursor, split_page
+from shared.aqi import compute_aqi
+from shared.metrics import MetricsMiddleware, ALERT_MONITOR_RUN, ALERT_MONITOR_STALE
+from shared.reading_cursor import ReadingCursor
 
 app = FastAPI(title="Environmental Alert Service", version="1.0.0")
 
+# Live fan-out of new alerts (GET /stream/alerts)
+alert_broker = EventBroker()
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -28,6 +43,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics and /metrics (added last, so it is the outermost middleware)
+app.add_middleware(MetricsMiddleware)
+
+# Background threshold monitor
+MONITOR_NAME = "threshold_monitor"
+MONITOR_ENABLED = os.getenv("MONITOR_ENABLED", "true").lower() == "true"
+MONITOR_INTERVAL_SECONDS = float(os.getenv("MONITOR_INTERVAL_SECONDS", "60"))
+MONITOR_BATCH_SIZE = int(os.getenv("MONITOR_BATCH_SIZE", "5000"))
+MONITOR_MAX_LAG_SECONDS = int(os.getenv("MONITOR_MAX_LAG_SECONDS", "3600"))
+
 # Alert thresholds (based on WHO and national standards)
 THRESHOLDS = {
     "pm25": {
@@ -76,6 +101,23 @@ def determine_severity(pollutant: str, value: float) -> str:
         return "info"
 
 
+def alert_event(alert: Alert) -> dict:
+    """Serializable stream event for a newly created alert"""
+    return {
+        "id": alert.id,
+        "timestamp": alert.timestamp,
+        "alert_type": alert.alert_type,
+        "severity": alert.severity,
+        "pollutant": alert.pollutant,
+        "value": alert.value,
+        "area": alert.area,
+        "message": alert.message,
+        "sensor_id": alert.sensor_id or (alert.extra_data or {}).get("sensor_id"),
+        "latitude": alert.latitude,
+        "longitude": alert.longitude
+    }
+
+
 def generate_alert_message(pollutant: str, value: float, severity: str, area: str = None) -> str:
     """Generate human-readable alert message"""
     pollutant_names = {
@@ -101,9 +143,20 @@ def generate_alert_message(pollutant: str, value: float, severity: str, area: st
 async def startup_event():
     """Initialize database on startup"""
     init_db()
+    alert_broker.bind_loop(asyncio.get_running_loop())
+    if MONITOR_ENABLED:
+        app.state.monitor_task = asyncio.create_task(monitor_loop())
     print("🚀 Alert Service started")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the background monitor"""
+    task = getattr(app.state, "monitor_task", None)
+    if task:
+        task.cancel()
+
+
 @app.get("/")
 async def root():
     return {
@@ -114,7 +167,7 @@ async def root():
 
 
 @app.post("/alert/create")
-async def create_alert(
+def create_alert(
     alert: AlertCreate,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
@@ -134,6 +187,7 @@ async def create_alert(
         area=alert.area,
         message=alert.message,
         resolved=0,
+        sensor_id=(alert.extra_data or {}).get("sensor_id"),
         extra_data=alert.extra_data
     )
 
@@ -141,6 +195,8 @@ async def create_alert(
     db.commit()
     db.refresh(new_alert)
 
+    alert_broker.publish_threadsafe(alert_event(new_alert))
+
     # Store in Firestore for real-time updates (if available)
     if firestore_db:
         try:
@@ -174,20 +230,22 @@ async def create_alert(
 async def get_active_alerts(
     severity: Optional[str] = None,
     area: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get all active (unresolved) alerts
     """
-    query = db.query(Alert).filter(Alert.resolved == 0)
+    query = select(Alert).where(Alert.resolved == 0)
 
     if severity:
-        query = query.filter(Alert.severity == severity)
+        query = query.where(Alert.severity == severity)
 
     if area:
-        query = query.filter(Alert.area == area)
+        query = query.where(Alert.area == area)
 
-    alerts = query.order_by(Alert.timestamp.desc()).limit(50).all()
+    alerts = (await db.execute(
+        query.order_by(Alert.timestamp.desc()).limit(50)
+    )).scalars().all()
 
     return {
         "count": len(alerts),
@@ -209,7 +267,7 @@ async def get_active_alerts(
 
 
 @app.post("/alerts/{alert_id}/resolve")
-async def resolve_alert(
+def resolve_alert(
     alert_id: int,
     db: Session = Depends(get_db)
 ):
@@ -237,24 +295,77 @@ async def resolve_alert(
     return {"message": "Alert resolved successfully"}
 
 
-@app.post("/monitor/check")
-async def check_thresholds(
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
-):
+def run_threshold_check(db: Session) -> dict:
     """
-    Check recent readings against thresholds and create alerts if needed
-    This should be called periodically (e.g., every 5 minutes)
+    Evaluate readings ingested since the last run against thresholds
+    Progress is kept in monitor_state as a commit-safe cursor (see
+    shared.reading_cursor), so rows committed late by a concurrent writer are
+    still evaluated; the row is locked for the run so replicas never
+    double-process. Readings older than MONITOR_MAX_LAG_SECONDS are counted as
+    stale instead of raising alerts.
     """
-    # Check readings from last 15 minutes
-    recent_time = datetime.utcnow() - timedelta(minutes=15)
-    readings = db.query(SensorReading).filter(
-        SensorReading.timestamp >= recent_time
+    now = datetime.utcnow()
+    started = time.time()
+
+    # Create the state row on first run, starting from the original 15-minute window
+    db.execute(
+        pg_insert(MonitorState)
+        .values(
+            name=MONITOR_NAME,
+            last_reading_id=select(func.coalesce(func.max(SensorReading.id), 0))
+            .where(SensorReading.timestamp < now - timedelta(minutes=15))
+            .scalar_subquery(),
+            updated_at=now
+        )
+        .on_conflict_do_nothing(index_elements=[MonitorState.name])
+    )
+    state = db.get(MonitorState, MONITOR_NAME, with_for_update=True)
+    extra = state.extra_data or {}
+    cursor = ReadingCursor.from_state(state.last_reading_id, extra.get("cursor"))
+
+    # Only unprocessed rows; the lookback bound lets TimescaleDB skip old chunks
+    fetched = db.execute(
+        select(
+            SensorReading.id, SensorReading.sensor_id, SensorReading.timestamp,
+            SensorReading.latitude, SensorReading.longitude,
+            SensorReading.pm25, SensorReading.pm10, SensorReading.no2, SensorReading.co
+        )
+        .where(cursor.condition(now))
+        .order_by(SensorReading.id)
+        .limit(MONITOR_BATCH_SIZE)
     ).all()
+    fresh = cursor.advance(fetched, started)
+
+    # Late or backfilled rows are too old to alert on, but are not skipped silently
+    oldest = now - timedelta(seconds=MONITOR_MAX_LAG_SECONDS)
+    readings = [r for r in fresh if r.timestamp >= oldest]
+    stale = len(fresh) - len(readings)
+    if stale:
+        ALERT_MONITOR_STALE.inc(stale)
+
+    # AQI of every reading in this run, computed in one vectorized pass
+    reading_aqi, _ = compute_aqi({
+        pollutant: [getattr(r, pollutant) for r in readings]
+        for pollutant in ('pm25', 'pm10', 'no2', 'co')
+    })
+
+    # Open alerts loaded once per run for deduplication
+    open_alerts = {
+        (row.sensor_id, row.pollutant)
+        for row in db.execute(
+            select(Alert.sensor_id, Alert.pollutant).distinct().where(
+                and_(
+                    Alert.resolved == 0,
+                    Alert.alert_type == "threshold_exceeded",
+                    Alert.timestamp >= now - timedelta(hours=1)
+                )
+            )
+        )
+    }
 
-    alerts_created = 0
+    new_alerts = []
 
-    for reading in readings:
+    for position, reading in enumerate(readings):
         # Check each pollutant
         for pollutant in ['pm25', 'pm10', 'no2', 'co']:
             value = getattr(reading, pollutant)
@@ -265,77 +376,174 @@ async def check_thresholds(
             severity = determine_severity(pollutant, value)
 
             # Only create alerts for medium severity and above
-            if severity in ['medium', 'high', 'critical']:
-                # Check if similar alert already exists (avoid duplicates)
-                threshold_key = 'moderate' if severity == 'medium' else 'unhealthy' if severity == 'high' else 'very_unhealthy'
-                threshold_value = THRESHOLDS[pollutant].get(threshold_key, 0)
-
-                existing = db.query(Alert).filter(
-                    and_(
-                        Alert.sensor_id == reading.sensor_id,
-                        Alert.pollutant == pollutant,
-                        Alert.timestamp >= datetime.utcnow() - timedelta(hours=1),
-                        Alert.resolved == 0
-                    )
-                ).first()
-
-                if not existing:
-                    # Create alert
-                    message = generate_alert_message(pollutant, value, severity)
-
-                    alert = Alert(
-                        timestamp=datetime.utcnow(),
-                        alert_type="threshold_exceeded",
-                        severity=severity,
-                        pollutant=pollutant,
-                        value=value,
-                        threshold=threshold_value,
-                        latitude=reading.latitude,
-                        longitude=reading.longitude,
-                        area="Pavlodar",  # Could be determined from coordinates
-                        message=message,
-                        resolved=0,
-                        extra_data={"sensor_id": reading.sensor_id}
-                    )
-
-                    db.add(alert)
-                    alerts_created += 1
+            if severity not in ['medium', 'high', 'critical']:
+                continue
 
+            # Skip if a similar alert is already open (avoid duplicates)
+            key = (reading.sensor_id, pollutant)
+            if key in open_alerts:
+                continue
+            open_alerts.add(key)
+
+            threshold_key = 'moderate' if severity == 'medium' else 'unhealthy' if severity == 'high' else 'very_unhealthy'
+            threshold_value = THRESHOLDS[pollutant].get(threshold_key, 0)
+            message = generate_alert_message(pollutant, value, severity)
+
+            alert = Alert(
+                timestamp=now,
+                alert_type="threshold_exceeded",
+                severity=severity,
+                pollutant=pollutant,
+                value=value,
+                threshold=threshold_value,
+                latitude=reading.latitude,
+                longitude=reading.longitude,
+                area="Pavlodar",  # Could be determined from coordinates
+                message=message,
+                resolved=0,
+                sensor_id=reading.sensor_id,
+                extra_data={
+                    "sensor_id": reading.sensor_id,
+                    "reading_id": reading.id,
+                    "aqi": None if np.isnan(reading_aqi[position]) else int(reading_aqi[position])
+                }
+            )
+
+            db.add(alert)
+            new_alerts.append(alert)
+
+    state.last_reading_id = cursor.mark
+    if fresh:
+        state.last_timestamp = max(r.timestamp for r in fresh)
+    state.extra_data = {
+        "cursor": cursor.to_state(),
+        "stale_readings": extra.get("stale_readings", 0) + stale,
+    }
+    state.updated_at = now
+
+    db.flush()
+    events = [alert_event(a) for a in new_alerts]
     db.commit()
 
+    for event in events:
+        alert_broker.publish_threadsafe(event)
+
     return {
         "message": "Threshold check completed",
         "readings_checked": len(readings),
-        "alerts_created": alerts_created
+        "readings_stale": stale,
+        "alerts_created": len(new_alerts),
+        **cursor.stats(),
+        "backlog": len(fetched) == MONITOR_BATCH_SIZE
     }
 
 
+def _monitor_once() -> dict:
+    db = SessionLocal()
+    try:
+        return run_threshold_check(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def monitor_loop():
+    """Scheduled threshold monitor running inside the service"""
+    while True:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.to_thread(_monitor_once)
+            ALERT_MONITOR_RUN.labels("ok").observe(time.perf_counter() - started)
+            # Keep draining without waiting while there is a backlog
+            if result["backlog"]:
+                continue
+        except Exception as e:
+            ALERT_MONITOR_RUN.labels("error").observe(time.perf_counter() - started)
+            print(f"⚠️  Threshold monitor run failed: {e}")
+        await asyncio.sleep(MONITOR_INTERVAL_SECONDS)
+
+
+@app.post("/monitor/check")
+def check_thresholds(db: Session = Depends(get_db)):
+    """
+    Run the threshold monitor immediately
+    The same check also runs every MONITOR_INTERVAL_SECONDS in the background
+    """
+    return run_threshold_check(db)
+
+
+@app.get("/stream/alerts")
+async def stream_alerts(
+    request: Request,
+    sensor_id: Optional[str] = None,
+    bbox: Optional[str] = None
+):
+    """
+    Live stream of new alerts (Server-Sent Events)
+    Optional filters: sensor_id=ID1,ID2 and bbox=min_lat,min_lon,max_lat,max_lon
+    """
+    try:
+        event_filter = parse_filter(sensor_id, bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        subscription = alert_broker.subscribe(event_filter)
+    except TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many stream subscribers")
+
+    return sse_response(alert_broker, subscription, request, "alert")
+
+
+@app.get("/stream/stats")
+async def get_stream_stats():
+    """
+    Live stream subscriber and eviction counters
+    """
+    return alert_broker.stats()
+
+
 @app.get("/alerts/history")
 async def get_alert_history(
     days: int = 7,
-    db: Session = Depends(get_db)
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get alert history for the past N days
+    Get alert history for the past N days, newest first
+    Severity counts are aggregated in SQL; alerts are paged on (timestamp, id) via next_cursor.
     """
     start_time = datetime.utcnow() - timedelta(days=days)
+    limit = clamp_limit(limit)
 
-    alerts = db.query(Alert).filter(
-        Alert.timestamp >= start_time
-    ).order_by(Alert.timestamp.desc()).all()
+    counts = (await db.execute(
+        select(Alert.severity, func.count(Alert.id))
+        .where(Alert.timestamp >= start_time)
+        .group_by(Alert.severity)
+    )).all()
+    by_severity = {severity: count for severity, count in counts}
 
-    # Group by severity
-    by_severity = {}
-    for alert in alerts:
-        severity = alert.severity
-        if severity not in by_severity:
-            by_severity[severity] = 0
-        by_severity[severity] += 1
+    query = select(Alert).where(Alert.timestamp >= start_time)
+    if cursor:
+        try:
+            key = decode_cursor(cursor, (datetime, int))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(after_key([Alert.timestamp, Alert.id], key))
+
+    alerts = (await db.execute(
+        query.order_by(Alert.timestamp.desc(), Alert.id.desc()).limit(limit + 1)
+    )).scalars().all()
+    alerts, next_cursor = split_page(alerts, limit, lambda a: (a.timestamp, a.id))
 
     return {
         "period": f"Last {days} days",
-        "total_alerts": len(alerts),
+        "total_alerts": sum(by_severity.values()),
         "by_severity": by_severity,
+        "next_cursor": next_cursor,
         "recent_alerts": [
             {
                 "id": a.id,
@@ -346,7 +554,7 @@ async def get_alert_history(
                 "area": a.area,
                 "resolved": bool(a.resolved)
             }
-            for a in alerts[:20]
+            for a in alerts
         ]
     }
 
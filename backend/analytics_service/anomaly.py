@@ -0,0 +1,241 @@
+"""
+Streaming per-sensor anomaly detection
+Keeps an exponentially weighted mean and variance for every (sensor, pollutant)
+pair and scores each new reading against its own sensor's baseline in O(1).
+State lives in memory, is fed by tailing sensor_readings through a commit-safe
+cursor (shared.reading_cursor), and is snapshotted periodically to monitor_state so restarts resume where they left off.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from shared.database import get_async_sessionmaker, SensorReading, MonitorState
+from shared.reading_cursor import ReadingCursor
+
+ANOMALY_ENABLED = os.getenv("ANOMALY_ENABLED", "true").lower() == "true"
+ANOMALY_POLLUTANTS = ("pm25", "pm10", "no2", "co", "o3", "so2")
+ANOMALY_ALPHA = float(os.getenv("ANOMALY_ALPHA", "0.05"))
+ANOMALY_RECORD_Z = float(os.getenv("ANOMALY_RECORD_Z", "2.0"))
+ANOMALY_WARMUP = int(os.getenv("ANOMALY_WARMUP", "20"))
+ANOMALY_MAX_RESULTS = int(os.getenv("ANOMALY_MAX_RESULTS", "10000"))
+ANOMALY_POLL_SECONDS = float(os.getenv("ANOMALY_POLL_SECONDS", "10"))
+ANOMALY_SNAPSHOT_SECONDS = float(os.getenv("ANOMALY_SNAPSHOT_SECONDS", "300"))
+ANOMALY_BATCH_SIZE = int(os.getenv("ANOMALY_BATCH_SIZE", "5000"))
+
+STATE_NAME = "anomaly_detector"
+SNAPSHOT_RESULTS = 1000  # most recent anomalies kept across restarts
+
+
+class StreamingAnomalyDetector:
+    """EWMA mean/variance per (sensor_id, pollutant) with z-score flagging"""
+
+    def __init__(self, alpha: float = ANOMALY_ALPHA, record_z: float = ANOMALY_RECORD_Z,
+                 warmup: int = ANOMALY_WARMUP, max_results: int = ANOMALY_MAX_RESULTS):
+        self.alpha = alpha
+        self.record_z = record_z
+        self.warmup = warmup
+        # (sensor_id, pollutant) -> [mean, variance, count]
+        self.state: Dict[Tuple[str, str], List[float]] = {}
+        self.results: deque = deque(maxlen=max_results)
+        self.cursor = ReadingCursor()
+        self.sequence = 0
+        self.readings_processed = 0
+
+    def update(self, reading) -> int:
+        """Score one reading against its sensor baselines, then fold it in; returns anomalies found"""
+        found = 0
+        for pollutant in ANOMALY_POLLUTANTS:
+            value = getattr(reading, pollutant)
+            if value is None:
+                continue
+
+            key = (reading.sensor_id, pollutant)
+            entry = self.state.get(key)
+            if entry is None:
+                self.state[key] = [float(value), 0.0, 1]
+                continue
+
+            mean, variance, count = entry
+            if count >= self.warmup and variance > 0:
+                z = (value - mean) / math.sqrt(variance)
+                if abs(z) >= self.record_z:
+                    self.sequence += 1
+                    found += 1
+                    self.results.append({
+                        "seq": self.sequence,
+                        "reading_id": reading.id,
+                        "sensor_id": reading.sensor_id,
+                        "timestamp": reading.timestamp,
+                        "pollutant": pollutant,
+                        "value": value,
+                        "baseline_mean": round(mean, 3),
+                        "baseline_std": round(math.sqrt(variance), 3),
+                        "z_score": round(z, 2),
+                        "location": {"lat": reading.latitude, "lon": reading.longitude},
+                    })
+
+            # West's incremental EWMA update
+            diff = value - mean
+            increment = self.alpha * diff
+            entry[0] = mean + increment
+            entry[1] = (1 - self.alpha) * (variance + diff * increment)
+            entry[2] = count + 1
+
+        self.readings_processed += 1
+        return found
+
+    def query(self, sensor_id: Optional[str] = None, pollutant: Optional[str] = None,
+              since: Optional[datetime] = None, min_z: float = 0.0,
+              cursor: Optional[int] = None, limit: int = 50):
+        """
+        Newest-first page of recorded anomalies
+        `cursor` is the seq of the last item of the previous page
+        """
+        page = []
+        for item in reversed(self.results):
+            if cursor is not None and item["seq"] >= cursor:
+                continue
+            if since is not None and item["timestamp"] < since:
+                continue
+            if sensor_id and item["sensor_id"] != sensor_id:
+                continue
+            if pollutant and item["pollutant"] != pollutant:
+                continue
+            if abs(item["z_score"]) < min_z:
+                continue
+            page.append(item)
+            if len(page) > limit:
+                break
+
+        has_more = len(page) > limit
+        page = page[:limit]
+        next_cursor = page[-1]["seq"] if has_more and page else None
+        return page, next_cursor
+
+    def baseline(self, sensor_id: str) -> Dict[str, Dict]:
+        """Current baselines of one sensor"""
+        return {
+            pollutant: {
+                "mean": round(entry[0], 3),
+                "std": round(math.sqrt(entry[1]), 3),
+                "samples": int(entry[2]),
+            }
+            for (sid, pollutant), entry in self.state.items() if sid == sensor_id
+        }
+
+    def snapshot(self) -> Dict:
+        return {
+            "state": [[sid, pollutant, *entry] for (sid, pollutant), entry in self.state.items()],
+            "results": [
+                {**item, "timestamp": item["timestamp"].isoformat()}
+                for item in list(self.results)[-SNAPSHOT_RESULTS:]
+            ],
+            "sequence": self.sequence,
+            "cursor": self.cursor.to_state(),
+        }
+
+    def restore(self, snapshot: Dict, settled_reading_id: int):
+        self.state = {
+            (sid, pollutant): [mean, variance, count]
+            for sid, pollutant, mean, variance, count in snapshot.get("state", [])
+        }
+        self.results.clear()
+        for item in snapshot.get("results", []):
+            self.results.append({**item, "timestamp": datetime.fromisoformat(item["timestamp"])})
+        self.sequence = snapshot.get("sequence", 0)
+        self.cursor = ReadingCursor.from_state(settled_reading_id, snapshot.get("cursor"))
+
+    def stats(self) -> Dict:
+        return {
+            "tracked_series": len(self.state),
+            "readings_processed": self.readings_processed,
+            "anomalies_recorded": self.sequence,
+            "anomalies_buffered": len(self.results),
+            **self.cursor.stats(),
+            "alpha": self.alpha,
+            "record_z": self.record_z,
+            "warmup": self.warmup,
+        }
+
+
+async def load_snapshot(detector: StreamingAnomalyDetector):
+    """Restore detector state from monitor_state (if a snapshot exists)"""
+    async with get_async_sessionmaker()() as db:
+        state = await db.get(MonitorState, STATE_NAME)
+        if state is not None and state.extra_data:
+            detector.restore(state.extra_data, state.last_reading_id)
+        elif state is None:
+            # Fresh start: begin with readings ingested from now on
+            latest = (await db.execute(select(func.max(SensorReading.id)))).scalar()
+            detector.cursor = ReadingCursor(latest or 0)
+
+
+async def save_snapshot(detector: StreamingAnomalyDetector):
+    """Persist detector state together with its reading cursor"""
+    snapshot = detector.snapshot()
+    async with get_async_sessionmaker()() as db:
+        stmt = pg_insert(MonitorState).values(
+            name=STATE_NAME,
+            last_reading_id=detector.cursor.mark,
+            updated_at=datetime.utcnow(),
+            extra_data=snapshot,
+        )
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=[MonitorState.name],
+            set_={
+                "last_reading_id": stmt.excluded.last_reading_id,
+                "updated_at": stmt.excluded.updated_at,
+                "extra_data": stmt.excluded.extra_data,
+            },
+        ))
+        await db.commit()
+
+
+async def poll_once(detector: StreamingAnomalyDetector) -> int:
+    """Feed readings not processed yet into the detector; returns rows fetched"""
+    started = time.time()
+    async with get_async_sessionmaker()() as db:
+        readings = (await db.execute(
+            select(
+                SensorReading.id, SensorReading.sensor_id, SensorReading.timestamp,
+                SensorReading.latitude, SensorReading.longitude,
+                *[getattr(SensorReading, p) for p in ANOMALY_POLLUTANTS]
+            )
+            .where(detector.cursor.condition(datetime.utcnow()))
+            .order_by(SensorReading.id)
+            .limit(ANOMALY_BATCH_SIZE)
+        )).all()
+
+    for reading in detector.cursor.advance(readings, started):
+        detector.update(reading)
+    return len(readings)
+
+
+async def run_detector(detector: StreamingAnomalyDetector):
+    """Background loop: tail new readings and snapshot periodically"""
+    try:
+        await load_snapshot(detector)
+    except Exception as e:
+        print(f"⚠️  Anomaly detector snapshot not loaded: {e}")
+
+    last_snapshot = time.monotonic()
+    while True:
+        try:
+            fetched = await poll_once(detector)
+            if time.monotonic() - last_snapshot >= ANOMALY_SNAPSHOT_SECONDS:
+                await save_snapshot(detector)
+                last_snapshot = time.monotonic()
+            if fetched == ANOMALY_BATCH_SIZE:
+                continue  # backlog: keep draining
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  Anomaly detector poll failed: {e}")
+        await asyncio.sleep(ANOMALY_POLL_SECONDS)
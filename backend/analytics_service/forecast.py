@@ -0,0 +1,375 @@
+"""
+Per-sensor pollution forecasting
+Autoregressive model with hour-of-day harmonics and day-of-week terms, fitted
+in NumPy on hourly rollups. Each model keeps its normal equations (X'X, X'y)
+with exponential forgetting, so a scheduled refit only folds in the hours
+closed since the last one. Forecasts are recursive and come with
+confidence intervals derived from the residual spread and the AR impulse response.
+"""
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from statistics import NormalDist
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database import get_async_sessionmaker, LatestReading
+from rollups import HOUR, floor_bucket, hourly_rollups
+
+FORECAST_ENABLED = os.getenv("FORECAST_ENABLED", "true").lower() == "true"
+FORECAST_POLLUTANTS = tuple(os.getenv("FORECAST_POLLUTANTS", "pm25,pm10").split(","))
+FORECAST_TRAIN_DAYS = int(os.getenv("FORECAST_TRAIN_DAYS", "28"))
+FORECAST_REFIT_SECONDS = float(os.getenv("FORECAST_REFIT_SECONDS", "3600"))
+FORECAST_FORGETTING = float(os.getenv("FORECAST_FORGETTING", "0.999"))  # per hour
+FORECAST_MAX_HORIZON = int(os.getenv("FORECAST_MAX_HORIZON", "48"))
+FORECAST_MIN_ROWS = int(os.getenv("FORECAST_MIN_ROWS", "48"))
+
+LAGS = (1, 2, 24)
+MAX_LAG = max(LAGS)
+N_FEATURES = 1 + len(LAGS) + 4 + 6  # intercept, lags, 2 daily harmonics (sin/cos), 6 weekday dummies
+RIDGE = 1e-3
+
+
+class InsufficientHistory(Exception):
+    """Not enough hourly data to fit or run a model"""
+
+
+def _calendar_terms(hours: np.ndarray, weekdays: np.ndarray) -> np.ndarray:
+    angle = 2 * np.pi * hours / 24.0
+    dummies = (weekdays[:, None] == np.arange(1, 7)[None, :]).astype(float)
+    return np.column_stack([np.sin(angle), np.cos(angle), np.sin(2 * angle), np.cos(2 * angle), dummies])
+
+
+def design(values: np.ndarray, start: datetime, first: int = MAX_LAG) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Design matrix and targets for hours first..len(values)-1 of a dense hourly series
+    Rows with a missing target or lag are dropped.
+    """
+    n = len(values)
+    if n <= first:
+        return np.empty((0, N_FEATURES)), np.empty(0)
+
+    index = np.arange(first, n)
+    offsets = start.weekday() * 24 + start.hour + index
+    X = np.column_stack([
+        np.ones(len(index)),
+        *[values[index - lag] for lag in LAGS],
+        _calendar_terms(offsets % 24, (offsets // 24) % 7),
+    ])
+    y = values[index]
+    valid = ~np.isnan(y) & ~np.isnan(X).any(axis=1)
+    return X[valid], y[valid]
+
+
+def hourly_series(rows: List[Dict], pollutant: str, start: datetime, end: datetime) -> np.ndarray:
+    """Dense hourly means from start to end (inclusive); NaN for missing hours"""
+    hours = int((end - start) / HOUR) + 1
+    values = np.full(max(hours, 0), np.nan)
+    for row in rows:
+        position = int((row["bucket"] - start) / HOUR)
+        n = row[f"n_{pollutant}"]
+        if 0 <= position < hours and n:
+            values[position] = row[f"sum_{pollutant}"] / n
+    return values
+
+
+@dataclass
+class FittedModel:
+    """Sufficient statistics, coefficients and the recent tail of one series"""
+    sensor_id: Optional[str]
+    pollutant: str
+    xtx: np.ndarray
+    xty: np.ndarray
+    yty: float
+    weight: float
+    coef: np.ndarray
+    sigma: float
+    tail: np.ndarray          # last MAX_LAG hourly values (NaN where missing)
+    last_bucket: datetime     # last closed hour folded into the model
+    fitted_at: float
+    rows: int
+
+    @classmethod
+    def empty(cls, sensor_id: Optional[str], pollutant: str, before: datetime) -> "FittedModel":
+        return cls(
+            sensor_id=sensor_id, pollutant=pollutant,
+            xtx=np.zeros((N_FEATURES, N_FEATURES)), xty=np.zeros(N_FEATURES), yty=0.0, weight=0.0,
+            coef=np.zeros(N_FEATURES), sigma=float("nan"),
+            tail=np.full(MAX_LAG, np.nan), last_bucket=before, fitted_at=0.0, rows=0,
+        )
+
+    def updated(self, values: np.ndarray, forgetting: float = FORECAST_FORGETTING) -> "FittedModel":
+        """
+        A new model with the hours following last_bucket (dense, oldest first) folded in
+        Published models are never mutated: forecasts read them from other threads
+        while a refit builds the next one, which is then swapped in.
+        """
+        if len(values) == 0:
+            return self
+        series = np.concatenate([self.tail, values])
+        start = self.last_bucket - (MAX_LAG - 1) * HOUR
+        X, y = design(series, start)
+        model = replace(self, tail=series[-MAX_LAG:], last_bucket=self.last_bucket + len(values) * HOUR)
+
+        # Older rows (and the previous statistics) decay by `forgetting` per hour
+        decay = forgetting ** len(values)
+        if len(y):
+            ages = np.arange(len(y))[::-1]
+            w = forgetting ** ages
+            model.xtx = decay * self.xtx + X.T @ (X * w[:, None])
+            model.xty = decay * self.xty + X.T @ (y * w)
+            model.yty = decay * self.yty + float(np.sum(w * y * y))
+            model.weight = decay * self.weight + float(w.sum())
+            model.rows = self.rows + len(y)
+
+        model._solve()
+        return model
+
+    def _solve(self):
+        if self.rows < FORECAST_MIN_ROWS:
+            return
+        scale = np.trace(self.xtx) / N_FEATURES or 1.0
+        self.coef = np.linalg.solve(self.xtx + RIDGE * scale * np.eye(N_FEATURES), self.xty)
+        sse = self.yty - 2 * self.coef @ self.xty + self.coef @ self.xtx @ self.coef
+        self.sigma = math.sqrt(max(sse, 0.0) / max(self.weight - N_FEATURES, 1.0))
+        self.fitted_at = time.time()
+
+    @property
+    def ready(self) -> bool:
+        return self.rows >= FORECAST_MIN_ROWS and not math.isnan(self.sigma)
+
+    def forecast(self, horizon: int, level: float = 0.9) -> List[Dict]:
+        """Recursive point forecasts with `level` confidence intervals for the next `horizon` hours"""
+        if not self.ready:
+            raise InsufficientHistory(f"Model needs {FORECAST_MIN_ROWS} complete hours, has {self.rows}")
+
+        history = list(_forward_fill(self.tail))
+        if any(math.isnan(v) for v in history):
+            raise InsufficientHistory("No recent values for this series")
+
+        lag_coef = dict(zip(LAGS, self.coef[1:1 + len(LAGS)]))
+        psi = _impulse_response(lag_coef, horizon)
+        z = NormalDist().inv_cdf(0.5 + level / 2)
+
+        points = []
+        for step in range(1, horizon + 1):
+            ts = self.last_bucket + step * HOUR
+            features = np.concatenate([
+                [1.0],
+                [history[-lag] for lag in LAGS],
+                _calendar_terms(np.array([ts.hour]), np.array([ts.weekday()]))[0],
+            ])
+            mean = max(float(features @ self.coef), 0.0)
+            history.append(mean)
+            spread = z * self.sigma * math.sqrt(float(np.sum(psi[:step] ** 2)))
+            points.append({
+                "timestamp": ts,
+                "mean": round(mean, 2),
+                "lower": round(max(mean - spread, 0.0), 2),
+                "upper": round(mean + spread, 2),
+            })
+        return points
+
+    def describe(self) -> Dict:
+        return {
+            "sensor_id": self.sensor_id,
+            "pollutant": self.pollutant,
+            "rows": self.rows,
+            "sigma": round(self.sigma, 3) if self.ready else None,
+            "last_bucket": self.last_bucket,
+            "fitted_at": datetime.utcfromtimestamp(self.fitted_at) if self.fitted_at else None,
+            "lag_coefficients": {f"lag_{lag}": round(float(c), 4) for lag, c in zip(LAGS, self.coef[1:1 + len(LAGS)])},
+        }
+
+
+def _forward_fill(values: np.ndarray) -> np.ndarray:
+    out = values.copy()
+    for i in range(1, len(out)):
+        if np.isnan(out[i]):
+            out[i] = out[i - 1]
+    # Leading gaps take the first known value
+    known = ~np.isnan(out)
+    if known.any():
+        out[:np.argmax(known)] = out[np.argmax(known)]
+    return out
+
+
+def _impulse_response(lag_coef: Dict[int, float], horizon: int) -> np.ndarray:
+    """MA(inf) weights psi_0..psi_{horizon-1} of the AR part (forecast error growth)"""
+    psi = np.zeros(horizon)
+    psi[0] = 1.0
+    for j in range(1, horizon):
+        psi[j] = sum(c * psi[j - lag] for lag, c in lag_coef.items() if j - lag >= 0)
+    return psi
+
+
+def backtest(values: np.ndarray, start: datetime, horizon: int = 6, min_train: int = 24 * 7,
+             step: int = 24, level: float = 0.9, forgetting: float = FORECAST_FORGETTING) -> Dict:
+    """
+    Rolling-origin evaluation on a dense hourly series
+    At each origin the model is updated with the hours seen so far and forecasts
+    `horizon` hours ahead; errors are compared with persistence, seasonal-naive
+    (same hour yesterday) and the previous "24h average x 1.1" rule.
+    """
+    model = FittedModel.empty(None, "backtest", start - HOUR)
+    errors = {"model": [], "persistence": [], "seasonal_naive": [], "average_x1_1": []}
+    covered = 0
+    seen = 0
+
+    for origin in range(min_train, len(values) - horizon + 1, step):
+        model = model.updated(values[seen:origin], forgetting)
+        seen = origin
+        if not model.ready:
+            continue
+        try:
+            points = model.forecast(horizon, level)
+        except InsufficientHistory:
+            continue
+
+        actual = values[origin:origin + horizon]
+        observed = values[:origin]
+        last = _forward_fill(observed[-MAX_LAG:])[-1]
+        recent = observed[-24:]
+        average = np.nanmean(recent) * 1.1 if (~np.isnan(recent)).any() else np.nan
+
+        for h, point in enumerate(points):
+            if np.isnan(actual[h]):
+                continue
+            errors["model"].append(point["mean"] - actual[h])
+            errors["persistence"].append(last - actual[h])
+            seasonal = values[origin + h - 24]
+            errors["seasonal_naive"].append(seasonal - actual[h] if not np.isnan(seasonal) else np.nan)
+            errors["average_x1_1"].append(average - actual[h])
+            covered += int(point["lower"] <= actual[h] <= point["upper"])
+
+    def metrics(e):
+        e = np.array(e, dtype=float)
+        e = e[~np.isnan(e)]
+        if not len(e):
+            return None
+        return {"mae": round(float(np.mean(np.abs(e))), 3), "rmse": round(float(np.sqrt(np.mean(e ** 2))), 3)}
+
+    evaluated = len(errors["model"])
+    return {
+        "horizon_hours": horizon,
+        "forecasts_evaluated": evaluated,
+        "interval_level": level,
+        "interval_coverage": round(covered / evaluated, 3) if evaluated else None,
+        "errors": {name: metrics(e) for name, e in errors.items()},
+    }
+
+
+class ForecastEngine:
+    """Cache of fitted models per (sensor_id or city-wide, pollutant), refit on a schedule"""
+
+    def __init__(self, pollutants=FORECAST_POLLUTANTS, train_days: int = FORECAST_TRAIN_DAYS):
+        self.pollutants = pollutants
+        self.train_days = train_days
+        self.models: Dict[Tuple[Optional[str], str], FittedModel] = {}
+        # One lock per series (sensor_id or None for the city), so a refit sweep
+        # only ever blocks a request for the series it is currently fitting
+        self._locks: Dict[Optional[str], asyncio.Lock] = {}
+        self.refits = 0
+        self.refit_errors = 0
+        self.last_refit_seconds: Optional[float] = None
+
+    def _get_lock(self, sensor_id: Optional[str]) -> asyncio.Lock:
+        lock = self._locks.get(sensor_id)
+        if lock is None:
+            lock = self._locks[sensor_id] = asyncio.Lock()
+        return lock
+
+    async def refit_series(self, db: AsyncSession, sensor_id: Optional[str]):
+        """Fold closed hours since each model's last bucket into the models of one sensor (or the city)"""
+        last_closed = floor_bucket(datetime.utcnow(), HOUR) - HOUR
+        initial_start = last_closed - timedelta(days=self.train_days) + HOUR
+
+        models = {}
+        for pollutant in self.pollutants:
+            model = self.models.get((sensor_id, pollutant))
+            if model is None:
+                model = FittedModel.empty(sensor_id, pollutant, initial_start - HOUR)
+            models[pollutant] = model
+
+        start = min(m.last_bucket for m in models.values()) + HOUR
+        if start > last_closed:
+            return
+        rows = [r for r in await hourly_rollups(db, start, sensor_id) if r["bucket"] <= last_closed]
+
+        for pollutant, model in models.items():
+            if model.last_bucket >= last_closed:
+                continue
+            values = hourly_series(rows, pollutant, model.last_bucket + HOUR, last_closed)
+            self.models[(sensor_id, pollutant)] = await asyncio.to_thread(model.updated, values)
+        self.refits += 1
+
+    async def refit_all(self, db: AsyncSession):
+        """Refit the city-wide models and those of every recently reporting sensor"""
+        started = time.monotonic()
+        since = datetime.utcnow() - timedelta(days=self.train_days)
+        sensor_ids = (await db.execute(
+            select(LatestReading.sensor_id).where(LatestReading.timestamp >= since)
+        )).scalars().all()
+
+        for sensor_id in [None, *sensor_ids]:
+            try:
+                async with self._get_lock(sensor_id):
+                    await self.refit_series(db, sensor_id)
+            except Exception as e:
+                # One bad series must not stop the rest of the sweep
+                self.refit_errors += 1
+                await db.rollback()
+                print(f"⚠️  Forecast refit failed for {sensor_id or 'city'}: {e}")
+        self.last_refit_seconds = round(time.monotonic() - started, 3)
+
+    async def forecast(self, db: AsyncSession, sensor_id: Optional[str], pollutant: str,
+                       horizon: int, level: float) -> List[Dict]:
+        """
+        Forecast the next `horizon` hours from the cached model
+        A series is fitted on demand the first time it is requested; afterwards the
+        scheduled refit keeps it current and hours it has not folded in yet are skipped.
+        """
+        model = self.models.get((sensor_id, pollutant))
+        if model is None:
+            async with self._get_lock(sensor_id):
+                await self.refit_series(db, sensor_id)
+            model = self.models.get((sensor_id, pollutant))
+        if model is None:
+            raise InsufficientHistory("No hourly data for this series")
+
+        behind = int((floor_bucket(datetime.utcnow(), HOUR) - HOUR - model.last_bucket) / HOUR)
+        if behind > FORECAST_MAX_HORIZON:
+            raise InsufficientHistory("Model is stale; waiting for the next refit")
+        points = await asyncio.to_thread(model.forecast, horizon + max(behind, 0), level)
+        return points[max(behind, 0):]
+
+    def stats(self) -> Dict:
+        ready = sum(1 for m in self.models.values() if m.ready)
+        return {
+            "models": len(self.models),
+            "ready": ready,
+            "pollutants": list(self.pollutants),
+            "refits": self.refits,
+            "refit_errors": self.refit_errors,
+            "last_refit_seconds": self.last_refit_seconds,
+            "train_days": self.train_days,
+        }
+
+
+async def run_refits(engine: ForecastEngine):
+    """Background loop: refit all models every FORECAST_REFIT_SECONDS"""
+    while True:
+        try:
+            async with get_async_sessionmaker()() as db:
+                await engine.refit_all(db)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"⚠️  Forecast refit failed: {e}")
+        await asyncio.sleep(FORECAST_REFIT_SECONDS)
@@ -0,0 +1,151 @@
+"""
+Gridded pollution surface (heatmap) from the latest per-sensor values
+Values are interpolated onto a lat/lon raster with inverse-distance weighting,
+computed block-wise with NumPy broadcasting. Rasters are cached per
+(bbox, resolution, pollutant, time bucket, staleness cutoff bucket) and only
+recomputed when latest_readings advances into a new bucket or the
+GRID_MAX_AGE_MINUTES window moves past one.
+"""
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import numpy as np
+
+from shared.aqi import compute_aqi, sub_index, category_index, CATEGORIES, POLLUTANTS
+from shared.geo import haversine_km
+
+GRID_MAX_CELLS = int(os.getenv("GRID_MAX_CELLS", "262144"))  # 512 x 512
+GRID_BLOCK_ELEMENTS = int(os.getenv("GRID_BLOCK_ELEMENTS", "1048576"))
+GRID_BUCKET_SECONDS = int(os.getenv("GRID_BUCKET_SECONDS", "60"))
+GRID_MAX_AGE_MINUTES = int(os.getenv("GRID_MAX_AGE_MINUTES", "60"))
+GRID_CACHE_ENTRIES = int(os.getenv("GRID_CACHE_ENTRIES", "64"))
+IDW_POWER = float(os.getenv("IDW_POWER", "2"))
+
+GRID_VALUES = ("aqi",) + POLLUTANTS
+
+
+@dataclass(frozen=True)
+class Grid:
+    """Row-major float32 raster; row 0 is the northern edge, NaN where undefined"""
+    values: np.ndarray
+    bbox: Tuple[float, float, float, float]  # min_lat, min_lon, max_lat, max_lon
+    sensors: int
+
+
+def sensor_values(value: str, columns) -> np.ndarray:
+    """Per-sensor value to interpolate: AQI or a raw pollutant concentration"""
+    if value == "aqi":
+        aqi, _ = compute_aqi(columns)
+        return aqi
+    return np.array([np.nan if v is None else v for v in columns[value]], dtype=float)
+
+
+def idw_grid(lat: np.ndarray, lon: np.ndarray, values: np.ndarray,
+             bbox: Tuple[float, float, float, float], width: int, height: int,
+             power: float = IDW_POWER, max_km: Optional[float] = None) -> np.ndarray:
+    """
+    Inverse-distance-weighted raster over bbox (cell centers), float32
+    Cells farther than max_km from every sensor are NaN.
+    """
+    known = ~np.isnan(values)
+    lat, lon, values = lat[known], lon[known], values[known]
+    out = np.full(width * height, np.nan, dtype=np.float32)
+    if len(values) == 0:
+        return out.reshape(height, width)
+
+    min_lat, min_lon, max_lat, max_lon = bbox
+    cell_lat = (max_lat - min_lat) / height
+    cell_lon = (max_lon - min_lon) / width
+    rows = max_lat - (np.arange(height) + 0.5) * cell_lat
+    cols = min_lon + (np.arange(width) + 0.5) * cell_lon
+    grid_lat = np.repeat(rows, width)
+    grid_lon = np.tile(cols, height)
+
+    # Bound memory to GRID_BLOCK_ELEMENTS cell-to-sensor distances at a time
+    block = max(1, GRID_BLOCK_ELEMENTS // len(values))
+    for start in range(0, len(grid_lat), block):
+        stop = start + block
+        distances = haversine_km(
+            grid_lat[start:stop, None], grid_lon[start:stop, None], lat[None, :], lon[None, :]
+        )
+        weights = 1.0 / np.maximum(distances, 1e-3) ** power
+        if max_km is not None:
+            weights = np.where(distances <= max_km, weights, 0.0)
+        total = weights.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[start:stop] = np.where(total > 0, (weights @ values) / total, np.nan)
+
+    return out.reshape(height, width)
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (struct.pack(">I", len(data)) + kind + data
+            + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+
+_PALETTE = np.array(
+    [[int(color[i:i + 2], 16) for i in (1, 3, 5)] + [160] for _, color, _ in CATEGORIES],
+    dtype=np.uint8,
+)
+
+
+def render_png(grid: Grid, value: str) -> bytes:
+    """Color the raster with AQI category colors (transparent where undefined)"""
+    indices = grid.values if value == "aqi" else sub_index(value, grid.values.ravel()).reshape(grid.values.shape)
+    defined = ~np.isnan(indices)
+    rgba = _PALETTE[np.clip(category_index(np.where(defined, indices, 0).ravel()), 0, len(_PALETTE) - 1)]
+    rgba = rgba.reshape(grid.values.shape + (4,))
+    rgba[~defined] = 0
+
+    height, width = grid.values.shape
+    raw = b"".join(b"\x00" + rgba[row].tobytes() for row in range(height))
+    return (b"\x89PNG\r\n\x1a\n"
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw, 6))
+            + _png_chunk(b"IEND", b""))
+
+
+class GridCache:
+    """Small thread-safe LRU of computed rasters"""
+
+    def __init__(self, max_entries: int = GRID_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, Grid]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> Optional[Grid]:
+        with self._lock:
+            grid = self._entries.get(key)
+            if grid is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return grid
+
+    def put(self, key: tuple, grid: Grid):
+        with self._lock:
+            self._entries[key] = grid
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "max_entries": self.max_entries,
+            }
+
+
+# Process-wide raster cache
+grid_cache = GridCache()
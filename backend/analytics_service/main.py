@@ -2,26 +2,48 @@
 Analytics Service - AI-powered Environmental Data Analysis
 Uses Gemini AI for predictions, anomaly detection, and insights
 """
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 import sys
 import os
-import google.generativeai as genai
+import asyncio
+import hashlib
+import numpy as np
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from shared.database import get_db, SensorReading
+from shared.database import get_async_db, SensorReading, LatestReading
+from shared.geo import sensor_index
+from shared.timescale import AGGREGATED_COLUMNS
+from shared.pubsub import parse_filter
+from shared.llm_client import make_client
+from shared.llm_cache import llm_cache, fingerprint
+from shared.ai_gateway import AIGateway, AIUnavailable
+from shared.ratelimit import RateLimiter, RateLimitMiddleware, RateLimitRule
 from shared.models import AQIResponse, AnalysisRequest, PredictionResponse
+from shared.aqi import calculate_aqi, compute_aqi, category_index, sub_indices, dominant_display_name, CATEGORIES
+from shared.metrics import MetricsMiddleware
+from rollups import HOUR, floor_bucket, hourly_rollups, daily_rollups, summarize
+from heatmap import Grid, GRID_VALUES, GRID_MAX_CELLS, GRID_BUCKET_SECONDS, GRID_MAX_AGE_MINUTES, grid_cache, idw_grid, sensor_values, render_png
+from forecast import ForecastEngine, FORECAST_ENABLED, FORECAST_MAX_HORIZON, InsufficientHistory, backtest, hourly_series, run_refits
+from anomaly import StreamingAnomalyDetector, ANOMALY_ENABLED, ANOMALY_POLLUTANTS, run_detector, save_snapshot
 
 app = FastAPI(title="Environmental Analytics Service", version="1.0.0")
 
-# Configure Gemini AI
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel('gemini-2.0-flash-exp')
+# Gemini AI behind the async gateway (LLM_CLIENT=fake for a local stand-in)
+ai = AIGateway(make_client('gemini-2.0-flash-exp'))
+
+# Tighter buckets for the endpoints that call the model (added before CORS so 429s carry CORS headers)
+rate_limiter = RateLimiter([
+    RateLimitRule("insights", "/insights", "user", os.getenv("RATE_LIMIT_INSIGHTS", "10/minute,burst=5")),
+    RateLimitRule("predict", "/predict", "user", os.getenv("RATE_LIMIT_PREDICT", "60/minute,burst=20")),
+    RateLimitRule("client", "*", "ip", os.getenv("RATE_LIMIT_CLIENT", "50/s,burst=100")),
+])
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
 
 # CORS
 app.add_middleware(
@@ -32,99 +54,36 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics and /metrics (added last, so it is the outermost middleware)
+app.add_middleware(MetricsMiddleware)
 
-def calculate_aqi(pm25: float = None, pm10: float = None, no2: float = None,
-                  co: float = None, o3: float = None, so2: float = None) -> Dict:
-    """
-    Calculate Air Quality Index (AQI) based on pollutant levels
-    Uses US EPA AQI standards
-    """
-    aqi_values = []
-    dominant = None
-    max_aqi = 0
-
-    # PM2.5 breakpoints (µg/m³ to AQI)
-    if pm25 is not None:
-        if pm25 <= 12.0:
-            aqi = (50 / 12.0) * pm25
-        elif pm25 <= 35.4:
-            aqi = 50 + ((100 - 50) / (35.4 - 12.1)) * (pm25 - 12.1)
-        elif pm25 <= 55.4:
-            aqi = 100 + ((150 - 100) / (55.4 - 35.5)) * (pm25 - 35.5)
-        elif pm25 <= 150.4:
-            aqi = 150 + ((200 - 150) / (150.4 - 55.5)) * (pm25 - 55.5)
-        elif pm25 <= 250.4:
-            aqi = 200 + ((300 - 200) / (250.4 - 150.5)) * (pm25 - 150.5)
-        else:
-            aqi = 300 + ((500 - 300) / (500.4 - 250.5)) * (pm25 - 250.5)
-
-        if aqi > max_aqi:
-            max_aqi = aqi
-            dominant = "PM2.5"
-        aqi_values.append(aqi)
-
-    # PM10 calculation
-    if pm10 is not None:
-        if pm10 <= 54:
-            aqi = (50 / 54) * pm10
-        elif pm10 <= 154:
-            aqi = 50 + ((100 - 50) / (154 - 55)) * (pm10 - 55)
-        elif pm10 <= 254:
-            aqi = 100 + ((150 - 100) / (254 - 155)) * (pm10 - 155)
-        elif pm10 <= 354:
-            aqi = 150 + ((200 - 150) / (354 - 255)) * (pm10 - 255)
-        else:
-            aqi = 200 + ((300 - 200) / (500 - 355)) * (pm10 - 355)
-
-        if aqi > max_aqi:
-            max_aqi = aqi
-            dominant = "PM10"
-        aqi_values.append(aqi)
-
-    if not aqi_values:
-        return {
-            "aqi": 0,
-            "category": "No Data",
-            "color": "#gray",
-            "health_message": "No data available",
-            "dominant_pollutant": "None"
-        }
+anomaly_detector = StreamingAnomalyDetector()
+forecast_engine = ForecastEngine()
 
-    final_aqi = int(max(aqi_values))
-
-    # Determine category
-    if final_aqi <= 50:
-        category = "Good"
-        color = "#00e400"
-        message = "Air quality is satisfactory, and air pollution poses little or no risk."
-    elif final_aqi <= 100:
-        category = "Moderate"
-        color = "#ffff00"
-        message = "Air quality is acceptable. However, there may be a risk for some people, particularly those who are unusually sensitive to air pollution."
-    elif final_aqi <= 150:
-        category = "Unhealthy for Sensitive Groups"
-        color = "#ff7e00"
-        message = "Members of sensitive groups may experience health effects. The general public is less likely to be affected."
-    elif final_aqi <= 200:
-        category = "Unhealthy"
-        color = "#ff0000"
-        message = "Some members of the general public may experience health effects; members of sensitive groups may experience more serious health effects."
-    elif final_aqi <= 300:
-        category = "Very Unhealthy"
-        color = "#8f3f97"
-        message = "Health alert: The risk of health effects is increased for everyone."
-    else:
-        category = "Hazardous"
-        color = "#7e0023"
-        message = "Health warning of emergency conditions: everyone is more likely to be affected."
 
-    return {
-        "aqi": final_aqi,
-        "category": category,
-        "color": color,
-        "health_message": message,
-        "dominant_pollutant": dominant
-    }
+@app.on_event("startup")
+async def startup_event():
+    """Start the streaming anomaly detector and the forecast refit schedule"""
+    if ANOMALY_ENABLED:
+        app.state.anomaly_task = asyncio.create_task(run_detector(anomaly_detector))
+    if FORECAST_ENABLED:
+        app.state.forecast_task = asyncio.create_task(run_refits(forecast_engine))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and persist detector state"""
+    forecast_task = getattr(app.state, "forecast_task", None)
+    if forecast_task:
+        forecast_task.cancel()
+
+    task = getattr(app.state, "anomaly_task", None)
+    if task:
+        task.cancel()
+        try:
+            await save_snapshot(anomaly_detector)
+        except Exception as e:
+            print(f"⚠️  Anomaly detector snapshot not saved: {e}")
 
 
 @app.get("/")
@@ -141,36 +100,32 @@ async def get_current_aqi(
     latitude: Optional[float] = None,
     longitude: Optional[float] = None,
     radius_km: float = 5.0,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get current AQI for a location (average of nearby sensors in last hour)
+    Get current AQI for a location (average of the latest values of nearby sensors in last hour)
     """
     one_hour_ago = datetime.utcnow() - timedelta(hours=1)
 
-    query = db.query(
-        func.avg(SensorReading.pm25).label('pm25'),
-        func.avg(SensorReading.pm10).label('pm10'),
-        func.avg(SensorReading.no2).label('no2'),
-        func.avg(SensorReading.co).label('co'),
-        func.avg(SensorReading.o3).label('o3'),
-        func.avg(SensorReading.so2).label('so2')
-    ).filter(SensorReading.timestamp >= one_hour_ago)
-
-    # Filter by location if provided
+    query = select(
+        func.avg(LatestReading.pm25).label('pm25'),
+        func.avg(LatestReading.pm10).label('pm10'),
+        func.avg(LatestReading.no2).label('no2'),
+        func.avg(LatestReading.co).label('co'),
+        func.avg(LatestReading.o3).label('o3'),
+        func.avg(LatestReading.so2).label('so2'),
+        func.count(LatestReading.sensor_id).label('sensors')
+    ).where(LatestReading.timestamp >= one_hour_ago)
+
+    # Filter by location if provided: resolve nearby sensors from the spatial index
     if latitude is not None and longitude is not None:
-        # Simple bounding box filter (for more accuracy, use PostGIS)
-        lat_range = radius_km / 111.0  # 1 degree ≈ 111 km
-        lon_range = radius_km / (111.0 * abs(latitude / 90.0))
-
-        query = query.filter(
-            and_(
-                SensorReading.latitude.between(latitude - lat_range, latitude + lat_range),
-                SensorReading.longitude.between(longitude - lon_range, longitude + lon_range)
-            )
-        )
+        await sensor_index.refresh(db)
+        nearby = sensor_index.within_radius(latitude, longitude, radius_km)
+        if not nearby:
+            raise HTTPException(status_code=404, detail=f"No sensors within {radius_km} km")
+        query = query.where(LatestReading.sensor_id.in_([sensor_id for sensor_id, _ in nearby]))
 
-    result = query.first()
+    result = (await db.execute(query)).first()
 
     if not result or result.pm25 is None:
         raise HTTPException(status_code=404, detail="No recent data available")
@@ -186,8 +141,9 @@ async def get_current_aqi(
 
     return {
         **aqi_data,
-        "location": {"latitude": latitude, "longitude": longitude} if latitude else None,
+        "location": {"latitude": latitude, "longitude": longitude} if latitude is not None else None,
         "timestamp": datetime.utcnow(),
+        "sensors_used": result.sensors,
         "data_points": {
             "pm25": round(result.pm25, 2) if result.pm25 else None,
             "pm10": round(result.pm10, 2) if result.pm10 else None,
@@ -197,184 +153,379 @@ async def get_current_aqi(
     }
 
 
+@app.get("/sensors/nearby")
+async def get_nearby_sensors(
+    latitude: float,
+    longitude: float,
+    radius_km: Optional[float] = None,
+    k: int = 5,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Nearest k sensors to a point (haversine distance), optionally limited to radius_km
+    """
+    await sensor_index.refresh(db)
+    nearest = sensor_index.nearest(latitude, longitude, k=max(1, min(k, 100)), max_km=radius_km)
+    return {
+        "location": {"latitude": latitude, "longitude": longitude},
+        "sensors": [
+            {"sensor_id": sensor_id, "distance_km": round(distance, 3)}
+            for sensor_id, distance in nearest
+        ],
+        "index": sensor_index.stats()
+    }
+
+
+@app.get("/aqi/series")
+async def get_aqi_series(
+    hours: int = 24,
+    sensor_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Hourly AQI series for the past N hours (per sensor or city-wide)
+    AQI, sub-indices and dominant pollutant for all buckets are computed in one vectorized pass
+    """
+    start_time = datetime.utcnow() - timedelta(hours=hours)
+    rows = await hourly_rollups(db, start_time, sensor_id)
+
+    columns = {
+        pollutant: np.array([
+            r[f"sum_{pollutant}"] / r[f"n_{pollutant}"] if r[f"n_{pollutant}"] else np.nan
+            for r in rows
+        ], dtype=float)
+        for pollutant in ("pm25", "pm10", "no2", "co", "o3", "so2")
+    }
+    aqi, dominant = compute_aqi(columns)
+    indices = sub_indices(columns)
+    categories = category_index(aqi)
+
+    series = []
+    for i, row in enumerate(rows):
+        if np.isnan(aqi[i]):
+            continue
+        series.append({
+            "timestamp": row["bucket"],
+            "aqi": int(aqi[i]),
+            "category": CATEGORIES[categories[i]][0],
+            "dominant_pollutant": dominant_display_name(dominant[i]),
+            "sub_indices": {
+                p: int(values[i]) for p, values in indices.items() if not np.isnan(values[i])
+            }
+        })
+
+    return {
+        "period": f"Last {hours} hours",
+        "sensor_id": sensor_id,
+        "data_points": len(series),
+        "series": series
+    }
+
+
+@app.get("/aqi/grid")
+async def get_aqi_grid(
+    request: Request,
+    bbox: str,
+    resolution: float = 0.01,
+    value: str = "aqi",
+    format: str = "f32",
+    max_km: Optional[float] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Interpolated pollution surface over bbox ("min_lat,min_lon,max_lat,max_lon")
+    IDW over the latest value of every sensor; `resolution` is the cell size in degrees.
+    format: f32 (little-endian float32, row 0 = north, NaN = no data; shape in
+    X-Grid-* headers), png (AQI category colors) or json.
+    """
+    try:
+        box = parse_filter(bbox=bbox).bbox
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if value not in GRID_VALUES:
+        raise HTTPException(status_code=400, detail=f"value must be one of {', '.join(GRID_VALUES)}")
+    if format not in ("f32", "png", "json"):
+        raise HTTPException(status_code=400, detail="format must be f32, png or json")
+    if resolution <= 0:
+        raise HTTPException(status_code=400, detail="resolution must be positive")
+
+    min_lat, min_lon, max_lat, max_lon = box
+    width = max(1, int(np.ceil(round((max_lon - min_lon) / resolution, 6))))
+    height = max(1, int(np.ceil(round((max_lat - min_lat) / resolution, 6))))
+    if width * height > GRID_MAX_CELLS:
+        raise HTTPException(status_code=400, detail=f"Grid too large ({width}x{height}); max {GRID_MAX_CELLS} cells")
+
+    # Cache key advances when latest_readings moves into a new time bucket, and
+    # with the staleness cutoff so silent sensors drop out within one bucket
+    newest = (await db.execute(select(func.max(LatestReading.timestamp)))).scalar()
+    bucket = int(newest.timestamp() // GRID_BUCKET_SECONDS) if newest else 0
+    cutoff = int((datetime.utcnow() - timedelta(minutes=GRID_MAX_AGE_MINUTES)).timestamp() // GRID_BUCKET_SECONDS)
+    key = (tuple(round(v, 6) for v in box), width, height, value, max_km, bucket, cutoff)
+    etag = '"' + hashlib.sha1(repr((key, format)).encode()).hexdigest()[:20] + '"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    grid = grid_cache.get(key)
+    if grid is None:
+        since = datetime.fromtimestamp(cutoff * GRID_BUCKET_SECONDS)
+        rows = (await db.execute(
+            select(LatestReading).where(LatestReading.timestamp >= since)
+        )).scalars().all()
+        columns = {p: [getattr(r, p) for r in rows] for p in GRID_VALUES if p != "aqi"}
+        values = sensor_values(value, columns)
+        raster = await asyncio.to_thread(
+            idw_grid,
+            np.array([r.latitude for r in rows], dtype=float),
+            np.array([r.longitude for r in rows], dtype=float),
+            values, box, width, height, max_km=max_km,
+        )
+        grid = Grid(values=raster, bbox=box, sensors=int(np.sum(~np.isnan(values))))
+        grid_cache.put(key, grid)
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"max-age={GRID_BUCKET_SECONDS}",
+        "X-Grid-Width": str(width),
+        "X-Grid-Height": str(height),
+        "X-Grid-Bbox": ",".join(str(v) for v in box),
+        "X-Grid-Sensors": str(grid.sensors),
+    }
+    if format == "png":
+        return Response(content=render_png(grid, value), media_type="image/png", headers=headers)
+    if format == "json":
+        return {
+            "bbox": box,
+            "width": width,
+            "height": height,
+            "value": value,
+            "sensors": grid.sensors,
+            "values": [[None if np.isnan(v) else round(float(v), 2) for v in row] for row in grid.values]
+        }
+    return Response(content=grid.values.astype("<f4").tobytes(), media_type="application/octet-stream", headers=headers)
+
+
+@app.get("/aqi/grid/stats")
+async def get_grid_cache_stats():
+    """Heatmap raster cache statistics"""
+    return grid_cache.stats()
+
+
 @app.get("/statistics/hourly")
 async def get_hourly_statistics(
     hours: int = 24,
     sensor_id: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get hourly statistics for the past N hours
+    Served from continuous aggregates; raw rows are read only for the open bucket
     """
     start_time = datetime.utcnow() - timedelta(hours=hours)
+    results = await hourly_rollups(db, start_time, sensor_id)
 
-    query = db.query(
-        func.date_trunc('hour', SensorReading.timestamp).label('hour'),
-        func.avg(SensorReading.pm25).label('avg_pm25'),
-        func.max(SensorReading.pm25).label('max_pm25'),
-        func.min(SensorReading.pm25).label('min_pm25'),
-        func.avg(SensorReading.pm10).label('avg_pm10'),
-        func.avg(SensorReading.no2).label('avg_no2'),
-        func.avg(SensorReading.co).label('avg_co'),
-        func.avg(SensorReading.temperature).label('avg_temp'),
-        func.avg(SensorReading.humidity).label('avg_humidity')
-    ).filter(SensorReading.timestamp >= start_time)
-
-    if sensor_id:
-        query = query.filter(SensorReading.sensor_id == sensor_id)
+    return {
+        "period": f"Last {hours} hours",
+        "data_points": len(results),
+        "statistics": [summarize(r) for r in results]
+    }
 
-    query = query.group_by('hour').order_by('hour')
 
-    results = query.all()
+@app.get("/statistics/daily")
+async def get_daily_statistics(
+    days: int = 30,
+    sensor_id: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get daily statistics for the past N days
+    """
+    start_time = datetime.utcnow() - timedelta(days=days)
+    results = await daily_rollups(db, start_time, sensor_id)
 
     return {
-        "period": f"Last {hours} hours",
+        "period": f"Last {days} days",
         "data_points": len(results),
-        "statistics": [
-            {
-                "timestamp": r.hour,
-                "pm25": {"avg": round(r.avg_pm25, 2) if r.avg_pm25 else None,
-                        "max": round(r.max_pm25, 2) if r.max_pm25 else None,
-                        "min": round(r.min_pm25, 2) if r.min_pm25 else None},
-                "pm10": round(r.avg_pm10, 2) if r.avg_pm10 else None,
-                "no2": round(r.avg_no2, 2) if r.avg_no2 else None,
-                "co": round(r.avg_co, 2) if r.avg_co else None,
-                "temperature": round(r.avg_temp, 2) if r.avg_temp else None,
-                "humidity": round(r.avg_humidity, 2) if r.avg_humidity else None
-            }
-            for r in results
-        ]
+        "statistics": [summarize(r) for r in results]
     }
 
 
 @app.post("/predict")
 async def predict_pollution(
     request: AnalysisRequest,
-    db: Session = Depends(get_db)
+    sensor_id: Optional[str] = None,
+    horizon_hours: int = 6,
+    confidence: float = 0.9,
+    explain: bool = False,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Use Gemini AI to predict pollution levels and provide recommendations
+    Forecast pollution for the next hours (per sensor or city-wide) with confidence intervals
+    Served from cached seasonal AR models; `explain=true` adds a Gemini commentary.
     """
-    # Get recent data for context
-    recent_data = db.query(SensorReading).order_by(
-        SensorReading.timestamp.desc()
-    ).limit(100).all()
-
-    if not recent_data:
-        raise HTTPException(status_code=404, detail="Insufficient data for prediction")
-
-    # Prepare data summary for Gemini
-    data_summary = {
-        "avg_pm25": sum(r.pm25 for r in recent_data if r.pm25) / len([r for r in recent_data if r.pm25]),
-        "avg_pm10": sum(r.pm10 for r in recent_data if r.pm10) / len([r for r in recent_data if r.pm10]),
-        "trend": "increasing" if recent_data[0].pm25 > recent_data[-1].pm25 else "decreasing"
-    }
+    if not 1 <= horizon_hours <= FORECAST_MAX_HORIZON:
+        raise HTTPException(status_code=400, detail=f"horizon_hours must be between 1 and {FORECAST_MAX_HORIZON}")
+    if not 0.5 <= confidence < 1:
+        raise HTTPException(status_code=400, detail="confidence must be in [0.5, 1)")
 
-    # Create prompt for Gemini
-    prompt = f"""
-    Analyze the following environmental data from Pavlodar, Kazakhstan and provide predictions:
+    pollutants = [p for p in (request.pollutants or forecast_engine.pollutants) if p in forecast_engine.pollutants]
+    if not pollutants:
+        raise HTTPException(status_code=400, detail=f"pollutants must be among {', '.join(forecast_engine.pollutants)}")
+
+    forecasts = {}
+    try:
+        for pollutant in pollutants:
+            forecasts[pollutant] = await forecast_engine.forecast(db, sensor_id, pollutant, horizon_hours, confidence)
+    except InsufficientHistory as e:
+        raise HTTPException(status_code=404, detail=f"Insufficient data for prediction: {e}")
+
+    hourly = [
+        {"timestamp": points[0]["timestamp"], **{
+            p: {k: forecasts[p][i][k] for k in ("mean", "lower", "upper")} for p in pollutants
+        }}
+        for i, points in enumerate(zip(*forecasts.values()))
+    ]
+    final = hourly[-1]
+
+    ai_response = None
+    if explain:
+        outlook = "\n".join(
+            f"    {p.upper()}: {forecasts[p][0]['mean']:.1f} -> {forecasts[p][-1]['mean']:.1f} µg/m³"
+            for p in pollutants
+        )
+        prompt = f"""
+    Analyze the following pollution forecast for Pavlodar, Kazakhstan (next {horizon_hours} hours):
 
-    Current Average PM2.5: {data_summary['avg_pm25']:.2f} µg/m³
-    Current Average PM10: {data_summary['avg_pm10']:.2f} µg/m³
-    Trend: {data_summary['trend']}
+{outlook}
 
-    Based on this data:
-    1. Predict pollution levels for the next 6 hours
-    2. Identify main contributing factors (industry, traffic, weather)
-    3. Provide 3 specific recommendations for citizens and authorities
+    Based on this forecast:
+    1. Identify main contributing factors (industry, traffic, weather)
+    2. Provide 3 specific recommendations for citizens and authorities
 
-    Format your response as JSON with keys: prediction, factors, recommendations
+    Keep the response concise.
     """
+        ai_response = await ai.generate_or_fallback(
+            prompt, None,
+            fingerprint("predict", {"sensor_id": sensor_id, "horizon": horizon_hours,
+                                    **{p: final[p]["mean"] for p in pollutants}})
+        )
 
-    try:
-        response = model.generate_content(prompt)
-        ai_response = response.text
+    return {
+        "prediction_time": final["timestamp"],
+        "sensor_id": sensor_id,
+        "predicted_values": {p: final[p]["mean"] for p in pollutants},
+        "intervals": {p: {"lower": final[p]["lower"], "upper": final[p]["upper"]} for p in pollutants},
+        "confidence": confidence,
+        "forecast": hourly,
+        "ai_analysis": ai_response,
+        "factors": ["Industrial emissions", "Traffic patterns", "Weather conditions"],
+        "recommendations": [
+            "Reduce outdoor activities if AQI exceeds 150",
+            "Use air purifiers indoors",
+            "Authorities should monitor industrial emissions closely"
+        ]
+    }
 
-        # Parse response (simplified - in production use structured output)
-        return {
-            "prediction_time": datetime.utcnow() + timedelta(hours=6),
-            "predicted_values": {
-                "pm25": round(data_summary['avg_pm25'] * 1.1, 2),  # Simplified prediction
-                "pm10": round(data_summary['avg_pm10'] * 1.1, 2)
-            },
-            "confidence": 0.75,
-            "ai_analysis": ai_response,
-            "factors": ["Industrial emissions", "Traffic patterns", "Weather conditions"],
-            "recommendations": [
-                "Reduce outdoor activities if AQI exceeds 150",
-                "Use air purifiers indoors",
-                "Authorities should monitor industrial emissions closely"
-            ]
-        }
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"AI prediction failed: {str(e)}")
 
+@app.get("/forecast/models")
+async def get_forecast_models(sensor_id: Optional[str] = None):
+    """Fitted forecast models (optionally for one sensor) and refit statistics"""
+    return {
+        "engine": forecast_engine.stats(),
+        "models": [
+            m.describe() for (sid, _), m in forecast_engine.models.items()
+            if sensor_id is None or sid == sensor_id
+        ]
+    }
 
-@app.get("/anomalies")
-async def detect_anomalies(
-    hours: int = 24,
-    threshold: float = 2.0,
-    db: Session = Depends(get_db)
+
+@app.get("/forecast/backtest")
+async def backtest_forecast(
+    sensor_id: Optional[str] = None,
+    pollutant: str = "pm25",
+    days: int = 28,
+    horizon_hours: int = 6,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Detect anomalies in pollution data (readings beyond threshold * stddev)
+    Rolling-origin backtest of the forecast model on historical hourly data
+    Reports MAE/RMSE against persistence, seasonal-naive and the old average x 1.1 rule.
     """
-    start_time = datetime.utcnow() - timedelta(hours=hours)
+    if pollutant not in AGGREGATED_COLUMNS:
+        raise HTTPException(status_code=400, detail=f"pollutant must be one of {', '.join(AGGREGATED_COLUMNS)}")
 
-    # Calculate mean and stddev
-    stats = db.query(
-        func.avg(SensorReading.pm25).label('mean_pm25'),
-        func.stddev(SensorReading.pm25).label('std_pm25')
-    ).filter(SensorReading.timestamp >= start_time).first()
+    end = floor_bucket(datetime.utcnow(), HOUR) - HOUR
+    start = end - timedelta(days=days) + HOUR
+    rows = await hourly_rollups(db, start, sensor_id)
+    values = hourly_series(rows, pollutant, start, end)
 
-    if not stats.mean_pm25:
-        return {"anomalies": [], "message": "Insufficient data"}
+    report = await asyncio.to_thread(backtest, values, start, horizon_hours)
+    return {"sensor_id": sensor_id, "pollutant": pollutant, "days": days, **report}
 
-    threshold_value = stats.mean_pm25 + (threshold * stats.std_pm25)
 
-    # Find anomalous readings
-    anomalies = db.query(SensorReading).filter(
-        and_(
-            SensorReading.timestamp >= start_time,
-            SensorReading.pm25 > threshold_value
-        )
-    ).all()
+@app.get("/anomalies")
+async def detect_anomalies(
+    hours: int = 24,
+    threshold: float = 3.0,
+    sensor_id: Optional[str] = None,
+    pollutant: Optional[str] = None,
+    cursor: Optional[int] = None,
+    limit: int = 50
+):
+    """
+    Anomalies flagged by the streaming detector, newest first
+    Each reading is scored against its own sensor's EWMA baseline;
+    `threshold` is the minimum |z-score|, `cursor` comes from next_cursor.
+    """
+    if pollutant and pollutant not in ANOMALY_POLLUTANTS:
+        raise HTTPException(status_code=400, detail=f"pollutant must be one of {', '.join(ANOMALY_POLLUTANTS)}")
+    limit = max(1, min(limit, 500))
+
+    anomalies, next_cursor = anomaly_detector.query(
+        sensor_id=sensor_id,
+        pollutant=pollutant,
+        since=datetime.utcnow() - timedelta(hours=hours),
+        min_z=threshold,
+        cursor=cursor,
+        limit=limit,
+    )
 
     return {
         "period": f"Last {hours} hours",
-        "threshold": round(threshold_value, 2),
-        "mean": round(stats.mean_pm25, 2),
-        "stddev": round(stats.std_pm25, 2),
-        "anomalies_found": len(anomalies),
-        "anomalies": [
-            {
-                "sensor_id": a.sensor_id,
-                "timestamp": a.timestamp,
-                "pm25": a.pm25,
-                "location": {"lat": a.latitude, "lon": a.longitude}
-            }
-            for a in anomalies[:20]  # Limit to 20
-        ]
+        "threshold": threshold,
+        "anomalies": anomalies,
+        "next_cursor": next_cursor,
+        "detector": anomaly_detector.stats()
     }
 
 
+@app.get("/anomalies/baseline/{sensor_id}")
+async def get_anomaly_baseline(sensor_id: str):
+    """Current per-pollutant baseline (EWMA mean/std) of one sensor"""
+    baseline = anomaly_detector.baseline(sensor_id)
+    if not baseline:
+        raise HTTPException(status_code=404, detail="No baseline for this sensor yet")
+    return {"sensor_id": sensor_id, "baseline": baseline}
+
+
 @app.get("/insights")
 async def get_ai_insights(
     area: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get AI-generated insights about environmental conditions
     """
     # Get recent statistics
-    recent = db.query(
-        func.avg(SensorReading.pm25).label('pm25'),
-        func.avg(SensorReading.pm10).label('pm10'),
-        func.avg(SensorReading.no2).label('no2'),
-        func.count(SensorReading.id).label('count')
-    ).filter(
-        SensorReading.timestamp >= datetime.utcnow() - timedelta(hours=24)
-    ).first()
+    recent = (await db.execute(
+        select(
+            func.avg(SensorReading.pm25).label('pm25'),
+            func.avg(SensorReading.pm10).label('pm10'),
+            func.avg(SensorReading.no2).label('no2'),
+            func.count(SensorReading.id).label('count')
+        ).where(
+            SensorReading.timestamp >= datetime.utcnow() - timedelta(hours=24)
+        )
+    )).first()
 
     if not recent.count:
         raise HTTPException(status_code=404, detail="No data available")
@@ -399,19 +550,36 @@ async def get_ai_insights(
     """
 
     try:
-        response = model.generate_content(prompt)
+        insights = await ai.generate(
+            prompt,
+            fingerprint("insights", {"pm25": recent.pm25, "pm10": recent.pm10, "no2": recent.no2})
+        )
 
         return {
             "timestamp": datetime.utcnow(),
             "area": area or "Pavlodar",
             "aqi": aqi,
-            "insights": response.text,
+            "insights": insights,
             "data_quality": "good" if recent.count > 100 else "limited"
         }
+    except AIUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"AI insights unavailable: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI insights failed: {str(e)}")
 
 
+@app.get("/ratelimit/stats")
+async def get_rate_limit_stats():
+    """Token-bucket limiter counters and rules"""
+    return rate_limiter.stats()
+
+
+@app.get("/ai/stats")
+async def get_ai_stats():
+    """AI gateway (latency, breaker) and response cache statistics"""
+    return {"gateway": ai.stats(), "cache": llm_cache.stats()}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8002)
@@ -0,0 +1,155 @@
+"""
+Bucketed statistics served from TimescaleDB continuous aggregates
+Closed buckets come from the materialized aggregates; only buckets after the
+materialization watermark (the still-open current bucket, plus any bucket the
+refresh policy has not reached yet) are computed from raw sensor_readings.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import select, func
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database import SensorReading
+from shared.timescale import (
+    AGGREGATED_COLUMNS, sensor_hourly, sensor_daily, city_hourly, city_daily
+)
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def floor_bucket(ts: datetime, width: timedelta) -> datetime:
+    """Floor a timestamp to the start of its hourly/daily bucket"""
+    if width == DAY:
+        return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    return ts.replace(minute=0, second=0, microsecond=0)
+
+
+def _raw_rollup(start: datetime, sensor_id: Optional[str]):
+    """Hourly sums/counts/min/max straight from the hypertable"""
+    bucket = func.date_trunc('hour', SensorReading.timestamp).label('bucket')
+    columns = [bucket, func.count().label('samples')]
+    for name in AGGREGATED_COLUMNS:
+        col = getattr(SensorReading, name)
+        columns += [
+            func.sum(col).label(f"sum_{name}"),
+            func.count(col).label(f"n_{name}"),
+            func.min(col).label(f"min_{name}"),
+            func.max(col).label(f"max_{name}"),
+        ]
+
+    query = select(*columns).where(SensorReading.timestamp >= start)
+    if sensor_id:
+        query = query.where(SensorReading.sensor_id == sensor_id)
+    return query.group_by(bucket)
+
+
+def merge_buckets(rows: List[Dict], width: timedelta) -> List[Dict]:
+    """Combine rollup rows into coarser buckets (exact, since rows hold sums and counts)"""
+    merged: Dict[datetime, Dict] = {}
+    for row in rows:
+        key = floor_bucket(row["bucket"], width)
+        target = merged.get(key)
+        if target is None:
+            merged[key] = {**row, "bucket": key}
+            continue
+        target["samples"] += row["samples"]
+        for name in AGGREGATED_COLUMNS:
+            target[f"sum_{name}"] = _add(target[f"sum_{name}"], row[f"sum_{name}"])
+            target[f"n_{name}"] += row[f"n_{name}"]
+            target[f"min_{name}"] = _pick(min, target[f"min_{name}"], row[f"min_{name}"])
+            target[f"max_{name}"] = _pick(max, target[f"max_{name}"], row[f"max_{name}"])
+    return [merged[k] for k in sorted(merged)]
+
+
+def _add(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return a + b
+
+
+def _pick(fn, a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return fn(a, b)
+
+
+async def _materialized(db: AsyncSession, view, start: datetime, sensor_id: Optional[str]):
+    """Return (rows, watermark) from a continuous aggregate"""
+    watermark = (await db.execute(select(func.max(view.c.bucket)))).scalar()
+    if watermark is None or watermark < start:
+        return [], watermark
+
+    query = select(view).where(view.c.bucket >= start, view.c.bucket <= watermark)
+    if sensor_id:
+        query = query.where(view.c.sensor_id == sensor_id)
+    rows = [dict(r) for r in (await db.execute(query)).mappings().all()]
+    return rows, watermark
+
+
+async def hourly_rollups(db: AsyncSession, start: datetime, sensor_id: Optional[str] = None) -> List[Dict]:
+    """Hourly rollup rows from `start` until now, per sensor or city-wide"""
+    start = floor_bucket(start, HOUR)
+    view = sensor_hourly if sensor_id else city_hourly
+
+    try:
+        rows, watermark = await _materialized(db, view, start, sensor_id)
+    except DBAPIError:
+        # Aggregates not available (e.g. plain PostgreSQL) - fall back to raw rows
+        await db.rollback()
+        rows, watermark = [], None
+
+    raw_start = max(start, watermark + HOUR) if watermark else start
+    raw_rows = (await db.execute(_raw_rollup(raw_start, sensor_id))).mappings().all()
+    rows.extend(dict(r) for r in raw_rows)
+
+    return merge_buckets(rows, HOUR)
+
+
+async def daily_rollups(db: AsyncSession, start: datetime, sensor_id: Optional[str] = None) -> List[Dict]:
+    """Daily rollup rows from `start` until now, per sensor or city-wide"""
+    start = floor_bucket(start, DAY)
+    view = sensor_daily if sensor_id else city_daily
+
+    try:
+        rows, watermark = await _materialized(db, view, start, sensor_id)
+    except DBAPIError:
+        await db.rollback()
+        rows, watermark = [], None
+
+    # Days after the daily watermark are assembled from hourly rollups
+    hourly_start = max(start, watermark + DAY) if watermark else start
+    rows.extend(await hourly_rollups(db, hourly_start, sensor_id))
+
+    return merge_buckets(rows, DAY)
+
+
+def summarize(row: Dict) -> Dict:
+    """Turn a rollup row into the public statistics shape"""
+    def avg(name):
+        n = row[f"n_{name}"]
+        return round(row[f"sum_{name}"] / n, 2) if n else None
+
+    def rounded(value):
+        return round(value, 2) if value is not None else None
+
+    return {
+        "timestamp": row["bucket"],
+        "samples": row["samples"],
+        "pm25": {"avg": avg("pm25"),
+                 "max": rounded(row["max_pm25"]),
+                 "min": rounded(row["min_pm25"])},
+        "pm10": avg("pm10"),
+        "no2": avg("no2"),
+        "co": avg("co"),
+        "o3": avg("o3"),
+        "so2": avg("so2"),
+        "temperature": avg("temperature"),
+        "humidity": avg("humidity")
+    }
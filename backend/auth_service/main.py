@@ -4,15 +4,13 @@ Handles user registration, login, and JWT token management
 """
 import os
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Optional
 
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
-from jose import JWTError, jwt
 from authlib.integrations.starlette_client import OAuth
 from starlette.config import Config
 from starlette.requests import Request
@@ -22,11 +20,11 @@ from starlette.middleware.sessions import SessionMiddleware
 # Add parent directory to path for shared modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from shared.database import get_db, init_db, User
-
-# Configuration
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+from shared.auth import (
+    SECRET_KEY, CurrentUser, create_access_token, get_current_user, require_role,
+    token_verifier, user_claims,
+)
+from shared.metrics import MetricsMiddleware
 
 # Google OAuth configuration
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
@@ -71,6 +69,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics and /metrics (added last, so it is the outermost middleware)
+app.add_middleware(MetricsMiddleware)
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup():
@@ -78,10 +79,6 @@ async def startup():
     print("🔐 Auth Service started")
 
 
-# Security
-security = HTTPBearer()
-
-
 # Models
 class Token(BaseModel):
     access_token: str
@@ -109,55 +106,6 @@ class UserLogin(BaseModel):
     password: str
 
 
-# JWT Functions
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    """Create JWT access token"""
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Verify JWT token and return payload"""
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Could not validate credentials",
-        )
-
-
-def get_current_user(
-    payload: dict = Depends(verify_token),
-    db: Session = Depends(get_db)
-) -> User:
-    """Get current user from JWT token"""
-    user_id = payload.get("sub")
-    if user_id is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid authentication credentials",
-        )
-
-    user = db.query(User).filter(User.id == int(user_id)).first()
-    if user is None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="User not found",
-        )
-
-    return user
-
-
 # Routes
 @app.get("/")
 async def root():
@@ -169,6 +117,7 @@ async def root():
             "google_callback": "/auth/google/callback",
             "verify": "/auth/verify",
             "me": "/auth/me",
+            "logout": "/auth/logout",
         }
     }
 
@@ -222,11 +171,10 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
 
         db.commit()
         db.refresh(user)
+        token_verifier.forget_profile(user.id)
 
-        # Create JWT token
-        access_token = create_access_token(
-            data={"sub": str(user.id), "email": user.email}
-        )
+        # Create JWT token (role and active flag are embedded as claims)
+        access_token = create_access_token(data=user_claims(user))
 
         # Redirect to frontend with token
         redirect_url = f"{FRONTEND_URL}/auth/callback?token={access_token}"
@@ -238,8 +186,8 @@ async def google_callback(request: Request, db: Session = Depends(get_db)):
 
 
 @app.get("/auth/verify")
-async def verify(current_user: User = Depends(get_current_user)):
-    """Verify JWT token"""
+async def verify(current_user: CurrentUser = Depends(get_current_user)):
+    """Verify JWT token (answered from the token claims)"""
     return {
         "valid": True,
         "user": {
@@ -253,25 +201,42 @@ async def verify(current_user: User = Depends(get_current_user)):
 
 
 @app.get("/auth/me")
-async def get_me(current_user: User = Depends(get_current_user)):
+def get_me(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
     """Get current user information"""
-    return {
-        "id": current_user.id,
-        "email": current_user.email,
-        "name": current_user.name,
-        "profile_picture": current_user.profile_picture,
-        "role": current_user.role,
-        "created_at": current_user.created_at,
-        "last_login": current_user.last_login,
-    }
+    profile = token_verifier.profile(db, current_user.id)
+    if profile is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+        )
+    return profile
 
 
 @app.post("/auth/logout")
-async def logout():
-    """Logout (client-side token removal)"""
+def logout(current_user: CurrentUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Logout: revoke this token for every service"""
+    token_verifier.revoke(db, current_user)
     return {"message": "Logged out successfully"}
 
 
+@app.post("/auth/users/{user_id}/revoke")
+def revoke_user_tokens(
+    user_id: int,
+    current_user: CurrentUser = Depends(require_role("admin")),
+    db: Session = Depends(get_db),
+):
+    """Revoke all tokens of a user (after a role change or deactivation)"""
+    if token_verifier.revoke_user(db, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": f"Tokens of user {user_id} revoked"}
+
+
+@app.get("/auth/stats")
+async def auth_stats():
+    """Token verification cache statistics"""
+    return token_verifier.stats()
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8004)
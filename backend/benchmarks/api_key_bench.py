@@ -0,0 +1,128 @@
+"""
+API-key check overhead on the ingestion path
+Times the in-memory work done per reading before it is written: the sensor
+registry cache lookup alone (no authentication) against lookup + HMAC of the
+presented key + constant-time comparison. Single readings hash once each;
+batches hash each distinct key once. The best of --repeat runs is reported,
+i.e. the steady state where presented-key digests are memoized. Parsing the
+reading with SensorData is timed as well, for scale.
+
+Usage (from backend/):
+    python benchmarks/api_key_bench.py --sensors 1000 --readings 100000 --batch-size 500
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.api_keys import generate_api_key, hash_api_key, hash_many, key_matches
+from shared.models import SensorData
+from shared.sensor_cache import SensorRegistryCache
+
+
+def build_cache(sensors: int):
+    cache = SensorRegistryCache(ttl=3600)
+    keys = {}
+    for i in range(sensors):
+        sensor_id = f"SENSOR_{i:05d}"
+        keys[sensor_id] = generate_api_key()
+        cache.put(SimpleNamespace(
+            sensor_id=sensor_id, name=sensor_id, latitude=52.28, longitude=76.96,
+            status="active", api_key_hash=hash_api_key(keys[sensor_id]),
+        ))
+    return cache, keys
+
+
+def single_lookup(cache, items):
+    for data in items:
+        cache.get(None, data.sensor_id)
+
+
+def single_authenticated(cache, items):
+    for data in items:
+        sensor = cache.get(None, data.sensor_id)
+        assert key_matches(sensor.api_key_hash, hash_api_key(data.api_key))
+
+
+def batch_lookup(cache, batches):
+    for batch in batches:
+        known = cache.get_many(None, {data.sensor_id for data in batch})
+        for data in batch:
+            known.get(data.sensor_id)
+
+
+def batch_authenticated(cache, batches):
+    for batch in batches:
+        known = cache.get_many(None, {data.sensor_id for data in batch})
+        digests = hash_many(data.api_key for data in batch)
+        for data in batch:
+            assert key_matches(known[data.sensor_id].api_key_hash, digests[data.api_key])
+
+
+def best_of(repeat, fn, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument("--readings", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    cache, keys = build_cache(args.sensors)
+    rng = random.Random(42)
+    payloads = []
+    for _ in range(args.readings):
+        sensor_id = f"SENSOR_{rng.randrange(args.sensors):05d}"
+        payloads.append(json.dumps({
+            "sensor_id": sensor_id, "latitude": 52.28, "longitude": 76.96,
+            "pm25": rng.uniform(5, 80), "pm10": rng.uniform(10, 120),
+            "api_key": keys[sensor_id],
+        }))
+
+    started = time.perf_counter()
+    items = [SensorData.model_validate_json(p) for p in payloads]
+    parse_seconds = time.perf_counter() - started
+    batches = [items[i:i + args.batch_size] for i in range(0, len(items), args.batch_size)]
+
+    def per_reading_us(seconds):
+        return round(seconds / args.readings * 1e6, 3)
+
+    single_base = best_of(args.repeat, single_lookup, cache, items)
+    single_auth = best_of(args.repeat, single_authenticated, cache, items)
+    batch_base = best_of(args.repeat, batch_lookup, cache, batches)
+    batch_auth = best_of(args.repeat, batch_authenticated, cache, batches)
+
+    report = {
+        "sensors": args.sensors,
+        "readings": args.readings,
+        "batch_size": args.batch_size,
+        "parse_us_per_reading": per_reading_us(parse_seconds),
+        "single": {
+            "lookup_us_per_reading": per_reading_us(single_base),
+            "authenticated_us_per_reading": per_reading_us(single_auth),
+            "overhead_us_per_reading": per_reading_us(single_auth - single_base),
+        },
+        "batch": {
+            "lookup_us_per_reading": per_reading_us(batch_base),
+            "authenticated_us_per_reading": per_reading_us(batch_auth),
+            "overhead_us_per_reading": per_reading_us(batch_auth - batch_base),
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+AQI engine benchmark: vectorized shared.aqi vs. a per-row Python loop
+The per-row version walks the same EPA breakpoint tables with a plain loop,
+which is what the old if/elif implementations did for each reading.
+
+Usage (from backend/):
+    python benchmarks/aqi_bench.py --rows 100000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from shared.aqi import compute_aqi, _CONCENTRATIONS, _INDEXES, UNIT_FACTORS, PRECISION
+
+POLLUTANTS = ("pm25", "pm10", "no2", "co", "o3", "so2")
+
+
+def scalar_sub_index(pollutant, value):
+    if value is None:
+        return None
+    scale = 10 ** PRECISION[pollutant]
+    conc = int(value * UNIT_FACTORS[pollutant] * scale + 1e-9) / scale
+    table = _CONCENTRATIONS[pollutant]
+    for segment, (c_low, c_high) in enumerate(table):
+        if conc <= c_high or segment == len(table) - 1:
+            i_low, i_high = _INDEXES[pollutant][segment]
+            return min(500, max(0, round((i_high - i_low) / (c_high - c_low) * (conc - c_low) + i_low)))
+
+
+def scalar_aqi(row):
+    best, dominant = None, None
+    for pollutant in POLLUTANTS:
+        index = scalar_sub_index(pollutant, row[pollutant])
+        if index is not None and (best is None or index > best):
+            best, dominant = index, pollutant
+    return best, dominant
+
+
+def synthetic_columns(rows, seed=42):
+    rng = np.random.default_rng(seed)
+    return {
+        "pm25": rng.gamma(2.0, 15.0, rows),
+        "pm10": rng.gamma(2.0, 25.0, rows),
+        "no2": rng.gamma(2.0, 30.0, rows),
+        "co": rng.gamma(2.0, 0.6, rows),
+        "o3": rng.uniform(20, 160, rows),
+        "so2": rng.uniform(5, 60, rows),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    columns = synthetic_columns(args.rows)
+    records = [
+        {p: float(columns[p][i]) for p in POLLUTANTS}
+        for i in range(args.rows)
+    ]
+
+    vectorized = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        aqi, _ = compute_aqi(columns)
+        vectorized.append(time.perf_counter() - started)
+
+    scalar = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        expected = [scalar_aqi(r)[0] for r in records]
+        scalar.append(time.perf_counter() - started)
+
+    mismatches = int(np.sum(aqi != np.array(expected, dtype=float)))
+
+    report = {
+        "rows": args.rows,
+        "vectorized_seconds": round(min(vectorized), 4),
+        "per_row_seconds": round(min(scalar), 4),
+        "speedup": round(min(scalar) / min(vectorized), 1),
+        "mismatches": mismatches,
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
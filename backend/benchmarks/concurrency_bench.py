@@ -0,0 +1,121 @@
+"""
+Concurrency benchmark for the FastAPI services
+Keeps a number of slow requests in flight (e.g. /statistics/hourly over a long
+window) and measures the latency of cheap requests issued at the same time.
+With blocking database calls the cheap requests queue behind the slow ones;
+with the async database layer they should stay close to their idle latency.
+
+Usage:
+    python benchmarks/concurrency_bench.py --base-url http://localhost:8002 \\
+        --slow "/statistics/hourly?hours=720" --fast "/aqi/current" \\
+        --slow-concurrency 8 --fast-requests 200
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
+
+
+async def slow_worker(client: httpx.AsyncClient, path: str, stop: asyncio.Event, counter: dict):
+    while not stop.is_set():
+        try:
+            await client.get(path)
+            counter["slow_completed"] += 1
+        except httpx.HTTPError:
+            counter["slow_errors"] += 1
+
+
+async def run(args) -> dict:
+    limits = httpx.Limits(max_connections=args.slow_concurrency + args.fast_concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limits) as client:
+        # Idle baseline for the fast endpoint
+        baseline = []
+        for _ in range(args.baseline_requests):
+            started = time.perf_counter()
+            await client.get(args.fast)
+            baseline.append((time.perf_counter() - started) * 1000)
+
+        stop = asyncio.Event()
+        counter = {"slow_completed": 0, "slow_errors": 0}
+        slow_tasks = [
+            asyncio.create_task(slow_worker(client, args.slow, stop, counter))
+            for _ in range(args.slow_concurrency)
+        ]
+        await asyncio.sleep(args.warmup)
+
+        latencies = []
+        errors = 0
+        semaphore = asyncio.Semaphore(args.fast_concurrency)
+
+        async def fast_request():
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await client.get(args.fast)
+                    if response.status_code >= 500:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(fast_request() for _ in range(args.fast_requests)))
+        elapsed = time.perf_counter() - started
+
+        stop.set()
+        await asyncio.gather(*slow_tasks, return_exceptions=True)
+
+    return {
+        "base_url": args.base_url,
+        "slow_path": args.slow,
+        "fast_path": args.fast,
+        "slow_concurrency": args.slow_concurrency,
+        "fast_requests": args.fast_requests,
+        "fast_errors": errors,
+        "fast_throughput_rps": round(args.fast_requests / elapsed, 1),
+        "baseline_p50_ms": round(statistics.median(baseline), 2) if baseline else None,
+        "under_load_ms": {
+            "p50": round(percentile(latencies, 50), 2),
+            "p95": round(percentile(latencies, 95), 2),
+            "p99": round(percentile(latencies, 99), 2),
+            "max": round(max(latencies), 2),
+        },
+        **counter,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8002")
+    parser.add_argument("--slow", default="/statistics/hourly?hours=720")
+    parser.add_argument("--fast", default="/")
+    parser.add_argument("--slow-concurrency", type=int, default=8)
+    parser.add_argument("--fast-concurrency", type=int, default=16)
+    parser.add_argument("--fast-requests", type=int, default=200)
+    parser.add_argument("--baseline-requests", type=int, default=20)
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
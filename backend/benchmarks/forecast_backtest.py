@@ -0,0 +1,76 @@
+"""
+Forecast backtest: rolling-origin error of the analytics forecast model
+Reads hourly rollups from the database (or a synthetic series with --synthetic)
+and compares the model with persistence, seasonal-naive and the old
+"average x 1.1" rule.
+
+Usage (from backend/):
+    python benchmarks/forecast_backtest.py --sensor-id PAV-001 --pollutant pm25 --days 28
+    python benchmarks/forecast_backtest.py --synthetic --days 42
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+
+BACKEND = os.path.join(os.path.dirname(__file__), '..')
+sys.path.append(BACKEND)
+sys.path.append(os.path.join(BACKEND, 'analytics_service'))
+
+from forecast import backtest, hourly_series
+from rollups import HOUR, floor_bucket, hourly_rollups
+
+
+def synthetic_series(hours, seed=42):
+    """Daily cycle, weekend offset and AR(1) noise"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(hours)
+    noise = np.zeros(hours)
+    for i in range(1, hours):
+        noise[i] = 0.7 * noise[i - 1] + rng.normal(0, 3)
+    values = 30 + 15 * np.sin(2 * np.pi * t / 24) + 5 * ((t // 24) % 7 >= 5) + noise
+    values[rng.choice(hours, hours // 50, replace=False)] = np.nan
+    return values
+
+
+async def database_series(sensor_id, pollutant, start, end):
+    from shared.database import get_async_sessionmaker
+
+    async with get_async_sessionmaker()() as db:
+        rows = await hourly_rollups(db, start, sensor_id)
+    return hourly_series(rows, pollutant, start, end)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensor-id", default=None, help="omit for the city-wide series")
+    parser.add_argument("--pollutant", default="pm25")
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--horizon", type=int, default=6)
+    parser.add_argument("--level", type=float, default=0.9)
+    parser.add_argument("--synthetic", action="store_true")
+    args = parser.parse_args()
+
+    end = floor_bucket(datetime.utcnow(), HOUR) - HOUR
+    start = end - timedelta(days=args.days) + HOUR
+    if args.synthetic:
+        values = synthetic_series(args.days * 24)
+    else:
+        values = asyncio.run(database_series(args.sensor_id, args.pollutant, start, end))
+
+    report = backtest(values, start, horizon=args.horizon, level=args.level)
+    print(json.dumps({
+        "sensor_id": args.sensor_id,
+        "pollutant": args.pollutant,
+        "synthetic": args.synthetic,
+        "hours": len(values),
+        **report,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
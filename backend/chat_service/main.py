@@ -10,21 +10,38 @@ from typing import List, Dict, Any, Optional
 from fastapi import FastAPI, HTTPException, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
-import google.generativeai as genai
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, and_
+import numpy as np
 
 # Add parent directory to path for shared modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from shared.database import get_db, SensorReading, Sensor, Alert
+from shared.database import get_async_db, LatestReading, Sensor, Alert
+from shared.geo import sensor_index
+from shared.llm_client import make_client
+from shared.llm_cache import llm_cache, fingerprint
+from shared.ai_gateway import AIGateway
+from shared.ratelimit import RateLimiter, RateLimitMiddleware, RateLimitRule
+from shared.aqi import compute_aqi, category_index, dominant_display_name, CATEGORIES
+from shared.metrics import MetricsMiddleware
 
 # Configuration
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+# One model client behind the async gateway (LLM_CLIENT=fake for a local stand-in)
+ai = AIGateway(make_client('gemini-pro'))
+
+# Location lookup: nearest reporting sensor among the k closest within NEAREST_MAX_KM
+NEAREST_SENSORS = int(os.getenv("CHAT_NEAREST_SENSORS", "3"))
+NEAREST_MAX_KM = float(os.getenv("CHAT_NEAREST_MAX_KM", "5"))
 
 app = FastAPI(title="Weimea Chat Assistant", version="1.0.0")
 
+# Each chat message may reach Gemini; limit per user (or IP) before CORS so 429s carry CORS headers
+rate_limiter = RateLimiter([
+    RateLimitRule("chat", "/chat", "user", os.getenv("RATE_LIMIT_CHAT", "20/minute,burst=5"), methods=("POST",)),
+    RateLimitRule("client", "*", "ip", os.getenv("RATE_LIMIT_CLIENT", "20/s,burst=40")),
+])
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -34,6 +51,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics and /metrics (added last, so it is the outermost middleware)
+app.add_middleware(MetricsMiddleware)
+
 
 # Models
 class ChatMessage(BaseModel):
@@ -49,97 +69,68 @@ class ChatResponse(BaseModel):
     recommendations: List[str] = []
 
 
+# Russian labels for shared.aqi.CATEGORIES (same order)
+CATEGORY_LABELS = [
+    "Хороший",
+    "Умеренный",
+    "Нездоровый для чувствительных групп",
+    "Нездоровый",
+    "Очень нездоровый",
+    "Опасный",
+]
+
+
 # Helper functions
-def calculate_aqi(pm25: float = None, pm10: float = None, no2: float = None) -> Dict[str, Any]:
-    """Calculate Air Quality Index"""
-    aqi_values = []
-
-    if pm25 is not None:
-        if pm25 <= 12: aqi = 50
-        elif pm25 <= 35.4: aqi = 100
-        elif pm25 <= 55.4: aqi = 150
-        elif pm25 <= 150.4: aqi = 200
-        elif pm25 <= 250.4: aqi = 300
-        else: aqi = 400
-        aqi_values.append(("PM2.5", aqi))
-
-    if pm10 is not None:
-        if pm10 <= 54: aqi = 50
-        elif pm10 <= 154: aqi = 100
-        elif pm10 <= 254: aqi = 150
-        elif pm10 <= 354: aqi = 200
-        elif pm10 <= 424: aqi = 300
-        else: aqi = 400
-        aqi_values.append(("PM10", aqi))
-
-    if not aqi_values:
+def calculate_aqi(pm25: float = None, pm10: float = None, no2: float = None,
+                  co: float = None, o3: float = None) -> Dict[str, Any]:
+    """Calculate Air Quality Index (shared EPA engine, Russian category labels)"""
+    aqi, dominant = compute_aqi({
+        "pm25": [pm25], "pm10": [pm10], "no2": [no2], "co": [co], "o3": [o3],
+    })
+
+    if np.isnan(aqi[0]):
         return {"aqi": 0, "category": "Unknown", "color": "#gray"}
 
-    dominant = max(aqi_values, key=lambda x: x[1])
-    aqi = dominant[1]
-
-    if aqi <= 50:
-        category = "Хороший"
-        color = "#00e400"
-    elif aqi <= 100:
-        category = "Умеренный"
-        color = "#ffff00"
-    elif aqi <= 150:
-        category = "Нездоровый для чувствительных групп"
-        color = "#ff7e00"
-    elif aqi <= 200:
-        category = "Нездоровый"
-        color = "#ff0000"
-    elif aqi <= 300:
-        category = "Очень нездоровый"
-        color = "#8f3f97"
-    else:
-        category = "Опасный"
-        color = "#7e0023"
+    value = int(aqi[0])
+    index = int(category_index(value)[0])
 
     return {
-        "aqi": aqi,
-        "category": category,
-        "color": color,
-        "dominant_pollutant": dominant[0]
+        "aqi": value,
+        "category": CATEGORY_LABELS[index],
+        "color": CATEGORIES[index][1],
+        "dominant_pollutant": dominant_display_name(dominant[0])
     }
 
 
-def get_location_data(db: Session, location: str = None, lat: float = None, lon: float = None) -> Dict[str, Any]:
-    """Get sensor data for specific location"""
-    query = db.query(
-        SensorReading.pm25,
-        SensorReading.pm10,
-        SensorReading.no2,
-        SensorReading.co,
-        SensorReading.o3,
-        SensorReading.temperature,
-        SensorReading.humidity,
-        SensorReading.latitude,
-        SensorReading.longitude,
-        SensorReading.timestamp
-    ).order_by(SensorReading.timestamp.desc())
+async def get_location_data(db: AsyncSession, location: str = None, lat: float = None, lon: float = None) -> Dict[str, Any]:
+    """Get latest sensor data for specific location (nearest reporting sensor)"""
+    query = select(LatestReading)
 
     # Filter by location if provided
-    if lat and lon:
-        # Find nearest sensor (within ~1km radius)
-        query = query.filter(
-            and_(
-                SensorReading.latitude.between(lat - 0.01, lat + 0.01),
-                SensorReading.longitude.between(lon - 0.01, lon + 0.01)
-            )
-        )
-
-    # Get latest reading
-    latest = query.first()
+    distances = {}
+    if lat is not None and lon is not None:
+        await sensor_index.refresh(db)
+        nearest = sensor_index.nearest(lat, lon, k=NEAREST_SENSORS, max_km=NEAREST_MAX_KM)
+        if not nearest:
+            return None
+        distances = dict(nearest)
+        query = query.where(LatestReading.sensor_id.in_(list(distances)))
+    else:
+        query = query.order_by(LatestReading.timestamp.desc()).limit(1)
 
-    if not latest:
+    candidates = (await db.execute(query)).scalars().all()
+    if not candidates:
         return None
 
+    # Closest sensor that has reported
+    latest = min(candidates, key=lambda r: distances.get(r.sensor_id, 0.0))
+
     # Calculate AQI
-    aqi_info = calculate_aqi(latest.pm25, latest.pm10, latest.no2)
+    aqi_info = calculate_aqi(latest.pm25, latest.pm10, latest.no2, latest.co, latest.o3)
 
     return {
+        "sensor_id": latest.sensor_id,
+        "distance_km": round(distances[latest.sensor_id], 2) if distances else None,
         "pm25": latest.pm25,
         "pm10": latest.pm10,
         "no2": latest.no2,
@@ -153,19 +144,21 @@ def get_location_data(db: Session, location: str = None, lat: float = None, lon:
     }
 
 
-def get_active_alerts(db: Session, lat: float = None, lon: float = None) -> List[Dict]:
+async def get_active_alerts(db: AsyncSession, lat: float = None, lon: float = None) -> List[Dict]:
     """Get active environmental alerts for area"""
-    query = db.query(Alert).filter(Alert.resolved == 0)
+    query = select(Alert).where(Alert.resolved == 0)
 
     if lat and lon:
-        query = query.filter(
+        query = query.where(
             and_(
                 Alert.latitude.between(lat - 0.02, lat + 0.02),
                 Alert.longitude.between(lon - 0.02, lon + 0.02)
             )
         )
 
-    alerts = query.order_by(Alert.timestamp.desc()).limit(5).all()
+    alerts = (await db.execute(
+        query.order_by(Alert.timestamp.desc()).limit(5)
+    )).scalars().all()
 
     return [
         {
@@ -219,15 +212,17 @@ def generate_recommendations(aqi: int, data: Dict, alerts: List[Dict]) -> List[s
     return recommendations
 
 
-def create_ai_response(user_message: str, data: Dict, recommendations: List[str]) -> str:
-    """Generate AI response using Gemini"""
-    if not GEMINI_API_KEY:
+async def create_ai_response(user_message: str, data: Dict, recommendations: List[str]) -> str:
+    """
+    Generate AI response using Gemini (cached per normalized question and conditions)
+    Falls back to the rule-based recommendations when the model is slow or failing
+    """
+    if not ai.available:
         return "⚠️ AI ассистент временно недоступен. Вот данные и рекомендации по вашему запросу."
 
-    try:
-        model = genai.GenerativeModel('gemini-pro')
+    fallback = f"На основе данных: AQI = {data.get('aqi')}, категория '{data.get('category')}'. " + " ".join(recommendations[:2])
 
-        prompt = f"""Ты виртуальный эко-ассистент "EcoGuide" для системы мониторинга окружающей среды в Павлодаре, Казахстан.
+    prompt = f"""Ты виртуальный эко-ассистент "EcoGuide" для системы мониторинга окружающей среды в Павлодаре, Казахстан.
 
 Пользователь спрашивает: "{user_message}"
 
@@ -252,12 +247,18 @@ def create_ai_response(user_message: str, data: Dict, recommendations: List[str]
 
 Не повторяй все данные - выбери главное. Говори тепло и по-человечески."""
 
-        response = model.generate_content(prompt)
-        return response.text
-
-    except Exception as e:
-        print(f"Gemini API error: {e}")
-        return f"На основе данных: AQI = {data.get('aqi')}, категория '{data.get('category')}'. " + " ".join(recommendations[:2])
+    key = fingerprint("chat", {
+        "message": user_message,
+        "aqi": data.get("aqi"),
+        "category": data.get("category"),
+        "pm25": data.get("pm25"),
+        "pm10": data.get("pm10"),
+        "no2": data.get("no2"),
+        "temperature": data.get("temperature"),
+        "humidity": data.get("humidity"),
+        "recommendations": recommendations,
+    })
+    return await ai.generate_or_fallback(prompt, fallback, key)
 
 
 # Routes
@@ -277,17 +278,29 @@ async def root():
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "gemini_configured": bool(GEMINI_API_KEY)}
+    return {"status": "healthy", "gemini_configured": ai.available}
+
+
+@app.get("/ratelimit/stats")
+async def get_rate_limit_stats():
+    """Token-bucket limiter counters and rules"""
+    return rate_limiter.stats()
+
+
+@app.get("/ai/stats")
+async def get_ai_stats():
+    """AI gateway (latency, breaker) and response cache statistics"""
+    return {"gateway": ai.stats(), "cache": llm_cache.stats()}
 
 
 @app.post("/chat", response_model=ChatResponse)
-async def chat(message: ChatMessage, db: Session = Depends(get_db)):
+async def chat(message: ChatMessage, db: AsyncSession = Depends(get_async_db)):
     """
     Chat with AI assistant about environmental conditions
     """
     try:
         # Get location data
-        location_data = get_location_data(
+        location_data = await get_location_data(
             db,
             location=message.location,
             lat=message.latitude,
@@ -302,7 +315,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
             )
 
         # Get alerts
-        alerts = get_active_alerts(db, message.latitude, message.longitude)
+        alerts = await get_active_alerts(db, message.latitude, message.longitude)
 
         # Generate recommendations
         recommendations = generate_recommendations(
@@ -312,7 +325,7 @@ async def chat(message: ChatMessage, db: Session = Depends(get_db)):
         )
 
         # Generate AI response
-        ai_response = create_ai_response(
+        ai_response = await create_ai_response(
             message.message,
             location_data,
             recommendations
@@ -0,0 +1,82 @@
+"""
+Column-oriented bulk reads
+Only the requested columns are selected through Core (no ORM objects) and the
+result is transposed into one array per field. Timestamps are epoch
+milliseconds so chart libraries and NumPy can use them directly. Output is
+JSON (encoded without per-row dicts) or an Arrow IPC stream.
+"""
+import io
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+
+from shared.database import SensorReading
+from shared.pagination import after_key
+from export import VALUE_COLUMNS, pa
+
+COLUMNS_MAX_ROWS = int(os.getenv("COLUMNS_MAX_ROWS", "500000"))
+
+FIELDS = ("id", "sensor_id") + VALUE_COLUMNS
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+def parse_fields(fields: Optional[str]) -> List[str]:
+    """Requested fields besides timestamp (default: sensor_id and pollutants); raises ValueError"""
+    if not fields:
+        return ["sensor_id", "pm25", "pm10", "no2", "co", "o3", "so2"]
+    requested = [f.strip() for f in fields.split(",") if f.strip() and f.strip() != "timestamp"]
+    unknown = [f for f in requested if f not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return list(dict.fromkeys(requested))
+
+
+def columns_query(start: datetime, end: datetime, sensor_ids: Optional[Sequence[str]],
+                  fields: Sequence[str], after: Optional[Tuple[datetime, int]], limit: int):
+    """Core select of timestamp, id (paging key) and the requested fields, oldest first"""
+    query = select(
+        SensorReading.timestamp, SensorReading.id,
+        *[getattr(SensorReading, f) for f in fields if f != "id"]
+    ).where(SensorReading.timestamp >= start, SensorReading.timestamp < end)
+
+    if sensor_ids:
+        query = query.where(SensorReading.sensor_id.in_(list(sensor_ids)))
+    if after is not None:
+        query = query.where(after_key([SensorReading.timestamp, SensorReading.id], after, descending=False))
+
+    return query.order_by(SensorReading.timestamp, SensorReading.id).limit(limit)
+
+
+def to_columns(rows, fields: Sequence[str]) -> Dict[str, list]:
+    """Transpose result rows into {"timestamp": [...ms], field: [...]}"""
+    if not rows:
+        return {"timestamp": [], **{f: [] for f in fields}}
+
+    transposed = list(zip(*rows))
+    columns = {"timestamp": [(ts - EPOCH) // MILLISECOND for ts in transposed[0]]}
+    values = iter(transposed[2:])
+    for f in fields:
+        columns[f] = list(transposed[1]) if f == "id" else list(next(values))
+    return columns
+
+
+def json_payload(columns: Dict[str, list], meta: Dict) -> bytes:
+    return json.dumps({**meta, "columns": columns}, separators=(",", ":")).encode()
+
+
+def arrow_payload(columns: Dict[str, list]) -> bytes:
+    """Arrow IPC stream (one record batch) of the column arrays"""
+    types = {"timestamp": pa.timestamp("ms"), "id": pa.int64(), "sensor_id": pa.string()}
+    arrays = [pa.array(values, type=types.get(name, pa.float64())) for name, values in columns.items()]
+    # Few distinct sensors over many rows: dictionary-encode the ids
+    arrays = [a.dictionary_encode() if name == "sensor_id" else a for name, a in zip(columns, arrays)]
+    schema = pa.schema([(name, a.type) for name, a in zip(columns, arrays)])
+    batch = pa.record_batch(arrays, schema=schema)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch)
+    return sink.getvalue()
@@ -0,0 +1,163 @@
+"""
+Streaming export of historical readings
+Rows are read through a server-side cursor (yield_per) and encoded chunk by
+chunk as CSV, NDJSON or Parquet row groups, so memory stays constant no
+matter how long the range is. Output is ordered by (timestamp, id); an
+interrupted download resumes with `after=<timestamp>,<id>` of the last
+complete row received.
+"""
+import csv
+import io
+import json
+import os
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select, or_, and_
+
+from shared.database import get_async_engine, SensorReading
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is optional
+    pa = None
+    pq = None
+
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", "10000"))
+
+KEY_COLUMNS = ("id", "sensor_id", "timestamp")
+VALUE_COLUMNS = ("latitude", "longitude", "pm25", "pm10", "no2", "co", "o3", "so2",
+                 "temperature", "humidity", "pressure")
+POLLUTANT_COLUMNS = ("pm25", "pm10", "no2", "co", "o3", "so2")
+
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+def parse_columns(columns: Optional[str]) -> List[str]:
+    """Requested value columns (all when empty); raises ValueError on unknown names"""
+    if not columns:
+        return list(VALUE_COLUMNS)
+    requested = [c.strip() for c in columns.split(",") if c.strip()]
+    unknown = [c for c in requested if c not in VALUE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+    return requested
+
+
+def parse_after(after: Optional[str]) -> Optional[Tuple[datetime, int]]:
+    """Resume position "timestamp,id" (the last row already received)"""
+    if not after:
+        return None
+    try:
+        timestamp, reading_id = after.rsplit(",", 1)
+        return datetime.fromisoformat(timestamp), int(reading_id)
+    except ValueError:
+        raise ValueError("after must be <ISO timestamp>,<id> of the last row received")
+
+
+def export_query(start: datetime, end: datetime, sensor_ids: Optional[Sequence[str]],
+                 columns: Sequence[str], after: Optional[Tuple[datetime, int]] = None):
+    """Core select of the requested columns ordered by (timestamp, id)"""
+    selected = [getattr(SensorReading, c) for c in (*KEY_COLUMNS, *columns)]
+    query = select(*selected).where(SensorReading.timestamp >= start, SensorReading.timestamp < end)
+
+    if sensor_ids:
+        query = query.where(SensorReading.sensor_id.in_(list(sensor_ids)))
+
+    # Skip rows where none of the requested pollutants was measured
+    pollutants = [getattr(SensorReading, c) for c in columns if c in POLLUTANT_COLUMNS]
+    if pollutants and len(pollutants) < len(POLLUTANT_COLUMNS):
+        query = query.where(or_(*[p.isnot(None) for p in pollutants]))
+
+    if after is not None:
+        after_ts, after_id = after
+        query = query.where(or_(
+            SensorReading.timestamp > after_ts,
+            and_(SensorReading.timestamp == after_ts, SensorReading.id > after_id),
+        ))
+
+    return query.order_by(SensorReading.timestamp, SensorReading.id)
+
+
+def _csv_chunk(rows, header: Optional[Sequence[str]] = None) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(header)
+    for row in rows:
+        writer.writerow([
+            v.isoformat() if isinstance(v, datetime) else ("" if v is None else v)
+            for v in row
+        ])
+    return buffer.getvalue()
+
+
+def _ndjson_chunk(rows, names: Sequence[str]) -> str:
+    return "".join(
+        json.dumps({
+            name: v.isoformat() if isinstance(v, datetime) else v
+            for name, v in zip(names, row)
+        }) + "\n"
+        for row in rows
+    )
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands out what has been written since the last drain"""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_schema(names: Sequence[str]):
+    types = {"id": pa.int64(), "sensor_id": pa.string(), "timestamp": pa.timestamp("us")}
+    return pa.schema([(name, types.get(name, pa.float64())) for name in names])
+
+
+async def stream_export(query, names: Sequence[str], fmt: str) -> AsyncIterator:
+    """Encode the query result chunk by chunk in the requested format"""
+    engine = get_async_engine()
+    async with engine.connect() as conn:
+        result = await conn.stream(query.execution_options(yield_per=EXPORT_CHUNK_ROWS))
+
+        if fmt == "parquet":
+            schema = _arrow_schema(names)
+            sink = _ChunkSink()
+            writer = pq.ParquetWriter(sink, schema, compression="zstd")
+            async for rows in result.partitions(EXPORT_CHUNK_ROWS):
+                columns = list(zip(*rows))
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                    schema=schema,
+                ))
+                yield sink.drain()
+            writer.close()
+            yield sink.drain()
+            return
+
+        if fmt == "csv":
+            yield _csv_chunk([], header=names)
+        async for rows in result.partitions(EXPORT_CHUNK_ROWS):
+            yield _csv_chunk(rows) if fmt == "csv" else _ndjson_chunk(rows, names)
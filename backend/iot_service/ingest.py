@@ -0,0 +1,193 @@
+"""
+Ingestion helpers shared by the HTTP, batch and MQTT ingestion paths
+Converts validated SensorData into sensor_readings rows and writes them in bulk
+"""
+import json
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from shared.database import SensorReading, LatestReading
+from shared.models import SensorData
+from shared.sensor_cache import sensor_cache
+from shared.api_keys import hash_many, key_matches
+from shared.pubsub import EventBroker
+from last_seen import last_seen_tracker
+
+# Upper bound on rows accepted in one batch request
+MAX_BATCH_SIZE = 5000
+
+UNKNOWN_SENSOR_ERROR = "Sensor not found. Please register first."
+INVALID_KEY_ERROR = "Invalid or missing API key"
+
+# Live fan-out of newly ingested readings (GET /stream/readings)
+reading_broker = EventBroker()
+
+LATEST_COLUMNS = [
+    "sensor_id", "timestamp", "latitude", "longitude", "pm25", "pm10",
+    "no2", "co", "o3", "so2", "temperature", "humidity", "pressure",
+]
+
+
+def utc_naive(timestamp: Optional[datetime]) -> datetime:
+    """
+    Naive UTC, as stored in the DateTime columns
+    Devices may send offset-aware timestamps while readings without one get
+    utcnow(); mixing both in a batch would make comparisons raise TypeError.
+    """
+    if timestamp is None:
+        return datetime.utcnow()
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def reading_row(data: SensorData) -> Dict[str, Any]:
+    """Build a sensor_readings row (column -> value) from validated sensor data"""
+    return {
+        "sensor_id": data.sensor_id,
+        "timestamp": utc_naive(data.timestamp),
+        "latitude": data.latitude,
+        "longitude": data.longitude,
+        "pm25": data.pm25,
+        "pm10": data.pm10,
+        "no2": data.no2,
+        "co": data.co,
+        "o3": data.o3,
+        "so2": data.so2,
+        "temperature": data.temperature,
+        "humidity": data.humidity,
+        "pressure": data.pressure,
+        "extra_data": data.extra_data,
+    }
+
+
+def parse_batch(body: bytes, content_type: str) -> Tuple[List[Tuple[int, SensorData]], List[Dict[str, Any]]]:
+    """
+    Parse a batch payload (JSON array or NDJSON) into validated readings
+    Returns (accepted, rejected) where accepted holds (row index, SensorData)
+    """
+    accepted = []
+    rejected = []
+
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        for line in body.splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError as e:
+                items.append(e)
+    else:
+        try:
+            items = json.loads(body or b"[]")
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON: {e}")
+        if not isinstance(items, list):
+            raise ValueError("Batch payload must be a JSON array")
+
+    if len(items) > MAX_BATCH_SIZE:
+        raise ValueError(f"Batch too large (max {MAX_BATCH_SIZE} readings)")
+
+    for index, item in enumerate(items):
+        if isinstance(item, Exception):
+            rejected.append({"index": index, "error": f"Invalid JSON: {item}"})
+            continue
+        try:
+            accepted.append((index, SensorData.model_validate(item)))
+        except ValidationError as e:
+            rejected.append({"index": index, "error": e.errors(include_url=False)})
+
+    return accepted, rejected
+
+
+def insert_readings(db: Session, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Write all rows with multi-row INSERTs and return the new ids in row order
+    SQLAlchemy's insertmanyvalues renders this as INSERT ... VALUES (...), (...)
+    """
+    if not rows:
+        return []
+
+    result = db.execute(
+        insert(SensorReading).returning(SensorReading.id, sort_by_parameter_order=True),
+        rows
+    )
+    return [row[0] for row in result]
+
+
+
+def upsert_latest(db: Session, rows: List[Dict[str, Any]], reading_ids: List[int]):
+    """
+    Upsert the newest row of each sensor into latest_readings
+    Older readings (late or out-of-order delivery) never replace a newer one.
+    Rows are upserted in sensor_id order so concurrent writers (HTTP, batch,
+    MQTT) take latest_readings row locks in the same order and cannot deadlock.
+    """
+    newest = {}
+    for row, reading_id in zip(rows, reading_ids):
+        current = newest.get(row["sensor_id"])
+        if current is None or row["timestamp"] >= current["timestamp"]:
+            newest[row["sensor_id"]] = {
+                **{col: row[col] for col in LATEST_COLUMNS},
+                "reading_id": reading_id,
+            }
+    if not newest:
+        return
+
+    stmt = pg_insert(LatestReading).values([newest[sensor_id] for sensor_id in sorted(newest)])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[LatestReading.sensor_id],
+        set_={col: stmt.excluded[col] for col in LATEST_COLUMNS[1:] + ["reading_id"]},
+        where=LatestReading.timestamp <= stmt.excluded.timestamp,
+    ))
+
+
+def write_rows(db: Session, rows: List[Dict[str, Any]]) -> List[int]:
+    """Insert readings, refresh latest_readings and commit; returns reading ids"""
+    reading_ids = insert_readings(db, rows)
+    upsert_latest(db, rows, reading_ids)
+    db.commit()
+    last_seen_tracker.touch(row["sensor_id"] for row in rows)
+
+    for row, reading_id in zip(rows, reading_ids):
+        reading_broker.publish_threadsafe({
+            "id": reading_id,
+            **{col: row[col] for col in LATEST_COLUMNS},
+        })
+    return reading_ids
+
+
+def store_readings(db: Session, items: List[Tuple[int, SensorData]], api_key: Optional[str] = None):
+    """
+    Validate sensors and API keys, then write a batch of readings in one transaction
+    Each reading is checked against its own `api_key` field, falling back to
+    the request-level key. Returns (accepted, rejected, rows) where accepted
+    holds (index, reading_id).
+    """
+    # Resolve all distinct sensors; cache misses are loaded with a single query
+    known = sensor_cache.get_many(db, {data.sensor_id for _, data in items})
+    digests = hash_many(data.api_key or api_key for _, data in items)
+
+    valid = []
+    rejected = []
+    for index, data in items:
+        sensor = known.get(data.sensor_id)
+        if sensor is None:
+            rejected.append({"index": index, "error": UNKNOWN_SENSOR_ERROR})
+        elif not key_matches(sensor.api_key_hash, digests[data.api_key or api_key]):
+            rejected.append({"index": index, "error": INVALID_KEY_ERROR})
+        else:
+            valid.append((index, data))
+
+    rows = [reading_row(data) for _, data in valid]
+    reading_ids = write_rows(db, rows)
+
+    accepted = [(index, reading_id) for (index, _), reading_id in zip(valid, reading_ids)]
+    return accepted, rejected, rows
@@ -0,0 +1,111 @@
+"""
+Write-behind tracking of Sensor.last_seen
+Ingestion only records the latest contact time in memory; a background task
+flushes all pending values with one UPDATE ... FROM (VALUES ...) per interval,
+so the `sensors` rows are no longer locked by every reading.
+"""
+import asyncio
+import os
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import update, values, column, func, String, DateTime
+
+from shared.database import SessionLocal, Sensor
+
+LAST_SEEN_FLUSH_INTERVAL = float(os.getenv("LAST_SEEN_FLUSH_INTERVAL", "10"))
+
+
+class LastSeenTracker:
+    """Coalesces last_seen updates per sensor and flushes them in bulk"""
+
+    def __init__(self):
+        self._pending: Dict[str, datetime] = {}
+        self._latest: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self.flushes = 0
+        self.rows_flushed = 0
+
+    def touch(self, sensor_ids: Iterable[str], seen_at: Optional[datetime] = None):
+        """Record contact for the given sensors"""
+        seen_at = seen_at or datetime.utcnow()
+        with self._lock:
+            for sensor_id in sensor_ids:
+                self._pending[sensor_id] = seen_at
+                self._latest[sensor_id] = seen_at
+
+    def get(self, sensor_id: str) -> Optional[datetime]:
+        """Most recent contact time seen by this process (flushed or not)"""
+        with self._lock:
+            return self._latest.get(sensor_id)
+
+    def merge(self, sensor_id: str, stored: Optional[datetime]) -> Optional[datetime]:
+        """Return the fresher of the stored and in-memory last_seen values"""
+        recent = self.get(sensor_id)
+        if stored is None or (recent is not None and recent > stored):
+            return recent
+        return stored
+
+    def flush(self) -> int:
+        """Write all pending values with a single UPDATE ... FROM (VALUES ...)"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        if not pending:
+            return 0
+
+        v = values(
+            column("sensor_id", String),
+            column("last_seen", DateTime),
+            name="v"
+        ).data(list(pending.items()))
+
+        db = SessionLocal()
+        try:
+            db.execute(
+                update(Sensor)
+                .where(Sensor.sensor_id == v.c.sensor_id)
+                .values(last_seen=func.greatest(
+                    func.coalesce(Sensor.last_seen, v.c.last_seen), v.c.last_seen
+                ))
+            )
+            db.commit()
+        except Exception:
+            db.rollback()
+            # Put the values back so the next flush retries them
+            with self._lock:
+                for sensor_id, seen_at in pending.items():
+                    current = self._pending.get(sensor_id)
+                    if current is None or seen_at > current:
+                        self._pending[sensor_id] = seen_at
+            raise
+        finally:
+            db.close()
+
+        self.flushes += 1
+        self.rows_flushed += len(pending)
+        return len(pending)
+
+    async def run(self, interval: float = LAST_SEEN_FLUSH_INTERVAL):
+        """Background flush loop (started from the service startup hook)"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.flush)
+            except Exception as e:
+                print(f"⚠️  last_seen flush failed (will retry): {e}")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "flushes": self.flushes,
+            "rows_flushed": self.rows_flushed,
+            "flush_interval_seconds": LAST_SEEN_FLUSH_INTERVAL,
+        }
+
+
+# Process-wide tracker
+last_seen_tracker = LastSeenTracker()
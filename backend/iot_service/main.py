@@ -2,22 +2,61 @@
 IoT Service - Sensor Data Ingestion
 Accepts data from IoT sensors via HTTP/MQTT
 """
-from fastapi import FastAPI, HTTPException, Depends, Header
+from fastapi import FastAPI, HTTPException, Depends, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, List
+import asyncio
 import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from shared.database import get_db, init_db, SensorReading, Sensor
+from shared.database import get_db, get_async_db, init_db, SensorReading, Sensor, LatestReading
 from shared.models import SensorData, SensorRegistration
 from shared.firebase_config import db as firestore_db
+from shared.sensor_cache import sensor_cache
+from shared.timescale import storage_stats
+from shared.pubsub import parse_filter, sse_response, TooManySubscribers
+from shared.pagination import after_key, clamp_limit, decode_cursor, split_page
+from shared.api_keys import generate_api_key, hash_api_key, key_matches
+from shared.auth import CurrentUser, get_optional_user
+from shared.ratelimit import RateLimiter, RateLimitMiddleware, RateLimitRule
+from shared.metrics import MetricsMiddleware, INGEST_ROWS
+from ingest import parse_batch, reading_row, store_readings, write_rows, reading_broker, INVALID_KEY_ERROR
+from last_seen import last_seen_tracker
+from export import FORMATS, export_query, parse_after, parse_columns, stream_export, pa, KEY_COLUMNS
+from columnar import COLUMNS_MAX_ROWS, arrow_payload, columns_query, json_payload, parse_fields, to_columns
+from mqtt_worker import MQTTIngestWorker, MQTT_BROKER_HOST
 
 app = FastAPI(title="IoT Sensor Data Service", version="1.0.0")
 
+# MQTT ingestion runs only when a broker is configured
+mqtt_worker = MQTTIngestWorker() if MQTT_BROKER_HOST else None
+
+
+def verified_sensor_key(sensor_id: str, api_key: str) -> bool:
+    """Rate-limit key check against the cached registry only (no database on the event loop)"""
+    sensor = sensor_cache.peek(sensor_id)
+    return (sensor is not None and sensor.api_key_hash is not None
+            and key_matches(sensor.api_key_hash, hash_api_key(api_key)))
+
+
+# Per-sensor, per-key and per-client token buckets (added before CORS so 429s carry CORS headers)
+rate_limiter = RateLimiter([
+    RateLimitRule("sensor", "/sensor/data", "sensor_id",
+                  os.getenv("RATE_LIMIT_SENSOR", "1/s,burst=10"), methods=("POST",)),
+    RateLimitRule("api_key", "/sensor/*", "api_key",
+                  os.getenv("RATE_LIMIT_API_KEY", "50/s,burst=200"), methods=("POST",)),
+    RateLimitRule("client", "*", "ip", os.getenv("RATE_LIMIT_CLIENT", "100/s,burst=200")),
+], key_verifier=verified_sensor_key)
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,14 +66,33 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics and /metrics (added last, so it is the outermost middleware)
+app.add_middleware(MetricsMiddleware)
+
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize database on startup"""
     init_db()
+    reading_broker.bind_loop(asyncio.get_running_loop())
+    app.state.last_seen_task = asyncio.create_task(last_seen_tracker.run())
+    if mqtt_worker:
+        mqtt_worker.start()
     print("🚀 IoT Service started")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background work and flush pending last_seen updates"""
+    if mqtt_worker:
+        await asyncio.to_thread(mqtt_worker.stop)
+    app.state.last_seen_task.cancel()
+    try:
+        await asyncio.to_thread(last_seen_tracker.flush)
+    except Exception as e:
+        print(f"⚠️  Final last_seen flush failed: {e}")
+
+
 @app.get("/")
 async def root():
     return {
@@ -45,18 +103,21 @@ async def root():
 
 
 @app.post("/sensor/register")
-async def register_sensor(
+def register_sensor(
     sensor: SensorRegistration,
     db: Session = Depends(get_db)
 ):
     """
     Register a new sensor in the system
+    The response carries the sensor's API key; only its hash is stored, so it
+    cannot be shown again (rotate it to get a new one).
     """
     # Check if sensor already exists
     existing = db.query(Sensor).filter(Sensor.sensor_id == sensor.sensor_id).first()
     if existing:
         raise HTTPException(status_code=400, detail="Sensor already registered")
 
+    api_key = generate_api_key()
     new_sensor = Sensor(
         sensor_id=sensor.sensor_id,
         name=sensor.name,
@@ -66,13 +127,18 @@ async def register_sensor(
         sensor_type=sensor.sensor_type,
         status="active",
         last_seen=datetime.utcnow(),
-        extra_data=sensor.extra_data
+        extra_data=sensor.extra_data,
+        api_key_hash=hash_api_key(api_key),
+        api_key_rotated_at=datetime.utcnow(),
     )
 
     db.add(new_sensor)
     db.commit()
     db.refresh(new_sensor)
 
+    # Replace any cached (possibly negative) entry for this sensor
+    sensor_cache.put(new_sensor)
+
     # Also save to Firestore for quick access (if available)
     if firestore_db:
         try:
@@ -90,56 +156,76 @@ async def register_sensor(
         except Exception as e:
             print(f"⚠️  Firestore update failed (non-critical): {e}")
 
-    return {"message": "Sensor registered successfully", "sensor_id": sensor.sensor_id}
+    return {"message": "Sensor registered successfully", "sensor_id": sensor.sensor_id, "api_key": api_key}
 
 
-@app.post("/sensor/data")
-async def ingest_sensor_data(
-    data: SensorData,
+@app.post("/sensor/{sensor_id}/api-key")
+def rotate_api_key(
+    sensor_id: str,
     x_api_key: Optional[str] = Header(None),
+    current_user: Optional[CurrentUser] = Depends(get_optional_user),
     db: Session = Depends(get_db)
 ):
     """
-    Ingest sensor data (from IoT devices)
-    Accepts data via HTTP POST with optional API key authentication
+    Issue a new API key for a sensor (the old one stops working)
+    Authorized by the sensor's current key, or by an admin token (lost keys,
+    sensors registered before keys existed).
     """
-    # Validate sensor exists
-    sensor = db.query(Sensor).filter(Sensor.sensor_id == data.sensor_id).first()
+    sensor = db.query(Sensor).filter(Sensor.sensor_id == sensor_id).first()
     if not sensor:
-        raise HTTPException(status_code=404, detail="Sensor not found. Please register first.")
+        raise HTTPException(status_code=404, detail="Sensor not found")
 
-    # Create reading
-    reading = SensorReading(
-        sensor_id=data.sensor_id,
-        timestamp=data.timestamp or datetime.utcnow(),
-        latitude=data.latitude,
-        longitude=data.longitude,
-        pm25=data.pm25,
-        pm10=data.pm10,
-        no2=data.no2,
-        co=data.co,
-        o3=data.o3,
-        so2=data.so2,
-        temperature=data.temperature,
-        humidity=data.humidity,
-        pressure=data.pressure,
-        extra_data=data.extra_data
+    is_admin = current_user is not None and current_user.role == "admin"
+    has_key = (
+        sensor.api_key_hash is not None and x_api_key is not None
+        and key_matches(sensor.api_key_hash, hash_api_key(x_api_key))
     )
+    if not (is_admin or has_key):
+        raise HTTPException(status_code=401, detail=INVALID_KEY_ERROR)
 
-    db.add(reading)
+    api_key = generate_api_key()
+    sensor.api_key_hash = hash_api_key(api_key)
+    sensor.api_key_rotated_at = datetime.utcnow()
+    db.commit()
+    db.refresh(sensor)
 
-    # Update sensor last seen
-    sensor.last_seen = datetime.utcnow()
+    # Other replicas pick up the new hash when their cache entry expires
+    sensor_cache.put(sensor)
 
-    db.commit()
-    db.refresh(reading)
+    return {"sensor_id": sensor_id, "api_key": api_key, "rotated_at": sensor.api_key_rotated_at}
+
+
+@app.post("/sensor/data")
+def ingest_sensor_data(
+    data: SensorData,
+    x_api_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Ingest sensor data (from IoT devices)
+    Authenticated with the sensor's API key (X-API-Key header or api_key field)
+    """
+    # Validate sensor and key (served from the in-process registry cache)
+    sensor = sensor_cache.get(db, data.sensor_id)
+    if not sensor:
+        INGEST_ROWS.labels("http", "rejected").inc()
+        raise HTTPException(status_code=404, detail="Sensor not found. Please register first.")
+    api_key = x_api_key or data.api_key
+    if not key_matches(sensor.api_key_hash, hash_api_key(api_key) if api_key else None):
+        INGEST_ROWS.labels("http", "rejected").inc()
+        raise HTTPException(status_code=401, detail=INVALID_KEY_ERROR)
+
+    # Create reading, refresh latest_readings and record last_seen
+    row = reading_row(data)
+    reading_id = write_rows(db, [row])[0]
+    INGEST_ROWS.labels("http", "accepted").inc()
 
     # Store latest reading in Firestore for real-time access (if available)
     if firestore_db:
         try:
             firestore_db.collection('latest_readings').document(data.sensor_id).set({
                 'sensor_id': data.sensor_id,
-                'timestamp': reading.timestamp,
+                'timestamp': row["timestamp"],
                 'latitude': data.latitude,
                 'longitude': data.longitude,
                 'pm25': data.pm25,
@@ -158,26 +244,177 @@ async def ingest_sensor_data(
 
     return {
         "message": "Data ingested successfully",
-        "reading_id": reading.id,
-        "timestamp": reading.timestamp
+        "reading_id": reading_id,
+        "timestamp": row["timestamp"]
     }
 
 
+@app.post("/sensor/data/batch")
+async def ingest_sensor_data_batch(
+    request: Request,
+    x_api_key: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """
+    Ingest many readings in one request
+    Accepts a JSON array or NDJSON (application/x-ndjson) of SensorData
+    and returns per-row accept/reject results. X-API-Key applies to every
+    reading without its own api_key field.
+    """
+    body = await request.body()
+    try:
+        accepted, rejected = parse_batch(body, request.headers.get("content-type", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    stored, unknown, rows = await run_in_threadpool(store_readings, db, accepted, x_api_key)
+    rejected.extend(unknown)
+    INGEST_ROWS.labels("batch", "accepted").inc(len(stored))
+    INGEST_ROWS.labels("batch", "rejected").inc(len(rejected))
+
+    # Mirror the newest reading of each sensor to Firestore in one batch (if available)
+    if firestore_db and rows:
+        try:
+            latest = {}
+            for row in rows:
+                current = latest.get(row["sensor_id"])
+                if current is None or row["timestamp"] >= current["timestamp"]:
+                    latest[row["sensor_id"]] = row
+            batch = firestore_db.batch()
+            for sensor_id, row in latest.items():
+                batch.set(
+                    firestore_db.collection('latest_readings').document(sensor_id),
+                    {**row, 'extra_data': row['extra_data'] or {}}
+                )
+            batch.commit()
+        except Exception as e:
+            print(f"⚠️  Firestore update failed (non-critical): {e}")
+
+    results = [
+        {"index": index, "status": "accepted", "reading_id": reading_id}
+        for index, reading_id in stored
+    ] + [
+        {"index": r["index"], "status": "rejected", "error": r["error"]}
+        for r in rejected
+    ]
+    results.sort(key=lambda r: r["index"])
+
+    return {
+        "message": "Batch processed",
+        "accepted": len(stored),
+        "rejected": len(rejected),
+        "results": results
+    }
+
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Sensor registry cache and last_seen write-behind counters
+    """
+    return {
+        "sensor_registry": sensor_cache.stats(),
+        "last_seen": last_seen_tracker.stats()
+    }
+
+
+@app.get("/ratelimit/stats")
+async def get_rate_limit_stats():
+    """Token-bucket limiter counters and rules"""
+    return rate_limiter.stats()
+
+
+@app.get("/mqtt/stats")
+async def get_mqtt_stats():
+    """
+    MQTT ingestion queue and throughput counters
+    """
+    if not mqtt_worker:
+        return {"enabled": False}
+    return {"enabled": True, **mqtt_worker.stats()}
+
+
+@app.get("/admin/storage")
+def get_storage_stats(db: Session = Depends(get_db)):
+    """
+    Chunk, compression and retention statistics for the readings hypertable
+    """
+    try:
+        return storage_stats(db.connection())
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"TimescaleDB stats unavailable: {e}")
+
+
+@app.get("/stream/readings")
+async def stream_readings(
+    request: Request,
+    sensor_id: Optional[str] = None,
+    bbox: Optional[str] = None
+):
+    """
+    Live stream of newly ingested readings (Server-Sent Events)
+    Optional filters: sensor_id=ID1,ID2 and bbox=min_lat,min_lon,max_lat,max_lon
+    """
+    try:
+        event_filter = parse_filter(sensor_id, bbox)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        subscription = reading_broker.subscribe(event_filter)
+    except TooManySubscribers:
+        raise HTTPException(status_code=503, detail="Too many stream subscribers")
+
+    return sse_response(reading_broker, subscription, request, "reading")
+
+
+@app.get("/stream/stats")
+async def get_stream_stats():
+    """
+    Live stream subscriber and eviction counters
+    """
+    return reading_broker.stats()
+
+
 @app.get("/sensors")
 async def list_sensors(
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    List all registered sensors
+    List registered sensors ordered by sensor_id
+    Without limit/cursor every sensor is returned (the map needs the full set);
+    with them the result is a page and next_cursor continues it. `total` is the
+    number of sensors matching the filter in both cases.
     """
-    query = db.query(Sensor)
+    query = select(Sensor)
     if status:
-        query = query.filter(Sensor.status == status)
+        query = query.where(Sensor.status == status)
+
+    if limit is None and cursor is None:
+        sensors = (await db.execute(query.order_by(Sensor.sensor_id))).scalars().all()
+        next_cursor, total = None, len(sensors)
+    else:
+        total = (await db.execute(
+            select(func.count()).select_from(query.subquery())
+        )).scalar()
+        page_query = query
+        if cursor:
+            try:
+                (after_id,) = decode_cursor(cursor, (str,))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            page_query = page_query.where(after_key([Sensor.sensor_id], [after_id], descending=False))
+        limit = clamp_limit(limit if limit is not None else 500)
+        sensors = (await db.execute(page_query.order_by(Sensor.sensor_id).limit(limit + 1))).scalars().all()
+        sensors, next_cursor = split_page(sensors, limit, lambda s: (s.sensor_id,))
 
-    sensors = query.all()
     return {
         "count": len(sensors),
+        "total": total,
+        "next_cursor": next_cursor,
         "sensors": [
             {
                 "sensor_id": s.sensor_id,
@@ -187,7 +424,7 @@ async def list_sensors(
                 "location_description": s.location_description,
                 "sensor_type": s.sensor_type,
                 "status": s.status,
-                "last_seen": s.last_seen
+                "last_seen": last_seen_tracker.merge(s.sensor_id, s.last_seen)
             }
             for s in sensors
         ]
@@ -197,14 +434,22 @@ async def list_sensors(
 @app.get("/sensor/{sensor_id}/latest")
 async def get_latest_reading(
     sensor_id: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get latest reading from a specific sensor
     """
-    reading = db.query(SensorReading).filter(
-        SensorReading.sensor_id == sensor_id
-    ).order_by(SensorReading.timestamp.desc()).first()
+    # Fast path: primary-key lookup in latest_readings
+    reading = await db.get(LatestReading, sensor_id)
+
+    if not reading:
+        # Sensors that reported before latest_readings existed
+        reading = (await db.execute(
+            select(SensorReading)
+            .where(SensorReading.sensor_id == sensor_id)
+            .order_by(SensorReading.timestamp.desc())
+            .limit(1)
+        )).scalars().first()
 
     if not reading:
         raise HTTPException(status_code=404, detail="No readings found")
@@ -226,24 +471,77 @@ async def get_latest_reading(
     }
 
 
+@app.get("/readings/latest")
+async def get_latest_readings(
+    max_age_minutes: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get the newest reading of every sensor in one call
+    """
+    query = select(LatestReading)
+    if max_age_minutes is not None:
+        query = query.where(
+            LatestReading.timestamp >= datetime.utcnow() - timedelta(minutes=max_age_minutes)
+        )
+
+    readings = (await db.execute(query.order_by(LatestReading.sensor_id))).scalars().all()
+
+    return {
+        "count": len(readings),
+        "readings": [
+            {
+                "sensor_id": r.sensor_id,
+                "reading_id": r.reading_id,
+                "timestamp": r.timestamp,
+                "latitude": r.latitude,
+                "longitude": r.longitude,
+                "pm25": r.pm25,
+                "pm10": r.pm10,
+                "no2": r.no2,
+                "co": r.co,
+                "o3": r.o3,
+                "so2": r.so2,
+                "temperature": r.temperature,
+                "humidity": r.humidity,
+                "pressure": r.pressure
+            }
+            for r in readings
+        ]
+    }
+
+
 @app.get("/readings/recent")
 async def get_recent_readings(
     limit: int = 100,
     sensor_id: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Get recent readings (for real-time monitoring)
+    Get recent readings, newest first (for real-time monitoring)
+    Pages are keyed on (timestamp, id); pass next_cursor to continue.
     """
-    query = db.query(SensorReading)
+    limit = clamp_limit(limit)
+    query = select(SensorReading)
 
     if sensor_id:
-        query = query.filter(SensorReading.sensor_id == sensor_id)
+        query = query.where(SensorReading.sensor_id == sensor_id)
+    if cursor:
+        try:
+            key = decode_cursor(cursor, (datetime, int))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        query = query.where(after_key([SensorReading.timestamp, SensorReading.id], key))
 
-    readings = query.order_by(SensorReading.timestamp.desc()).limit(limit).all()
+    readings = (await db.execute(
+        query.order_by(SensorReading.timestamp.desc(), SensorReading.id.desc()).limit(limit + 1)
+    )).scalars().all()
+    readings, next_cursor = split_page(readings, limit, lambda r: (r.timestamp, r.id))
 
     return {
         "count": len(readings),
+        "next_cursor": next_cursor,
         "readings": [
             {
                 "id": r.id,
@@ -263,6 +561,98 @@ async def get_recent_readings(
     }
 
 
+@app.get("/readings/export")
+async def export_readings(
+    start: datetime,
+    end: Optional[datetime] = None,
+    sensor_id: Optional[str] = None,
+    columns: Optional[str] = None,
+    format: str = "csv",
+    after: Optional[str] = None
+):
+    """
+    Stream historical readings as CSV, NDJSON or Parquet (constant memory)
+    sensor_id and columns are comma-separated; rows are ordered by (timestamp, id).
+    To resume an interrupted download pass after=<timestamp>,<id> of the last row received.
+    """
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(FORMATS)}")
+    if format == "parquet" and pa is None:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+
+    end = end or datetime.utcnow()
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    try:
+        selected = parse_columns(columns)
+        resume = parse_after(after)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    sensor_ids = [s.strip() for s in sensor_id.split(",") if s.strip()] if sensor_id else None
+    query = export_query(start, end, sensor_ids, selected, resume)
+    media_type, extension = FORMATS[format]
+    filename = f"readings_{start:%Y%m%dT%H%M}_{end:%Y%m%dT%H%M}.{extension}"
+
+    return StreamingResponse(
+        stream_export(query, [*KEY_COLUMNS, *selected], format),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "X-Export-Order": "timestamp,id",
+        },
+    )
+
+
+@app.get("/readings/columns")
+async def get_reading_columns(
+    start: datetime,
+    end: Optional[datetime] = None,
+    sensor_id: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: int = COLUMNS_MAX_ROWS,
+    cursor: Optional[str] = None,
+    format: str = "json",
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Bulk readings for a time range as one array per field (oldest first)
+    `timestamp` is epoch milliseconds; format=json or arrow (Arrow IPC stream).
+    When more rows remain, next_cursor (X-Next-Cursor for arrow) continues the range.
+    """
+    if format not in ("json", "arrow"):
+        raise HTTPException(status_code=400, detail="format must be json or arrow")
+    if format == "arrow" and pa is None:
+        raise HTTPException(status_code=501, detail="Arrow output requires pyarrow")
+
+    end = end or datetime.utcnow()
+    limit = clamp_limit(limit, COLUMNS_MAX_ROWS)
+    try:
+        selected = parse_fields(fields)
+        after = decode_cursor(cursor, (datetime, int)) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    sensor_ids = [s.strip() for s in sensor_id.split(",") if s.strip()] if sensor_id else None
+    rows = (await db.execute(
+        columns_query(start, end, sensor_ids, selected, after, limit + 1)
+    )).all()
+    rows, next_cursor = split_page(rows, limit, lambda r: (r[0], r[1]))
+
+    # Transposing and encoding 100k+ rows is CPU work; keep it off the event loop
+    columns = await run_in_threadpool(to_columns, rows, selected)
+    if format == "arrow":
+        body = await run_in_threadpool(arrow_payload, columns)
+        headers = {"X-Row-Count": str(len(rows))}
+        if next_cursor:
+            headers["X-Next-Cursor"] = next_cursor
+        return Response(content=body, media_type="application/vnd.apache.arrow.stream", headers=headers)
+
+    body = await run_in_threadpool(json_payload, columns, {"count": len(rows), "next_cursor": next_cursor})
+    return Response(content=body, media_type="application/json")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
@@ -0,0 +1,200 @@
+"""
+MQTT ingestion worker
+Subscribes to sensor topics, validates payloads against SensorData and buffers
+them in a bounded queue. A flusher thread writes the buffer to sensor_readings
+in batches triggered by size or time. Each message authenticates with the
+sensor's API key in its `api_key` field.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Optional, Dict, List, Tuple
+
+from pydantic import ValidationError
+
+from shared.database import SessionLocal
+from shared.models import SensorData
+from shared.metrics import INGEST_ROWS
+from ingest import store_readings, INVALID_KEY_ERROR
+
+MQTT_BROKER_HOST = os.getenv("MQTT_BROKER_HOST", "")
+MQTT_BROKER_PORT = int(os.getenv("MQTT_BROKER_PORT", "1883"))
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "sensors/+/data")
+MQTT_QOS = int(os.getenv("MQTT_QOS", "1"))
+MQTT_QUEUE_SIZE = int(os.getenv("MQTT_QUEUE_SIZE", "10000"))
+MQTT_BATCH_SIZE = int(os.getenv("MQTT_BATCH_SIZE", "500"))
+MQTT_FLUSH_INTERVAL = float(os.getenv("MQTT_FLUSH_INTERVAL", "1.0"))
+# "block" stalls the network thread (TCP backpressure to the broker), "drop" discards
+MQTT_OVERFLOW_POLICY = os.getenv("MQTT_OVERFLOW_POLICY", "block")
+MQTT_BLOCK_TIMEOUT = float(os.getenv("MQTT_BLOCK_TIMEOUT", "5.0"))
+
+
+class MQTTIngestWorker:
+    """Bounded-queue MQTT consumer with batched database flushes"""
+
+    def __init__(self,
+                 host: str = MQTT_BROKER_HOST,
+                 port: int = MQTT_BROKER_PORT,
+                 topic: str = MQTT_TOPIC,
+                 qos: int = MQTT_QOS,
+                 queue_size: int = MQTT_QUEUE_SIZE,
+                 batch_size: int = MQTT_BATCH_SIZE,
+                 flush_interval: float = MQTT_FLUSH_INTERVAL,
+                 overflow_policy: str = MQTT_OVERFLOW_POLICY,
+                 block_timeout: float = MQTT_BLOCK_TIMEOUT,
+                 session_factory=SessionLocal):
+        if overflow_policy not in ("block", "drop"):
+            raise ValueError(f"Unknown MQTT overflow policy: {overflow_policy}")
+
+        self.host = host
+        self.port = port
+        self.topic = topic
+        self.qos = qos
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+        self.session_factory = session_factory
+
+        self.queue: "queue.Queue[SensorData]" = queue.Queue(maxsize=queue_size)
+        self.client = None
+        self._stop = threading.Event()
+        self._flusher: Optional[threading.Thread] = None
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            "received": 0,
+            "invalid": 0,
+            "dropped": 0,
+            "written": 0,
+            "unknown_sensor": 0,
+            "unauthorized": 0,
+            "batches": 0,
+            "failed_batches": 0,
+        }
+
+    def _count(self, name: str, amount: int = 1):
+        with self._counters_lock:
+            self.counters[name] += amount
+
+    # Broker side
+
+    def start(self):
+        """Connect to the broker and start the network and flusher threads"""
+        import paho.mqtt.client as mqtt
+
+        self._stop.clear()
+        self._flusher = threading.Thread(target=self._flush_loop, name="mqtt-flusher", daemon=True)
+        self._flusher.start()
+
+        self.client = mqtt.Client(client_id=f"iot-service-{os.getpid()}", clean_session=True)
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.connect_async(self.host, self.port, keepalive=60)
+        self.client.loop_start()
+        print(f"📡 MQTT worker subscribing to {self.topic} on {self.host}:{self.port}")
+
+    def stop(self):
+        """Disconnect and flush everything still buffered"""
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval * 5)
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(self.topic, qos=self.qos)
+        else:
+            print(f"⚠️  MQTT connection refused (rc={rc})")
+
+    def _on_message(self, client, userdata, msg):
+        self.handle_payload(msg.payload)
+
+    def handle_payload(self, payload: bytes) -> bool:
+        """
+        Validate one message and enqueue it
+        Called from the MQTT network thread; also usable directly with a fake broker
+        """
+        self._count("received")
+        try:
+            data = SensorData.model_validate_json(payload)
+        except ValidationError:
+            self._count("invalid")
+            INGEST_ROWS.labels("mqtt", "invalid").inc()
+            return False
+
+        try:
+            if self.overflow_policy == "block":
+                self.queue.put(data, timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait(data)
+        except queue.Full:
+            self._count("dropped")
+            INGEST_ROWS.labels("mqtt", "dropped").inc()
+            return False
+        return True
+
+    # Database side
+
+    def _drain(self) -> List[Tuple[int, SensorData]]:
+        """Collect up to batch_size items, waiting at most flush_interval"""
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append((len(batch), self.queue.get(timeout=remaining)))
+            except queue.Empty:
+                break
+        return batch
+
+    def flush_batch(self, batch: List[Tuple[int, SensorData]]):
+        """Write one batch to sensor_readings"""
+        if not batch:
+            return
+
+        db = self.session_factory()
+        try:
+            accepted, rejected, _ = store_readings(db, batch)
+            unauthorized = sum(1 for r in rejected if r["error"] == INVALID_KEY_ERROR)
+            self._count("written", len(accepted))
+            self._count("unauthorized", unauthorized)
+            self._count("unknown_sensor", len(rejected) - unauthorized)
+            self._count("batches")
+            INGEST_ROWS.labels("mqtt", "accepted").inc(len(accepted))
+            INGEST_ROWS.labels("mqtt", "rejected").inc(len(rejected))
+        except Exception as e:
+            db.rollback()
+            self._count("failed_batches")
+            self._count("dropped", len(batch))
+            INGEST_ROWS.labels("mqtt", "failed").inc(len(batch))
+            print(f"⚠️  MQTT batch write failed ({len(batch)} readings): {e}")
+        finally:
+            db.close()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self.flush_batch(self._drain())
+
+        # Final drain after stop()
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append((len(batch), self.queue.get_nowait()))
+            self.flush_batch(batch)
+
+    def stats(self) -> Dict:
+        with self._counters_lock:
+            counters = dict(self.counters)
+        return {
+            **counters,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "overflow_policy": self.overflow_policy,
+            "topic": self.topic,
+            "connected": bool(self.client and self.client.is_connected()),
+        }
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Same import layout as the service: iot_service modules plus backend/shared
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..'))
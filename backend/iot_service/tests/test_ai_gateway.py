@@ -0,0 +1,117 @@
+"""
+Circuit breaker and AI gateway (shared.ai_gateway)
+The gateway wraps a stub client whose generate() can succeed, fail or stall.
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from shared.ai_gateway import AIGateway, AITimeout, AIUnavailable, CircuitBreaker, CircuitOpen
+
+
+class StubClient:
+    model_name = "stub"
+    available = True
+
+    def __init__(self, delay=0.0, fail=False):
+        self.delay = delay
+        self.fail = fail
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, prompt):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("upstream error")
+        return f"answer to {prompt}"
+
+
+def make_gateway(client, **kwargs):
+    options = dict(max_concurrency=2, timeout=0.5, slow_threshold=5.0, cache=None,
+                   breaker=CircuitBreaker(failure_threshold=2, reset_after=0.1))
+    options.update(kwargs)
+    return AIGateway(client, **options)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_after=60)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.trips == 1
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_after=60)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_allows_one_half_open_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+
+
+def test_breaker_closes_after_successful_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_after=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_gateway_returns_the_model_answer():
+    gateway = make_gateway(StubClient())
+    assert asyncio.run(gateway.generate("hi")) == "answer to hi"
+    assert gateway.counters["succeeded"] == 1
+    assert gateway.breaker.state == "closed"
+
+
+def test_gateway_times_out_and_trips_the_breaker():
+    client = StubClient(delay=0.3)
+    gateway = make_gateway(client, timeout=0.05)
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(AITimeout):
+                await gateway.generate("slow")
+        with pytest.raises(CircuitOpen):
+            await gateway.generate("slow")
+
+    asyncio.run(run())
+    assert gateway.counters["timeouts"] == 2
+    assert gateway.counters["rejected"] == 1
+    assert client.calls == 2
+
+
+def test_gateway_wraps_upstream_errors():
+    gateway = make_gateway(StubClient(fail=True))
+    with pytest.raises(AIUnavailable):
+        asyncio.run(gateway.generate("hi"))
+    assert gateway.counters["failed"] == 1
+
+
+def test_generate_or_fallback_returns_fallback():
+    gateway = make_gateway(StubClient(fail=True))
+    assert asyncio.run(gateway.generate_or_fallback("hi", "fallback")) == "fallback"
+    assert gateway.counters["fallbacks"] == 1
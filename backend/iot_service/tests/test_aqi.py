@@ -0,0 +1,63 @@
+"""
+EPA breakpoint tables (shared.aqi)
+One concentration inside every segment of every pollutant, given in EPA table
+units (ppb, ppm, µg/m³) and converted back to the stored units.
+"""
+import numpy as np
+import pytest
+
+from shared.aqi import UNIT_FACTORS, _CONCENTRATIONS, calculate_aqi, compute_aqi, sub_index
+
+SEGMENT_CASES = {
+    "pm25": [(6.0, 25), (20.0, 68), (45.0, 124), (100.0, 174), (200.0, 250), (300.0, 350), (400.0, 434)],
+    "pm10": [(30, 28), (100, 73), (200, 123), (300, 173), (400, 266), (450, 332), (550, 446)],
+    # 8-hour table up to 200 ppb, then the 1-hour table
+    "o3": [(30, 28), (60, 67), (81, 136), (95, 174), (150, 247),
+           (202, 197), (250, 223), (450, 346), (550, 446)],
+    "co": [(2.0, 23), (7.0, 76), (11.0, 126), (14.0, 176), (20.0, 231), (35.0, 346), (45.0, 446)],
+    "so2": [(20, 29), (50, 69), (100, 112), (250, 178), (400, 232), (700, 348), (900, 448)],
+    "no2": [(30, 28), (80, 79), (200, 120), (500, 175), (1000, 259), (1400, 338), (1800, 438)],
+}
+
+
+@pytest.mark.parametrize("pollutant", sorted(SEGMENT_CASES))
+def test_every_segment_is_covered(pollutant):
+    assert len(SEGMENT_CASES[pollutant]) == len(_CONCENTRATIONS[pollutant])
+
+
+@pytest.mark.parametrize("pollutant,concentration,expected", [
+    (pollutant, concentration, expected)
+    for pollutant, cases in SEGMENT_CASES.items()
+    for concentration, expected in cases
+])
+def test_sub_index_inside_each_segment(pollutant, concentration, expected):
+    stored = concentration / UNIT_FACTORS[pollutant]
+    assert sub_index(pollutant, stored)[0] == expected
+
+
+def test_segment_boundaries_are_not_truncated_down():
+    assert sub_index("pm25", 35.4)[0] == 100
+    assert sub_index("pm25", 35.5)[0] == 101
+    assert sub_index("co", 9.4 / UNIT_FACTORS["co"])[0] == 100
+
+
+def test_concentrations_above_the_table_cap_at_500():
+    assert sub_index("pm25", 900.0)[0] == 500
+
+
+def test_compute_aqi_picks_dominant_pollutant_per_row():
+    aqi, dominant = compute_aqi({
+        "pm25": [6.0, 100.0, None],
+        "o3": [250 / UNIT_FACTORS["o3"], None, None],
+    })
+    assert aqi[:2].tolist() == [223, 174]
+    assert np.isnan(aqi[2])
+    assert dominant.tolist() == ["o3", "pm25", None]
+
+
+def test_calculate_aqi_reports_category_and_display_name():
+    result = calculate_aqi(pm25=20.0, no2=30 / UNIT_FACTORS["no2"])
+    assert result["aqi"] == 68
+    assert result["category"] == "Moderate"
+    assert result["dominant_pollutant"] == "PM2.5"
+    assert calculate_aqi()["category"] == "No Data"
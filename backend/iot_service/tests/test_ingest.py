@@ -0,0 +1,141 @@
+"""
+Batch ingestion helpers (ingest.py) with a stub session
+The registry cache and last-seen tracker are replaced, so store_readings runs
+end to end without a database.
+"""
+import json
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+import ingest
+from shared.api_keys import hash_api_key
+
+API_KEY = "sk_test-key"
+
+
+class StubResult(list):
+    pass
+
+
+class StubSession:
+    """Records executed statements; bulk inserts return sequential ids"""
+
+    def __init__(self):
+        self.statements = []
+        self.committed = False
+        self.next_id = 1
+
+    def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        if params is not None:
+            ids = list(range(self.next_id, self.next_id + len(params)))
+            self.next_id += len(params)
+            return StubResult((reading_id,) for reading_id in ids)
+        return StubResult()
+
+    def commit(self):
+        self.committed = True
+
+
+class StubCache:
+    def __init__(self, *sensor_ids):
+        self.sensors = {
+            sensor_id: SimpleNamespace(sensor_id=sensor_id, api_key_hash=hash_api_key(API_KEY))
+            for sensor_id in sensor_ids
+        }
+
+    def get_many(self, db, sensor_ids):
+        return {s: self.sensors[s] for s in sensor_ids if s in self.sensors}
+
+
+@pytest.fixture
+def stubs(monkeypatch):
+    monkeypatch.setattr(ingest, "sensor_cache", StubCache("SENSOR_001", "SENSOR_002"))
+    monkeypatch.setattr(ingest, "last_seen_tracker", SimpleNamespace(touch=lambda ids: list(ids)))
+
+
+def reading(sensor_id="SENSOR_001", timestamp=None, pm25=10.0):
+    item = {"sensor_id": sensor_id, "latitude": 52.28, "longitude": 76.96, "pm25": pm25, "api_key": API_KEY}
+    if timestamp is not None:
+        item["timestamp"] = timestamp
+    return item
+
+
+def latest_upsert_values(db):
+    """sensor_id -> (timestamp, pm25) rendered into the latest_readings upsert"""
+    statement = next(s for s, params in db.statements if params is None)
+    params = statement.compile(dialect=postgresql.dialect()).params
+    rows = {}
+    for key, value in params.items():
+        column, _, position = key.rpartition("_m")
+        rows.setdefault(position, {})[column] = value
+    return {row["sensor_id"]: (row["timestamp"], row["pm25"]) for row in rows.values()}
+
+
+def test_utc_naive_converts_aware_timestamps():
+    aware = datetime.fromisoformat("2025-01-01T06:00:00+06:00")
+    assert ingest.utc_naive(aware) == datetime(2025, 1, 1, 0, 0)
+    assert ingest.utc_naive(datetime(2025, 1, 1, 12, 0)) == datetime(2025, 1, 1, 12, 0)
+    assert ingest.utc_naive(None).tzinfo is None
+
+
+def test_batch_with_mixed_timestamps(stubs):
+    body = json.dumps([
+        reading("SENSOR_001", "2025-01-01T00:00:00Z", pm25=11.0),
+        reading("SENSOR_001", pm25=12.0),  # no timestamp: stamped with utcnow()
+        reading("SENSOR_002", "2025-01-01T08:00:00+06:00", pm25=21.0),
+        reading("SENSOR_002", "2025-01-01T01:30:00", pm25=22.0),
+    ]).encode()
+    items, rejected = ingest.parse_batch(body, "application/json")
+    assert rejected == []
+
+    db = StubSession()
+    accepted, rejected, rows = ingest.store_readings(db, items)
+
+    assert [index for index, _ in accepted] == [0, 1, 2, 3]
+    assert rejected == []
+    assert db.committed
+    assert all(row["timestamp"].tzinfo is None for row in rows)
+    assert rows[2]["timestamp"] == datetime(2025, 1, 1, 2, 0)
+
+    latest = latest_upsert_values(db)
+    assert latest["SENSOR_001"][1] == 12.0  # utcnow() is newer than 2025-01-01
+    assert latest["SENSOR_002"] == (datetime(2025, 1, 1, 2, 0), 21.0)
+
+
+def test_latest_upsert_is_sorted_by_sensor_id(stubs):
+    items = [(i, ingest.SensorData.model_validate(reading(s))) for i, s in
+             enumerate(["SENSOR_002", "SENSOR_001", "SENSOR_002"])]
+    db = StubSession()
+    ingest.store_readings(db, items)
+
+    statement = next(s for s, params in db.statements if params is None)
+    sql = str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert sql.index("'SENSOR_001'") < sql.index("'SENSOR_002'")
+
+
+def test_unknown_sensor_and_bad_key_are_rejected(stubs):
+    items = [
+        (0, ingest.SensorData.model_validate(reading("SENSOR_404"))),
+        (1, ingest.SensorData.model_validate({**reading("SENSOR_001"), "api_key": "sk_wrong"})),
+        (2, ingest.SensorData.model_validate(reading("SENSOR_002"))),
+    ]
+    db = StubSession()
+    accepted, rejected, _ = ingest.store_readings(db, items)
+
+    assert [index for index, _ in accepted] == [2]
+    assert rejected == [
+        {"index": 0, "error": ingest.UNKNOWN_SENSOR_ERROR},
+        {"index": 1, "error": ingest.INVALID_KEY_ERROR},
+    ]
+
+
+def test_parse_batch_ndjson_reports_bad_lines():
+    body = b"\n".join([json.dumps(reading()).encode(), b"{not json", json.dumps({"sensor_id": "x"}).encode()])
+    accepted, rejected = ingest.parse_batch(body, "application/x-ndjson")
+
+    assert [index for index, _ in accepted] == [0]
+    assert [r["index"] for r in rejected] == [1, 2]
@@ -0,0 +1,111 @@
+"""
+LLM response cache (shared.llm_cache)
+Single-flight coalescing, failure propagation and TTL/LRU behaviour, with
+plain coroutines standing in for model calls.
+"""
+import asyncio
+import time
+
+import pytest
+
+from shared.ai_gateway import AIUnavailable
+from shared.llm_cache import LLMCache, fingerprint
+
+
+def test_fingerprint_ignores_noise_in_inputs():
+    a = fingerprint("analysis", {"pm25": 35.2, "city": "Pavlodar  "}, bucket_seconds=0)
+    b = fingerprint("analysis", {"city": "pavlodar", "pm25": 34.8}, bucket_seconds=0)
+    assert a == b
+    assert a != fingerprint("prediction", {"pm25": 35.2, "city": "Pavlodar"}, bucket_seconds=0)
+
+
+def test_concurrent_callers_share_one_computation():
+    cache = LLMCache(disk_dir=None)
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert len(calls) == 1
+    assert cache.stats()["coalesced"] == 4
+    assert cache.get("k") == "answer"
+
+
+def test_failures_reach_every_waiter_and_are_not_cached():
+    cache = LLMCache(disk_dir=None)
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        raise AIUnavailable("upstream error")
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("k", compute) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, AIUnavailable) for r in results)
+    assert cache.get("k") is None
+    assert cache.stats()["inflight"] == 0
+
+
+def test_cancelled_leader_leaves_waiters_with_ai_unavailable():
+    cache = LLMCache(disk_dir=None)
+
+    async def compute():
+        await asyncio.sleep(10)
+        return "never"
+
+    async def run():
+        leader = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(cache.get_or_compute("k", compute))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(leader, waiter, return_exceptions=True)
+        return results
+
+    leader_result, waiter_result = asyncio.run(run())
+    assert isinstance(leader_result, asyncio.CancelledError)
+    assert isinstance(waiter_result, AIUnavailable)
+    assert cache.stats()["inflight"] == 0
+
+
+def test_entries_expire_after_ttl():
+    cache = LLMCache(ttl=0.05, disk_dir=None)
+    cache.put("k", "v")
+    assert cache.get("k") == "v"
+    time.sleep(0.06)
+    assert cache.get("k") is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = LLMCache(max_entries=2, disk_dir=None)
+    cache.put("a", "1")
+    cache.put("b", "2")
+    cache.get("a")
+    cache.put("c", "3")
+    assert cache.get("b") is None
+    assert cache.get("a") == "1" and cache.get("c") == "3"
+
+
+def test_disk_tier_survives_a_new_cache(tmp_path):
+    LLMCache(disk_dir=str(tmp_path)).put("k", "v")
+    cache = LLMCache(disk_dir=str(tmp_path))
+    assert cache.get("k") == "v"
+    assert cache.stats()["disk_hits"] == 1
+
+
+@pytest.mark.parametrize("key", [None, "k"])
+def test_invalidate(key):
+    cache = LLMCache(disk_dir=None)
+    cache.put("k", "v")
+    cache.put("other", "w")
+    cache.invalidate(key)
+    assert cache.get("k") is None
+    assert (cache.get("other") is None) == (key is None)
@@ -0,0 +1,238 @@
+"""
+MQTT ingestion worker against a fake broker
+Messages are delivered through _on_message with a stub client, and the
+flusher writes through a stub session factory; store_readings is replaced so
+no database is needed.
+"""
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import mqtt_worker
+from mqtt_worker import MQTTIngestWorker
+
+
+def reading(sensor_id="SENSOR_001", pm25=12.5):
+    return json.dumps({
+        "sensor_id": sensor_id,
+        "latitude": 52.28,
+        "longitude": 76.96,
+        "pm25": pm25,
+        "api_key": "test-key",
+    }).encode()
+
+
+class StubClient:
+    """Stands in for paho's client in broker callbacks"""
+
+    def __init__(self):
+        self.subscriptions = []
+
+    def subscribe(self, topic, qos=0):
+        self.subscriptions.append((topic, qos))
+
+    def is_connected(self):
+        return True
+
+
+class StubSession:
+    def __init__(self):
+        self.rolled_back = False
+        self.closed = False
+
+    def rollback(self):
+        self.rolled_back = True
+
+    def close(self):
+        self.closed = True
+
+
+class StubStore:
+    """Records the batches store_readings would have written"""
+
+    def __init__(self, fail=False):
+        self.batches = []
+        self.sessions = []
+        self.fail = fail
+        self.written = threading.Event()
+
+    def session_factory(self):
+        session = StubSession()
+        self.sessions.append(session)
+        return session
+
+    def store_readings(self, db, batch, api_key=None):
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        self.batches.append([data for _, data in batch])
+        self.written.set()
+        return [(index, 1000 + index) for index, _ in batch], [], []
+
+
+@pytest.fixture
+def store(monkeypatch):
+    stub = StubStore()
+    monkeypatch.setattr(mqtt_worker, "store_readings", stub.store_readings)
+    return stub
+
+
+def make_worker(store, **kwargs):
+    options = dict(queue_size=100, batch_size=100, flush_interval=0.05,
+                   overflow_policy="drop", block_timeout=0.05)
+    options.update(kwargs)
+    return MQTTIngestWorker(host="broker.test", session_factory=store.session_factory, **options)
+
+
+def deliver(worker, payload, client=None):
+    worker._on_message(client or StubClient(), None, SimpleNamespace(topic="sensors/x/data", payload=payload))
+
+
+def start_flusher(worker):
+    worker._flusher = threading.Thread(target=worker._flush_loop, daemon=True)
+    worker._flusher.start()
+
+
+def test_on_connect_subscribes_to_topic(store):
+    worker = make_worker(store, qos=1)
+    client = StubClient()
+    worker._on_connect(client, None, {}, 0)
+    assert client.subscriptions == [("sensors/+/data", 1)]
+
+
+def test_on_message_enqueues_valid_readings(store):
+    worker = make_worker(store)
+    deliver(worker, reading("SENSOR_007", pm25=40.0))
+
+    assert worker.queue.qsize() == 1
+    data = worker.queue.get_nowait()
+    assert data.sensor_id == "SENSOR_007"
+    assert data.pm25 == 40.0
+    assert data.api_key == "test-key"
+    assert worker.counters["received"] == 1
+
+
+def test_on_message_counts_invalid_payloads(store):
+    worker = make_worker(store)
+    deliver(worker, b"not json")
+    deliver(worker, json.dumps({"sensor_id": "SENSOR_001"}).encode())
+
+    assert worker.queue.empty()
+    assert worker.counters["received"] == 2
+    assert worker.counters["invalid"] == 2
+
+
+def test_drop_policy_discards_when_queue_is_full(store):
+    worker = make_worker(store, queue_size=2, overflow_policy="drop")
+    for _ in range(5):
+        deliver(worker, reading())
+
+    assert worker.queue.qsize() == 2
+    assert worker.counters["dropped"] == 3
+
+
+def test_block_policy_waits_for_space(store):
+    worker = make_worker(store, queue_size=1, overflow_policy="block", block_timeout=2.0)
+    deliver(worker, reading("SENSOR_001"))
+
+    # Free the slot shortly after the network thread starts blocking
+    threading.Timer(0.1, worker.queue.get_nowait).start()
+    started = time.monotonic()
+    deliver(worker, reading("SENSOR_002"))
+
+    assert 0.05 <= time.monotonic() - started < 2.0
+    assert worker.queue.get_nowait().sensor_id == "SENSOR_002"
+    assert worker.counters["dropped"] == 0
+
+
+def test_block_policy_drops_after_timeout(store):
+    worker = make_worker(store, queue_size=1, overflow_policy="block", block_timeout=0.1)
+    deliver(worker, reading())
+
+    started = time.monotonic()
+    deliver(worker, reading())
+
+    assert time.monotonic() - started >= 0.1
+    assert worker.queue.qsize() == 1
+    assert worker.counters["dropped"] == 1
+
+
+def test_unknown_overflow_policy_is_rejected(store):
+    with pytest.raises(ValueError):
+        make_worker(store, overflow_policy="spill")
+
+
+def test_flush_triggered_by_batch_size(store):
+    # The interval is far away, so only a full batch can trigger this flush
+    worker = make_worker(store, batch_size=3, flush_interval=30.0)
+    for i in range(3):
+        deliver(worker, reading(f"SENSOR_{i:03d}"))
+
+    started = time.monotonic()
+    batch = worker._drain()
+    assert time.monotonic() - started < 1.0
+    worker.flush_batch(batch)
+
+    assert [[d.sensor_id for d in b] for b in store.batches] == [["SENSOR_000", "SENSOR_001", "SENSOR_002"]]
+    assert worker.counters["written"] == 3
+    assert worker.counters["batches"] == 1
+    assert store.sessions[0].closed
+
+
+def test_flush_triggered_by_interval(store):
+    worker = make_worker(store, batch_size=100, flush_interval=0.2)
+    start_flusher(worker)
+    try:
+        started = time.monotonic()
+        deliver(worker, reading("SENSOR_001"))
+        deliver(worker, reading("SENSOR_002"))
+
+        assert store.written.wait(timeout=2.0)
+        assert time.monotonic() - started < 1.0
+        assert [len(b) for b in store.batches] == [2]
+        assert worker.counters["written"] == 2
+    finally:
+        worker.stop()
+
+
+def test_flusher_splits_backlog_into_batches(store):
+    worker = make_worker(store, batch_size=4, flush_interval=0.05)
+    for i in range(10):
+        deliver(worker, reading(f"SENSOR_{i:03d}"))
+
+    start_flusher(worker)
+    worker.stop()
+
+    assert [len(b) for b in store.batches] == [4, 4, 2]
+    assert worker.counters["written"] == 10
+    assert worker.queue.empty()
+
+
+def test_stop_flushes_buffered_readings(store):
+    worker = make_worker(store, batch_size=2, flush_interval=30.0)
+    for _ in range(3):
+        deliver(worker, reading())
+
+    # After stop() the loop skips the timed drain and empties the queue in batches
+    worker._stop.set()
+    worker._flush_loop()
+
+    assert [len(b) for b in store.batches] == [2, 1]
+    assert worker.queue.empty()
+
+
+def test_failed_batch_is_rolled_back_and_counted(monkeypatch):
+    store = StubStore(fail=True)
+    monkeypatch.setattr(mqtt_worker, "store_readings", store.store_readings)
+    worker = make_worker(store, batch_size=2)
+    deliver(worker, reading())
+    deliver(worker, reading())
+
+    worker.flush_batch(worker._drain())
+
+    assert store.sessions[0].rolled_back and store.sessions[0].closed
+    assert worker.counters["failed_batches"] == 1
+    assert worker.counters["dropped"] == 2
+    assert worker.counters["written"] == 0
@@ -0,0 +1,53 @@
+"""
+Keyset pagination helpers (shared.pagination)
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from shared.database import SensorReading
+from shared.pagination import after_key, clamp_limit, decode_cursor, encode_cursor, split_page
+
+
+def sql(clause):
+    return str(clause.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_cursor_round_trip():
+    key = (datetime(2025, 1, 1, 12, 30, 15, 250000), 42)
+    cursor = encode_cursor(key)
+    assert "=" not in cursor
+    assert decode_cursor(cursor, (datetime, int)) == key
+
+
+@pytest.mark.parametrize("cursor", ["", "not-base64!", encode_cursor([1]), encode_cursor(["x", 1]),
+                                    encode_cursor(["yesterday", 1])])
+def test_malformed_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError, match="Invalid cursor"):
+        decode_cursor(cursor, (datetime, int))
+
+
+def test_clamp_limit():
+    assert clamp_limit(0) == 1
+    assert clamp_limit(50) == 50
+    assert clamp_limit(10 ** 6, maximum=1000) == 1000
+
+
+def test_after_key_uses_row_value_comparison():
+    since = datetime(2025, 1, 1)
+    assert sql(after_key([SensorReading.id], [7])) == "sensor_readings.id < 7"
+    assert sql(after_key([SensorReading.id], [7], descending=False)) == "sensor_readings.id > 7"
+    text = sql(after_key([SensorReading.timestamp, SensorReading.id], [since, 7]))
+    assert text.startswith("(sensor_readings.timestamp, sensor_readings.id) < (")
+
+
+def test_split_page():
+    items = [SimpleNamespace(id=i) for i in (9, 8, 7)]
+    page, cursor = split_page(items, 2, key=lambda row: (row.id,))
+    assert [row.id for row in page] == [9, 8]
+    assert decode_cursor(cursor, (int,)) == (8,)
+
+    page, cursor = split_page(items, 3, key=lambda row: (row.id,))
+    assert len(page) == 3 and cursor is None
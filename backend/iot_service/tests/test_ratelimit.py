@@ -0,0 +1,147 @@
+"""
+Token buckets and rate-limit keying (shared.ratelimit)
+The middleware runs in front of a minimal app, with an in-process bucket
+store and a key verifier that knows one sensor's real key.
+"""
+import asyncio
+import uuid
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from shared.ratelimit import LocalBucketStore, RateLimiter, RateLimitMiddleware, RateLimitRule, parse_limit
+
+REAL_KEY = "sk_real-key-of-sensor-001"
+
+
+def verifier(sensor_id, api_key):
+    return sensor_id == "SENSOR_001" and api_key == REAL_KEY
+
+
+def make_client(rules, key_verifier=verifier):
+    app = FastAPI()
+
+    @app.post("/sensor/data")
+    async def ingest(request: Request):
+        return await request.json()
+
+    @app.post("/chat")
+    async def chat():
+        return {"ok": True}
+
+    limiter = RateLimiter(rules, store=LocalBucketStore(), enabled=True, key_verifier=key_verifier)
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    return TestClient(app), limiter
+
+
+def post_reading(client, sensor_id, api_key=None, header_key=None):
+    body = {"sensor_id": sensor_id, "latitude": 52.28, "longitude": 76.96, "pm25": 10.0}
+    if api_key:
+        body["api_key"] = api_key
+    headers = {"x-api-key": header_key} if header_key else {}
+    return client.post("/sensor/data", json=body, headers=headers)
+
+
+def sensor_rule():
+    return RateLimitRule("sensor", "/sensor/data", "sensor_id", "1/minute,burst=3", methods=("POST",))
+
+
+def test_parse_limit():
+    assert parse_limit("2/s,burst=10") == (2.0, 10.0)
+    assert parse_limit("30/minute") == (0.5, 30.0)
+    assert parse_limit("off") is None
+    with pytest.raises(ValueError):
+        parse_limit("fast")
+
+
+def test_bucket_refills_at_rate():
+    store = LocalBucketStore()
+
+    async def run():
+        results = [await store.take("k", rate=1000.0, burst=2) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        return results, await store.take("k", rate=1000.0, burst=2)
+
+    results, refilled = asyncio.run(run())
+    assert [allowed for allowed, _ in results] == [True, True, False]
+    assert results[2][1] > 0
+    assert refilled[0] is True
+
+
+def test_bucket_store_evicts_least_recently_used():
+    store = LocalBucketStore(max_keys=2)
+
+    async def run():
+        for key in ("a", "b", "c"):
+            await store.take(key, rate=1.0, burst=1)
+
+    asyncio.run(run())
+    assert store.stats()["buckets"] == 2
+    assert store.stats()["evictions"] == 1
+
+
+def test_random_body_keys_share_one_sensor_bucket():
+    client, _ = make_client([sensor_rule()])
+    statuses = [post_reading(client, "SENSOR_002", api_key=f"sk_{uuid.uuid4().hex}").status_code
+                for _ in range(6)]
+    assert statuses == [200, 200, 200, 429, 429, 429]
+
+
+def test_random_header_keys_share_one_sensor_bucket():
+    client, _ = make_client([sensor_rule()])
+    statuses = [post_reading(client, "SENSOR_001", header_key=f"sk_{uuid.uuid4().hex}").status_code
+                for _ in range(5)]
+    assert statuses.count(429) == 2
+
+
+def test_spoofed_readings_cannot_drain_the_real_sensor():
+    client, _ = make_client([sensor_rule()])
+    for _ in range(5):
+        post_reading(client, "SENSOR_001", api_key=f"sk_{uuid.uuid4().hex}")
+        post_reading(client, "SENSOR_001")
+
+    statuses = [post_reading(client, "SENSOR_001", api_key=REAL_KEY).status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_without_verifier_every_key_is_unverified():
+    client, _ = make_client([sensor_rule()], key_verifier=None)
+    statuses = [post_reading(client, "SENSOR_001", api_key=REAL_KEY if i % 2 else "sk_other").status_code
+                for i in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_random_keys_fall_back_to_the_ip_for_api_key_rules():
+    rule = RateLimitRule("api_key", "/sensor/*", "api_key", "1/minute,burst=2", methods=("POST",))
+    client, limiter = make_client([rule])
+    statuses = [post_reading(client, f"SENSOR_{i:03d}", header_key=f"sk_{uuid.uuid4().hex}").status_code
+                for i in range(2, 6)]
+    assert statuses == [200, 200, 429, 429]
+    assert limiter.limited_by_rule["api_key"] == 2
+
+    # The verified key has its own bucket, unaffected by the exhausted IP bucket
+    assert post_reading(client, "SENSOR_001", header_key=REAL_KEY).status_code == 200
+
+
+def test_unverifiable_bearer_tokens_fall_back_to_the_ip():
+    rule = RateLimitRule("chat", "/chat", "user", "1/minute,burst=2", methods=("POST",))
+    client, _ = make_client([rule])
+    statuses = [client.post("/chat", headers={"authorization": f"Bearer {uuid.uuid4().hex}"}).status_code
+                for _ in range(4)]
+    assert statuses == [200, 200, 429, 429]
+
+
+def test_limited_requests_get_retry_after():
+    client, _ = make_client([sensor_rule()])
+    for _ in range(3):
+        post_reading(client, "SENSOR_002")
+    response = post_reading(client, "SENSOR_002")
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+
+
+def test_body_is_replayed_to_the_app():
+    client, _ = make_client([sensor_rule()])
+    response = post_reading(client, "SENSOR_001", api_key=REAL_KEY)
+    assert response.json()["sensor_id"] == "SENSOR_001"
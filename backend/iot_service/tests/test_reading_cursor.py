@@ -0,0 +1,92 @@
+"""
+Commit-safe tail of sensor_readings (shared.reading_cursor)
+Rows are stand-ins with only an id; fetch times are passed explicitly so
+settling does not depend on the clock.
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+from sqlalchemy.dialects import postgresql
+
+from shared.reading_cursor import READING_CURSOR_LOOKBACK_SECONDS, ReadingCursor
+
+NOW = datetime(2025, 1, 10, 12, 0)
+
+
+def rows(*ids):
+    return [SimpleNamespace(id=reading_id) for reading_id in ids]
+
+
+def ids(fresh):
+    return [row.id for row in fresh]
+
+
+def sql(cursor):
+    clause = cursor.condition(NOW)
+    return str(clause.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_new_cursor_asks_for_everything_above_the_mark():
+    text = sql(ReadingCursor(mark=10))
+    assert "sensor_readings.id > 10" in text
+    assert "sensor_readings.timestamp >=" in text
+    assert READING_CURSOR_LOOKBACK_SECONDS > 0
+
+
+def test_condition_asks_for_gaps_and_the_tail():
+    cursor = ReadingCursor(mark=10)
+    cursor.advance(rows(11, 12, 15, 20), started=1000.0)
+
+    text = sql(cursor)
+    assert "sensor_readings.id > 12 AND sensor_readings.id < 15" in text
+    assert "sensor_readings.id > 15 AND sensor_readings.id < 20" in text
+    assert "sensor_readings.id > 20" in text
+    assert "sensor_readings.id > 10 AND" not in text  # 11-12 follow the mark directly
+
+
+def test_late_commit_below_the_high_water_is_returned_once():
+    cursor = ReadingCursor(mark=0, settle_seconds=60)
+    assert ids(cursor.advance(rows(1, 2, 4), started=1000.0)) == [1, 2, 4]
+
+    # id 3 commits after 4 was seen; the next fetch picks it up from the gap
+    assert ids(cursor.advance(rows(3, 5), started=1010.0)) == [3, 5]
+    assert cursor.seen == [[1, 5]]
+    assert ids(cursor.advance(rows(3, 4, 5), started=1020.0)) == []
+
+
+def test_mark_settles_only_after_the_settle_time():
+    cursor = ReadingCursor(mark=0, settle_seconds=60)
+    cursor.advance(rows(1, 2, 4), started=1000.0)
+    cursor.advance(rows(6), started=1030.0)
+    assert cursor.mark == 0
+
+    # 60 s after the first fetch, everything visible then (up to 4) is settled
+    cursor.advance([], started=1060.0)
+    assert cursor.mark == 4
+    assert cursor.seen == [[6, 6]]
+    assert cursor.stats() == {"settled_reading_id": 4, "last_reading_id": 6, "unsettled_ranges": 1}
+
+    # Ids at or below the mark are never reported again
+    assert ids(cursor.advance(rows(3, 5), started=1070.0)) == [5]
+
+
+def test_adjacent_ranges_merge():
+    cursor = ReadingCursor(mark=0)
+    cursor.advance(rows(1, 3, 5), started=1000.0)
+    assert cursor.seen == [[1, 1], [3, 3], [5, 5]]
+    cursor.advance(rows(2, 4), started=1001.0)
+    assert cursor.seen == [[1, 5]]
+    assert cursor.high_water == 5
+
+
+def test_state_round_trip_drops_ranges_below_the_mark():
+    cursor = ReadingCursor(mark=0, settle_seconds=60)
+    cursor.advance(rows(1, 2, 5, 9), started=1000.0)
+
+    restored = ReadingCursor.from_state(3, cursor.to_state(), settle_seconds=60)
+    assert restored.mark == 3
+    assert restored.seen == [[5, 5], [9, 9]]
+    assert ids(restored.advance(rows(4, 5, 6), started=1010.0)) == [4, 6]
+
+    fresh = ReadingCursor.from_state(None, None)
+    assert fresh.mark == 0 and fresh.seen == []
@@ -0,0 +1,99 @@
+"""
+Sensor registry cache (shared.sensor_cache)
+A stub session answers the `sensors` lookup and counts the queries it gets.
+"""
+from types import SimpleNamespace
+
+from shared.sensor_cache import SensorRegistryCache
+
+
+def sensor(sensor_id):
+    return SimpleNamespace(sensor_id=sensor_id, name=sensor_id, latitude=52.28, longitude=76.96,
+                           status="active", api_key_hash="hash")
+
+
+class StubQuery:
+    def __init__(self, session):
+        self.session = session
+        self.ids = []
+
+    def filter(self, criterion):
+        # Sensor.sensor_id.in_(ids) binds the id list as one expanding parameter
+        self.ids = criterion.right.value
+        return self
+
+    def all(self):
+        self.session.queries += 1
+        return [self.session.sensors[s] for s in self.ids if s in self.session.sensors]
+
+
+class StubSession:
+    def __init__(self, *sensor_ids):
+        self.sensors = {s: sensor(s) for s in sensor_ids}
+        self.queries = 0
+
+    def query(self, model):
+        return StubQuery(self)
+
+
+def test_misses_are_loaded_with_one_query_and_then_cached():
+    db = StubSession("SENSOR_001", "SENSOR_002")
+    cache = SensorRegistryCache()
+
+    assert set(cache.get_many(db, ["SENSOR_001", "SENSOR_002", "SENSOR_404"])) == {"SENSOR_001", "SENSOR_002"}
+    assert db.queries == 1
+
+    assert cache.get(db, "SENSOR_001").sensor_id == "SENSOR_001"
+    assert cache.get(db, "SENSOR_404") is None
+    assert db.queries == 1
+    assert cache.stats()["negative_hits"] == 1
+
+
+def test_full_cache_evicts_least_recently_used_entries():
+    db = StubSession(*(f"SENSOR_{i:03d}" for i in range(5)))
+    cache = SensorRegistryCache(max_entries=3)
+    for sensor_id in ("SENSOR_000", "SENSOR_001", "SENSOR_002"):
+        cache.get(db, sensor_id)
+    cache.get(db, "SENSOR_000")  # now the most recently used
+
+    cache.get(db, "SENSOR_003")
+
+    assert cache.peek("SENSOR_001") is None
+    assert cache.peek("SENSOR_000") is not None
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["evictions"] == 1
+
+
+def test_unknown_ids_do_not_flush_the_fleet():
+    fleet = [f"SENSOR_{i:03d}" for i in range(4)]
+    db = StubSession(*fleet)
+    cache = SensorRegistryCache(max_entries=6)
+    cache.get_many(db, fleet)
+
+    for i in range(3):
+        cache.get(db, f"UNKNOWN_{i}")
+        for sensor_id in fleet:
+            cache.get(db, sensor_id)
+
+    assert all(cache.peek(sensor_id) is not None for sensor_id in fleet)
+    assert db.queries == 1 + 3  # the fleet load, then one per unknown id
+
+
+def test_expired_entries_are_reloaded():
+    db = StubSession("SENSOR_001")
+    cache = SensorRegistryCache(ttl=-1)
+    cache.get(db, "SENSOR_001")
+    cache.get(db, "SENSOR_001")
+    assert db.queries == 2
+
+
+def test_peek_and_invalidate():
+    db = StubSession("SENSOR_001")
+    cache = SensorRegistryCache()
+    assert cache.peek("SENSOR_001") is None
+    assert db.queries == 0
+
+    cache.get(db, "SENSOR_001")
+    assert cache.peek("SENSOR_001").api_key_hash == "hash"
+    cache.invalidate("SENSOR_001")
+    assert cache.peek("SENSOR_001") is None
@@ -0,0 +1,208 @@
+"""
+Async gateway in front of the LLM client
+Blocking model calls run on a small dedicated thread pool behind a semaphore,
+each with a deadline. A circuit breaker counts failures and slow calls; once
+open, callers fail fast (or get their fallback text) until a trial call
+succeeds. Latency percentiles and outcome counters are kept for /ai/stats.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+import numpy as np
+
+from shared.llm_cache import LLMCache, llm_cache
+from shared.metrics import AI_CALL_DURATION, AI_CALLS
+
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "10"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_SLOW_SECONDS = float(os.getenv("AI_BREAKER_SLOW_SECONDS", "6"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+AI_LATENCY_SAMPLES = 1000
+
+
+class AIUnavailable(Exception):
+    """The model call did not produce an answer (timeout, open circuit or upstream error)"""
+
+
+class AITimeout(AIUnavailable):
+    """The call exceeded its deadline (including time waiting for a slot)"""
+
+
+class CircuitOpen(AIUnavailable):
+    """The breaker is open; the upstream is not being called"""
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a single half-open trial call"""
+
+    def __init__(self, failure_threshold: int = AI_BREAKER_FAILURES,
+                 reset_after: float = AI_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._trial_running = False
+        self._trial_started = 0.0
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        now = time.monotonic()
+        if self.state == "open" and now - self.opened_at >= self.reset_after:
+            self.state = "half_open"
+        # A trial whose caller went away never reports back; allow a new one after reset_after
+        if self.state == "half_open" and (not self._trial_running or now - self._trial_started >= self.reset_after):
+            self._trial_running = True
+            self._trial_started = now
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self):
+        self._trial_running = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.trips += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class AIGateway:
+    """Bounded, deadline-limited, circuit-broken access to one LLM client"""
+
+    def __init__(self, client, max_concurrency: int = AI_MAX_CONCURRENCY,
+                 timeout: float = AI_TIMEOUT_SECONDS,
+                 slow_threshold: float = AI_BREAKER_SLOW_SECONDS,
+                 breaker: Optional[CircuitBreaker] = None,
+                 cache: Optional[LLMCache] = llm_cache):
+        self.client = client
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.slow_threshold = slow_threshold
+        self.breaker = breaker or CircuitBreaker()
+        self.cache = cache
+        # Threads are only freed when the upstream returns, so the pool itself
+        # bounds concurrent upstream calls even after callers have timed out
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="ai-gateway")
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=AI_LATENCY_SAMPLES)
+        self.counters = {
+            "calls": 0, "succeeded": 0, "failed": 0, "timeouts": 0,
+            "slow": 0, "rejected": 0, "fallbacks": 0,
+        }
+
+    @property
+    def available(self) -> bool:
+        return self.client.available
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+        AI_CALLS.labels(self.client.model_name, name).inc()
+
+    def _finished(self, started: float, semaphore: asyncio.Semaphore, loop, future):
+        """Runs when the worker thread returns: record latency and free the slot"""
+        latency = time.monotonic() - started
+        outcome = "error" if future.cancelled() or future.exception() is not None else "ok"
+        AI_CALL_DURATION.labels(self.client.model_name, outcome).observe(latency)
+        with self._lock:
+            self._latencies.append(latency)
+        if latency > self.slow_threshold:
+            self._count("slow")
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    async def _call(self, prompt: str) -> str:
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpen("AI upstream circuit is open")
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        semaphore = self._semaphore
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        self._count("calls")
+
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            self.breaker.record_failure()
+            raise AITimeout("Timed out waiting for an AI slot")
+
+        started = time.monotonic()
+        future = loop.run_in_executor(self._executor, self.client.generate, prompt)
+        future.add_done_callback(lambda f: self._finished(started, semaphore, loop, f))
+
+        try:
+            text = await asyncio.wait_for(asyncio.shield(future), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            self.breaker.record_failure()
+            raise AITimeout(f"AI call exceeded {self.timeout:g}s")
+        except Exception as e:
+            self._count("failed")
+            self.breaker.record_failure()
+            raise AIUnavailable(str(e)) from e
+
+        if time.monotonic() - started > self.slow_threshold:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        self._count("succeeded")
+        return text
+
+    async def generate(self, prompt: str, cache_key: Optional[str] = None) -> str:
+        """Model answer for prompt (cached under cache_key when given); raises AIUnavailable"""
+        if cache_key is None or self.cache is None:
+            return await self._call(prompt)
+        return await self.cache.get_or_compute(cache_key, lambda: self._call(prompt))
+
+    async def generate_or_fallback(self, prompt: str, fallback: str,
+                                   cache_key: Optional[str] = None) -> str:
+        """Like generate(), but returns `fallback` instead of raising"""
+        try:
+            return await self.generate(prompt, cache_key)
+        except AIUnavailable as e:
+            self._count("fallbacks")
+            print(f"⚠️  AI fallback used: {e}")
+            return fallback
+
+    def stats(self) -> Dict:
+        with self._lock:
+            latencies = np.array(self._latencies)
+            counters = dict(self.counters)
+        percentiles = (
+            {f"p{p}": round(float(np.percentile(latencies, p)), 3) for p in (50, 95, 99)}
+            if len(latencies) else {}
+        )
+        return {
+            **counters,
+            "latency_seconds": percentiles,
+            "breaker": {
+                "state": self.breaker.state,
+                "consecutive_failures": self.breaker.failures,
+                "trips": self.breaker.trips,
+            },
+            "max_concurrency": self.max_concurrency,
+            "timeout_seconds": self.timeout,
+            "model": self.client.model_name,
+        }
@@ -0,0 +1,53 @@
+"""
+Per-sensor API keys
+Keys are random 256-bit tokens, so a keyed SHA-256 (HMAC with a server-side
+pepper) is a sufficient hash: it is one microsecond-scale operation per
+request instead of a deliberately slow password hash. Only the hex digest is
+stored in the sensor registry; comparisons use hmac.compare_digest. Devices
+send the same key with every reading, so digests of recently presented keys
+are memoized.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+from functools import lru_cache
+from typing import Dict, Iterable, Optional
+
+API_KEY_PEPPER = os.getenv("SENSOR_API_KEY_PEPPER", "change-this-pepper-in-production").encode()
+# When false, sensors registered before keys existed (no hash stored) may still ingest
+API_KEY_REQUIRED = os.getenv("SENSOR_API_KEY_REQUIRED", "false").lower() in ("1", "true", "yes")
+API_KEY_PREFIX = "sk_"
+API_KEY_MEMO_SIZE = int(os.getenv("SENSOR_API_KEY_MEMO_SIZE", "100000"))
+
+# Keyed hasher with the pepper already absorbed; copied per key
+_hasher = hmac.new(API_KEY_PEPPER, digestmod=hashlib.sha256)
+
+
+def generate_api_key() -> str:
+    return API_KEY_PREFIX + secrets.token_urlsafe(32)
+
+
+@lru_cache(maxsize=API_KEY_MEMO_SIZE)
+def hash_api_key(api_key: str) -> str:
+    mac = _hasher.copy()
+    mac.update(api_key.encode())
+    return mac.hexdigest()
+
+
+def key_matches(stored_hash: Optional[str], presented_hash: Optional[str],
+                required: bool = API_KEY_REQUIRED) -> bool:
+    """
+    Check a presented key (already hashed) against a sensor's stored hash
+    Sensors without a stored hash are accepted unless keys are required.
+    """
+    if stored_hash is None:
+        return not required
+    if presented_hash is None:
+        return False
+    return hmac.compare_digest(stored_hash, presented_hash)
+
+
+def hash_many(api_keys: Iterable[Optional[str]]) -> Dict[Optional[str], Optional[str]]:
+    """Hash each distinct key once (a batch usually carries one or a few keys)"""
+    return {key: hash_api_key(key) if key else None for key in set(api_keys)}
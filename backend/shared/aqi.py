@@ -0,0 +1,191 @@
+"""
+Vectorized US EPA Air Quality Index engine
+Breakpoint tables for all six criteria pollutants are held as NumPy arrays, so
+sub-indices, AQI and dominant pollutant are computed for whole columns with
+searchsorted instead of per-row if/elif chains. Scalar callers use calculate_aqi().
+
+Concentrations are accepted in the units stored in sensor_readings
+(µg/m³, CO in mg/m³) and converted to the units of the EPA tables.
+"""
+from typing import Dict, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+POLLUTANTS = ("pm25", "pm10", "o3", "co", "so2", "no2")
+
+DISPLAY_NAMES = {
+    "pm25": "PM2.5",
+    "pm10": "PM10",
+    "o3": "O3",
+    "co": "CO",
+    "so2": "SO2",
+    "no2": "NO2",
+}
+
+# Conversion from stored units to EPA table units (25 °C, 1 atm)
+UNIT_FACTORS = {
+    "pm25": 1.0,          # µg/m³
+    "pm10": 1.0,          # µg/m³
+    "o3": 1 / 1.96,       # µg/m³ -> ppb
+    "co": 1 / 1.145,      # mg/m³ -> ppm
+    "so2": 1 / 2.62,      # µg/m³ -> ppb
+    "no2": 1 / 1.88,      # µg/m³ -> ppb
+}
+
+# EPA truncation precision (decimal places) per pollutant
+PRECISION = {"pm25": 1, "pm10": 0, "o3": 0, "co": 1, "so2": 0, "no2": 0}
+
+_INDEX_LOW = [0, 51, 101, 151, 201, 301, 401]
+_INDEX_HIGH = [50, 100, 150, 200, 300, 400, 500]
+
+# Concentration breakpoints (low, high) per AQI segment, in EPA table units
+_CONCENTRATIONS = {
+    "pm25": [(0.0, 12.0), (12.1, 35.4), (35.5, 55.4), (55.5, 150.4),
+             (150.5, 250.4), (250.5, 350.4), (350.5, 500.4)],
+    "pm10": [(0, 54), (55, 154), (155, 254), (255, 354),
+             (355, 424), (425, 504), (505, 604)],
+    # 8-hour ppb table up to 200 ppb, where it ends; above that the 1-hour table
+    "o3": [(0, 54), (55, 70), (71, 85), (86, 105), (106, 200),
+           (165, 204), (205, 404), (405, 504), (505, 604)],
+    "co": [(0.0, 4.4), (4.5, 9.4), (9.5, 12.4), (12.5, 15.4),
+           (15.5, 30.4), (30.5, 40.4), (40.5, 50.4)],
+    "so2": [(0, 35), (36, 75), (76, 185), (186, 304),
+            (305, 604), (605, 804), (805, 1004)],
+    "no2": [(0, 53), (54, 100), (101, 360), (361, 649),
+            (650, 1249), (1250, 1649), (1650, 2049)],
+}
+
+# AQI range (low, high) of each concentration segment above
+_INDEXES = {pollutant: list(zip(_INDEX_LOW, _INDEX_HIGH)) for pollutant in _CONCENTRATIONS}
+# Segments are picked by their upper bound, so the 1-hour 165-204 ppb segment
+# only covers 201-204 ppb here
+_INDEXES["o3"] = [(0, 50), (51, 100), (101, 150), (151, 200), (201, 300),
+                  (151, 200), (201, 300), (301, 400), (401, 500)]
+
+BREAKPOINTS = {
+    pollutant: {
+        "c_low": np.array([lo for lo, _ in table], dtype=float),
+        "c_high": np.array([hi for _, hi in table], dtype=float),
+        "i_low": np.array([lo for lo, _ in _INDEXES[pollutant]], dtype=float),
+        "i_high": np.array([hi for _, hi in _INDEXES[pollutant]], dtype=float),
+    }
+    for pollutant, table in _CONCENTRATIONS.items()
+}
+
+# Category upper bounds and their labels/colors/messages
+CATEGORY_BOUNDS = np.array([50, 100, 150, 200, 300], dtype=float)
+CATEGORIES = [
+    ("Good", "#00e400",
+     "Air quality is satisfactory, and air pollution poses little or no risk."),
+    ("Moderate", "#ffff00",
+     "Air quality is acceptable. However, there may be a risk for some people, particularly those who are unusually sensitive to air pollution."),
+    ("Unhealthy for Sensitive Groups", "#ff7e00",
+     "Members of sensitive groups may experience health effects. The general public is less likely to be affected."),
+    ("Unhealthy", "#ff0000",
+     "Some members of the general public may experience health effects; members of sensitive groups may experience more serious health effects."),
+    ("Very Unhealthy", "#8f3f97",
+     "Health alert: The risk of health effects is increased for everyone."),
+    ("Hazardous", "#7e0023",
+     "Health warning of emergency conditions: everyone is more likely to be affected."),
+]
+
+
+def _as_array(values) -> np.ndarray:
+    """Convert a column (list with None, array, scalar) to a float array with NaN for missing"""
+    if isinstance(values, np.ndarray) and values.dtype.kind == "f":
+        return values
+    if np.isscalar(values) or values is None:
+        values = [values]
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def sub_index(pollutant: str, values) -> np.ndarray:
+    """AQI sub-index for one pollutant over a whole column (NaN where missing)"""
+    table = BREAKPOINTS[pollutant]
+    scale = 10 ** PRECISION[pollutant]
+    # Small epsilon keeps values like 35.4 (35.39999...) from truncating down a step
+    conc = np.floor(_as_array(values) * UNIT_FACTORS[pollutant] * scale + 1e-9) / scale
+
+    segment = np.searchsorted(table["c_high"], conc, side="left")
+    segment = np.clip(segment, 0, len(table["c_high"]) - 1)
+
+    c_low = table["c_low"][segment]
+    c_high = table["c_high"][segment]
+    i_low = table["i_low"][segment]
+    i_high = table["i_high"][segment]
+
+    index = (i_high - i_low) / (c_high - c_low) * (conc - c_low) + i_low
+    return np.clip(np.rint(index), 0, 500)
+
+
+def sub_indices(columns: Mapping[str, Sequence]) -> Dict[str, np.ndarray]:
+    """Sub-indices for every known pollutant present in `columns`"""
+    return {
+        pollutant: sub_index(pollutant, values)
+        for pollutant, values in columns.items()
+        if pollutant in BREAKPOINTS and values is not None
+    }
+
+
+def compute_aqi(columns: Mapping[str, Sequence]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Overall AQI and dominant pollutant for each row
+    Returns (aqi, dominant): aqi is NaN and dominant None where no pollutant is present
+    """
+    indices = sub_indices(columns)
+    if not indices:
+        length = len(next(iter(columns.values()), []))
+        return np.full(length, np.nan), np.full(length, None, dtype=object)
+
+    names = list(indices)
+    stacked = np.vstack([indices[name] for name in names])
+    present = ~np.isnan(stacked)
+    any_present = present.any(axis=0)
+
+    filled = np.where(present, stacked, -1.0)
+    winner = filled.argmax(axis=0)
+    aqi = np.where(any_present, filled.max(axis=0), np.nan)
+    dominant = np.where(any_present, np.array(names, dtype=object)[winner], None)
+    return aqi, dominant
+
+
+def category_index(aqi) -> np.ndarray:
+    """Index into CATEGORIES for each AQI value"""
+    return np.searchsorted(CATEGORY_BOUNDS, _as_array(aqi), side="left")
+
+
+def calculate_aqi(pm25: float = None, pm10: float = None, no2: float = None,
+                  co: float = None, o3: float = None, so2: float = None) -> Dict:
+    """
+    Calculate Air Quality Index (AQI) based on pollutant levels
+    Uses US EPA AQI standards
+    """
+    aqi, dominant = compute_aqi({
+        "pm25": [pm25], "pm10": [pm10], "no2": [no2],
+        "co": [co], "o3": [o3], "so2": [so2],
+    })
+
+    if np.isnan(aqi[0]):
+        return {
+            "aqi": 0,
+            "category": "No Data",
+            "color": "#gray",
+            "health_message": "No data available",
+            "dominant_pollutant": "None"
+        }
+
+    final_aqi = int(aqi[0])
+    category, color, message = CATEGORIES[int(category_index(final_aqi)[0])]
+
+    return {
+        "aqi": final_aqi,
+        "category": category,
+        "color": color,
+        "health_message": message,
+        "dominant_pollutant": dominant_display_name(dominant[0])
+    }
+
+
+def dominant_display_name(pollutant: Optional[str]) -> Optional[str]:
+    """Human-readable pollutant name (PM2.5, NO2, ...)"""
+    return DISPLAY_NAMES.get(pollutant) if pollutant else None
@@ -0,0 +1,380 @@
+"""
+Stateless access-token verification shared by all services
+Tokens carry the user's role and active flag as claims, so a valid signature
+is enough to build the current user without touching the users table. Verified
+tokens are kept in a bounded LRU (keyed by a hash of the token) until they
+expire, and a revocation list is re-read from revoked_tokens every
+AUTH_REVOCATION_REFRESH_SECONDS. Revoking all of a user's tokens bumps their
+token generation, which every token carries as a claim, so the check does not
+depend on issue times or replica clocks. Tokens issued before the claims
+existed are resolved from the database once and then cached like the others.
+"""
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from jose import JWTError, jwt
+from sqlalchemy import func, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from shared.database import get_db, RevokedToken, User
+
+# Same fallback as docker-compose, so services without the variable still agree
+DEFAULT_SECRET_KEY = "change-this-secret-key-in-production"
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", DEFAULT_SECRET_KEY)
+if SECRET_KEY == DEFAULT_SECRET_KEY:
+    print("⚠️  JWT_SECRET_KEY not set; using the development default (tokens are forgeable)")
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7  # 7 days
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_PROFILE_TTL = float(os.getenv("AUTH_PROFILE_TTL", "60"))
+AUTH_REVOCATION_REFRESH_SECONDS = float(os.getenv("AUTH_REVOCATION_REFRESH_SECONDS", "30"))
+REVOCATION_OVERLAP_SECONDS = 60
+
+
+def _epoch(moment: datetime) -> float:
+    """Epoch seconds of a naive UTC datetime"""
+    return moment.replace(tzinfo=timezone.utc).timestamp()
+
+
+class AuthError(Exception):
+    """The token cannot be used (bad signature, expired, revoked or inactive user)"""
+
+    def __init__(self, detail: str, status_code: int = status.HTTP_401_UNAUTHORIZED):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """Snapshot of the authenticated user taken from the token claims"""
+    id: int
+    email: str
+    name: Optional[str]
+    role: str
+    is_active: bool
+    profile_picture: Optional[str] = None
+    jti: Optional[str] = None
+    issued_at: float = 0.0
+    expires_at: float = 0.0
+    token_generation: int = 0
+
+
+def user_claims(user: User) -> Dict:
+    """Claims that let other services authorize without loading the user"""
+    return {
+        "sub": str(user.id),
+        "email": user.email,
+        "name": user.name,
+        "picture": user.profile_picture,
+        "role": user.role or "user",
+        "active": bool(user.is_active),
+        "gen": user.token_generation or 0,
+    }
+
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
+    """Signed JWT with issue time and a unique id (jti) so it can be revoked"""
+    now = datetime.utcnow()
+    to_encode = data.copy()
+    to_encode.update({
+        "iat": now,
+        "exp": now + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "jti": uuid.uuid4().hex,
+    })
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+class TokenVerifier:
+    """Local JWT verification with an LRU of verified tokens and user profiles"""
+
+    def __init__(self, secret: str = SECRET_KEY, algorithm: str = ALGORITHM,
+                 max_entries: int = AUTH_CACHE_SIZE,
+                 refresh_seconds: float = AUTH_REVOCATION_REFRESH_SECONDS,
+                 profile_ttl: float = AUTH_PROFILE_TTL):
+        self.secret = secret
+        self.algorithm = algorithm
+        self.max_entries = max_entries
+        self.refresh_seconds = refresh_seconds
+        self.profile_ttl = profile_ttl
+        self._tokens: "OrderedDict[str, CurrentUser]" = OrderedDict()
+        self._profiles: "OrderedDict[int, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        # jti -> expiry (epoch seconds); user id -> (generation, revoked at): lower generations are revoked
+        self._revoked: Dict[str, float] = {}
+        self._revoked_users: Dict[int, Tuple[int, float]] = {}
+        self._revocations_loaded_at = 0.0
+        self._revocations_seen_until: Optional[datetime] = None
+        self.counters = {"hits": 0, "misses": 0, "db_lookups": 0, "rejected": 0, "revocation_refreshes": 0}
+
+    @staticmethod
+    def _key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _count(self, name: str):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _check(self, user: CurrentUser) -> CurrentUser:
+        if user.expires_at and user.expires_at <= time.time():
+            raise AuthError("Token has expired")
+        if user.jti and user.jti in self._revoked:
+            raise AuthError("Token has been revoked")
+        revoked = self._revoked_users.get(user.id)
+        if revoked is not None and user.token_generation < revoked[0]:
+            raise AuthError("Token has been revoked")
+        if not user.is_active:
+            raise AuthError("User account is disabled", status.HTTP_403_FORBIDDEN)
+        return user
+
+    def _decode(self, token: str, db: Optional[Session]) -> CurrentUser:
+        try:
+            payload = jwt.decode(token, self.secret, algorithms=[self.algorithm])
+            user_id = int(payload["sub"])
+        except (JWTError, KeyError, TypeError, ValueError):
+            raise AuthError("Could not validate credentials")
+
+        role, active = payload.get("role"), payload.get("active")
+        name, picture = payload.get("name"), payload.get("picture")
+        if role is None or active is None:
+            # Token issued before role/active were embedded
+            if db is None:
+                raise AuthError("Could not validate credentials")
+            self._count("db_lookups")
+            user = db.query(User).filter(User.id == user_id).first()
+            if user is None:
+                raise AuthError("User not found")
+            role, active = user.role or "user", bool(user.is_active)
+            name, picture = user.name, user.profile_picture
+
+        return CurrentUser(
+            id=user_id,
+            email=payload.get("email", ""),
+            name=name,
+            role=role,
+            is_active=bool(active),
+            profile_picture=picture,
+            jti=payload.get("jti"),
+            issued_at=float(payload.get("iat", 0)),
+            expires_at=float(payload.get("exp", 0)),
+            token_generation=int(payload.get("gen", 0)),
+        )
+
+    def verify(self, token: str, db: Optional[Session] = None) -> CurrentUser:
+        """Current user for a bearer token; raises AuthError"""
+        if db is not None:
+            self.maybe_refresh(db)
+
+        key = self._key(token)
+        with self._lock:
+            user = self._tokens.get(key)
+            if user is not None:
+                self._tokens.move_to_end(key)
+                self.counters["hits"] += 1
+
+        if user is None:
+            self._count("misses")
+            try:
+                user = self._decode(token, db)
+            except AuthError:
+                self._count("rejected")
+                raise
+            with self._lock:
+                self._tokens[key] = user
+                while len(self._tokens) > self.max_entries:
+                    self._tokens.popitem(last=False)
+
+        try:
+            return self._check(user)
+        except AuthError:
+            self._count("rejected")
+            with self._lock:
+                self._tokens.pop(key, None)
+            raise
+
+    # Full profiles (/auth/me) change rarely and are cached briefly per user
+    def profile(self, db: Session, user_id: int) -> Optional[Dict]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._profiles.get(user_id)
+            if cached is not None and now - cached[0] < self.profile_ttl:
+                self._profiles.move_to_end(user_id)
+                return cached[1]
+
+        self._count("db_lookups")
+        user = db.query(User).filter(User.id == user_id).first()
+        if user is None:
+            return None
+        profile = {
+            "id": user.id,
+            "email": user.email,
+            "name": user.name,
+            "profile_picture": user.profile_picture,
+            "role": user.role,
+            "created_at": user.created_at,
+            "last_login": user.last_login,
+        }
+        with self._lock:
+            self._profiles[user_id] = (now, profile)
+            while len(self._profiles) > self.max_entries:
+                self._profiles.popitem(last=False)
+        return profile
+
+    def forget_profile(self, user_id: int):
+        with self._lock:
+            self._profiles.pop(user_id, None)
+
+    def revoke(self, db: Session, user: CurrentUser):
+        """Revoke one token everywhere (this process immediately, others on their next refresh)"""
+        if not user.jti:
+            return
+        expires_at = datetime.fromtimestamp(user.expires_at, timezone.utc).replace(tzinfo=None) if user.expires_at else (
+            datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        )
+        db.execute(pg_insert(RevokedToken).values(
+            jti=user.jti, user_id=user.id, revoked_at=datetime.utcnow(), expires_at=expires_at,
+        ).on_conflict_do_nothing(index_elements=["jti"]))
+        db.commit()
+        with self._lock:
+            self._revoked[user.jti] = _epoch(expires_at)
+
+    def revoke_user(self, db: Session, user_id: int) -> Optional[int]:
+        """
+        Revoke every token issued to a user so far (role change, deactivation)
+        Returns the user's new token generation, or None if there is no such user.
+        """
+        generation = db.execute(
+            update(User).where(User.id == user_id)
+            .values(token_generation=func.coalesce(User.token_generation, 0) + 1)
+            .returning(User.token_generation)
+        ).scalar()
+        if generation is None:
+            db.rollback()
+            return None
+
+        now = datetime.utcnow()
+        row = dict(
+            jti=f"user:{user_id}", user_id=user_id, revoked_at=now,
+            expires_at=now + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES), generation=generation,
+        )
+        db.execute(pg_insert(RevokedToken).values(**row).on_conflict_do_update(
+            index_elements=["jti"],
+            set_={"revoked_at": now, "expires_at": row["expires_at"], "generation": generation},
+        ))
+        db.commit()
+        with self._lock:
+            self._revoked_users[user_id] = (generation, _epoch(now))
+            self._profiles.pop(user_id, None)
+        return generation
+
+    def maybe_refresh(self, db: Session):
+        """Re-read the revocation list when it is older than refresh_seconds"""
+        if time.monotonic() - self._revocations_loaded_at < self.refresh_seconds:
+            return
+        # Another request is already refreshing; keep using the current list
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+        try:
+            self.refresh_revocations(db)
+        except Exception as e:
+            print(f"⚠️  Revocation list refresh failed: {e}")
+        finally:
+            self._revocations_loaded_at = time.monotonic()
+            self._refresh_lock.release()
+
+    def refresh_revocations(self, db: Session):
+        """Load revocations added since the last refresh and drop expired ones"""
+        now = datetime.utcnow()
+        query = db.query(RevokedToken.jti, RevokedToken.user_id, RevokedToken.revoked_at,
+                         RevokedToken.expires_at, RevokedToken.generation).filter(RevokedToken.expires_at > now)
+        if self._revocations_seen_until is not None:
+            # Overlap the previous window so rows committed late are not missed
+            since = self._revocations_seen_until - timedelta(seconds=REVOCATION_OVERLAP_SECONDS)
+            query = query.filter(RevokedToken.revoked_at >= since)
+        rows = query.all()
+
+        with self._lock:
+            for jti, user_id, revoked_at, expires_at, generation in rows:
+                if jti.startswith("user:"):
+                    known = self._revoked_users.get(user_id)
+                    if generation is not None and (known is None or generation >= known[0]):
+                        self._revoked_users[user_id] = (generation, _epoch(revoked_at))
+                else:
+                    self._revoked[jti] = _epoch(expires_at)
+            cutoff = _epoch(now)
+            self._revoked = {j: exp for j, exp in self._revoked.items() if exp > cutoff}
+            window = ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            self._revoked_users = {
+                u: entry for u, entry in self._revoked_users.items() if entry[1] + window > cutoff
+            }
+            self.counters["revocation_refreshes"] += 1
+
+        if rows:
+            self._revocations_seen_until = max(r.revoked_at for r in rows)
+        elif self._revocations_seen_until is None:
+            self._revocations_seen_until = now
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self.counters,
+                "cached_tokens": len(self._tokens),
+                "cached_profiles": len(self._profiles),
+                "revoked_tokens": len(self._revoked),
+                "revoked_users": len(self._revoked_users),
+                "max_entries": self.max_entries,
+                "revocation_refresh_seconds": self.refresh_seconds,
+            }
+
+
+# Process-wide verifier shared by the auth dependencies
+token_verifier = TokenVerifier()
+
+bearer = HTTPBearer()
+optional_bearer = HTTPBearer(auto_error=False)
+
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer),
+    db: Session = Depends(get_db),
+) -> CurrentUser:
+    """
+    FastAPI dependency resolving the bearer token to a CurrentUser
+    The session only opens a connection for a revocation refresh or a legacy
+    token, so cached requests never reach the database.
+    """
+    try:
+        return token_verifier.verify(credentials.credentials, db)
+    except AuthError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+
+def get_optional_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_bearer),
+    db: Session = Depends(get_db),
+) -> Optional[CurrentUser]:
+    """Like get_current_user, but None when no bearer token was sent"""
+    if credentials is None:
+        return None
+    return get_current_user(credentials, db)
+
+
+def require_role(*roles: str):
+    """Dependency factory allowing only users with one of the given roles"""
+    def dependency(current_user: CurrentUser = Depends(get_current_user)) -> CurrentUser:
+        if current_user.role not in roles:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
+        return current_user
+    return dependency
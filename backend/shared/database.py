@@ -2,11 +2,14 @@
 Shared database utilities for PostgreSQL with TimescaleDB
 """
 import os
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, JSON
+from sqlalchemy import create_engine, text, Column, Integer, Float, String, DateTime, JSON, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
 
+from shared.timescale import setup_continuous_aggregates, setup_storage_policies
+from shared.metrics import TimedQueuePool, TimedAsyncQueuePool, instrument_engine
+
 # Database configuration
 DATABASE_URL = (
     f"postgresql://{os.getenv('POSTGRES_USER', 'eco_monitor')}:"
@@ -16,18 +19,40 @@ DATABASE_URL = (
     f"{os.getenv('POSTGRES_DB', 'environmental_monitoring')}"
 )
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+ASYNC_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+# Connection pool configuration (shared by the sync and async engines)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+engine = create_engine(
+    DATABASE_URL,
+    poolclass=TimedQueuePool,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    connect_args={"options": f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"},
+)
+instrument_engine(engine, "sync")
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# Async engine is created lazily so services without asyncpg can still import this module
+_async_engine = None
+_AsyncSessionLocal = None
+
 
 class SensorReading(Base):
     """Sensor readings table (TimescaleDB hypertable)"""
     __tablename__ = "sensor_readings"
 
-    id = Column(Integer, primary_key=True, index=True)
-    sensor_id = Column(String, index=True, nullable=False)
-    timestamp = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+    # Hypertable unique constraints must include the partitioning column
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    sensor_id = Column(String, nullable=False)
+    timestamp = Column(DateTime, default=datetime.utcnow, primary_key=True, index=True, nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
     pm25 = Column(Float)  # PM2.5 (µg/m³)
@@ -41,6 +66,31 @@ class SensorReading(Base):
     pressure = Column(Float)     # hPa
     extra_data = Column(JSON)  # Additional metadata (renamed from 'metadata' - reserved word)
 
+    # Serves "readings of one sensor, newest first" (also covers plain sensor_id filters)
+    __table_args__ = (
+        Index("ix_sensor_readings_sensor_id_timestamp", sensor_id, timestamp.desc()),
+    )
+
+
+class LatestReading(Base):
+    """Newest reading of every sensor (upserted on ingestion)"""
+    __tablename__ = "latest_readings"
+
+    sensor_id = Column(String, primary_key=True)
+    reading_id = Column(Integer)
+    timestamp = Column(DateTime, nullable=False)
+    latitude = Column(Float, nullable=False)
+    longitude = Column(Float, nullable=False)
+    pm25 = Column(Float)
+    pm10 = Column(Float)
+    no2 = Column(Float)
+    co = Column(Float)
+    o3 = Column(Float)
+    so2 = Column(Float)
+    temperature = Column(Float)
+    humidity = Column(Float)
+    pressure = Column(Float)
+
 
 class Sensor(Base):
     """Sensor registry table"""
@@ -55,6 +105,8 @@ class Sensor(Base):
     status = Column(String, default="active")  # active, inactive, maintenance
     last_seen = Column(DateTime)
     extra_data = Column(JSON)  # Additional metadata (renamed from 'metadata' - reserved word)
+    api_key_hash = Column(String)  # HMAC-SHA256 of the sensor's API key (see shared.api_keys)
+    api_key_rotated_at = Column(DateTime)
 
 
 class Alert(Base):
@@ -73,8 +125,25 @@ class Alert(Base):
     area = Column(String)  # district/area name
     message = Column(String)
     resolved = Column(Integer, default=0)  # 0 = active, 1 = resolved
+    sensor_id = Column(String, index=True)  # source sensor for threshold alerts
     extra_data = Column(JSON)  # Additional metadata (renamed from 'metadata' - reserved word)
 
+    # Serves keyset pages of the history, newest first
+    __table_args__ = (
+        Index("ix_alerts_timestamp_id", timestamp.desc(), id.desc()),
+    )
+
+
+class MonitorState(Base):
+    """Persisted progress of background processors (high-water marks, snapshots)"""
+    __tablename__ = "monitor_state"
+
+    name = Column(String, primary_key=True)
+    last_reading_id = Column(Integer, default=0, nullable=False)
+    last_timestamp = Column(DateTime)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    extra_data = Column(JSON)
+
 
 class User(Base):
     """Users table for authentication"""
@@ -89,9 +158,26 @@ class User(Base):
     last_login = Column(DateTime, default=datetime.utcnow)
     is_active = Column(Integer, default=1)  # 1 = active, 0 = inactive
     role = Column(String, default="user")  # user, admin, moderator
+    token_generation = Column(Integer, default=0, nullable=False)  # bumped to revoke all tokens
     extra_data = Column(JSON)  # Additional user metadata
 
 
+class RevokedToken(Base):
+    """
+    Revoked access tokens, polled by every service's token verifier
+    jti is a token id, or "user:<id>" to revoke all of that user's tokens
+    whose generation claim is below `generation`. Rows can be purged once
+    expires_at has passed.
+    """
+    __tablename__ = "revoked_tokens"
+
+    jti = Column(String, primary_key=True)
+    user_id = Column(Integer, index=True)
+    revoked_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+    generation = Column(Integer)  # user rows only
+
+
 def get_db():
     """Dependency for FastAPI"""
     db = SessionLocal()
@@ -101,19 +187,88 @@ def get_db():
         db.close()
 
 
+def get_async_engine():
+    """Return the process-wide async engine (asyncpg), creating it on first use"""
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        _async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            poolclass=TimedAsyncQueuePool,
+            pool_pre_ping=True,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            connect_args={"server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}},
+        )
+        instrument_engine(_async_engine.sync_engine, "async")
+        _AsyncSessionLocal = async_sessionmaker(
+            _async_engine, autoflush=False, expire_on_commit=False
+        )
+    return _async_engine
+
+
+def get_async_sessionmaker():
+    """Session factory bound to the async engine (for background tasks)"""
+    get_async_engine()
+    return _AsyncSessionLocal
+
+
+async def get_async_db():
+    """Async dependency for FastAPI (does not block the event loop)"""
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+
 def init_db():
     """Initialize database tables"""
     Base.metadata.create_all(bind=engine)
 
+    # create_all only builds indexes for new tables; keep existing ones in sync
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_sensor_readings_sensor_id_timestamp "
+            "ON sensor_readings (sensor_id, timestamp DESC)"
+        ))
+        conn.execute(text("DROP INDEX IF EXISTS ix_sensor_readings_sensor_id"))
+        conn.execute(text("ALTER TABLE alerts ADD COLUMN IF NOT EXISTS sensor_id VARCHAR"))
+        conn.execute(text("ALTER TABLE sensors ADD COLUMN IF NOT EXISTS api_key_hash VARCHAR"))
+        conn.execute(text("ALTER TABLE sensors ADD COLUMN IF NOT EXISTS api_key_rotated_at TIMESTAMP"))
+        conn.execute(text(
+            "ALTER TABLE users ADD COLUMN IF NOT EXISTS token_generation INTEGER NOT NULL DEFAULT 0"
+        ))
+        conn.execute(text("ALTER TABLE revoked_tokens ADD COLUMN IF NOT EXISTS generation INTEGER"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_alerts_sensor_id ON alerts (sensor_id)"))
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_alerts_timestamp_id ON alerts (timestamp DESC, id DESC)"
+        ))
+
+        # Seed latest_readings once from history (ingestion keeps it current afterwards)
+        conn.execute(text(
+            "INSERT INTO latest_readings (sensor_id, reading_id, timestamp, latitude, longitude, "
+            "pm25, pm10, no2, co, o3, so2, temperature, humidity, pressure) "
+            "SELECT DISTINCT ON (sensor_id) sensor_id, id, timestamp, latitude, longitude, "
+            "pm25, pm10, no2, co, o3, so2, temperature, humidity, pressure "
+            "FROM sensor_readings "
+            "WHERE NOT EXISTS (SELECT 1 FROM latest_readings) "
+            "ORDER BY sensor_id, timestamp DESC"
+        ))
+
     # Enable TimescaleDB extension and create hypertable
-    with engine.connect() as conn:
+    # (continuous aggregates cannot be created inside a transaction block)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
         try:
-            conn.execute("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;")
-            conn.execute(
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb CASCADE;"))
+            conn.execute(text(
                 "SELECT create_hypertable('sensor_readings', 'timestamp', "
-                "if_not_exists => TRUE);"
-            )
-            conn.commit()
-            print("✅ Database initialized with TimescaleDB")
+                "if_not_exists => TRUE, migrate_data => TRUE);"
+            ))
         except Exception as e:
             print(f"⚠️ TimescaleDB setup skipped (may already exist): {e}")
+            return
+
+        failures = setup_continuous_aggregates(conn)
+        failures += setup_storage_policies(conn)
+        if failures == 0:
+            print("✅ Database initialized with TimescaleDB")
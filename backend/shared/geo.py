@@ -0,0 +1,168 @@
+"""
+In-memory spatial index over the sensor registry
+Sensors are bucketed into a fixed lat/lon grid so radius and nearest-k lookups
+only compute haversine distances for sensors in nearby cells. The index is
+rebuilt from the `sensors` table when its TTL expires, when the registry size
+changes (checked cheaply every few seconds) or when invalidate() is called.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shared.database import Sensor
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM  # half the circumference
+
+GEO_CELL_DEGREES = float(os.getenv("GEO_CELL_DEGREES", "0.05"))  # ~5.5 km of latitude
+GEO_INDEX_TTL = float(os.getenv("GEO_INDEX_TTL", "600"))
+GEO_INDEX_CHECK_SECONDS = float(os.getenv("GEO_INDEX_CHECK_SECONDS", "30"))
+
+
+def haversine_km(lat1: float, lon1: float, lat2, lon2):
+    """Great-circle distance in km (lat2/lon2 may be NumPy arrays)"""
+    lat1, lon1 = np.radians(lat1), np.radians(lon1)
+    lat2, lon2 = np.radians(lat2), np.radians(lon2)
+    a = (np.sin((lat2 - lat1) / 2) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class SensorSpatialIndex:
+    """Grid index of sensor positions with haversine radius and nearest-k queries"""
+
+    def __init__(self, cell_degrees: float = GEO_CELL_DEGREES, ttl: float = GEO_INDEX_TTL,
+                 check_interval: float = GEO_INDEX_CHECK_SECONDS):
+        self.cell_degrees = cell_degrees
+        self.ttl = ttl
+        self.check_interval = check_interval
+        self._columns = int(math.ceil(360.0 / cell_degrees))
+        self._ids: List[str] = []
+        self._lat = np.empty(0)
+        self._lon = np.empty(0)
+        self._cells: Dict[Tuple[int, int], np.ndarray] = {}
+        self._source_count = 0
+        self._built_at: Optional[float] = None
+        self._checked_at = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+        self.rebuilds = 0
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        row = int(math.floor((lat + 90.0) / self.cell_degrees))
+        column = int(math.floor((lon + 180.0) / self.cell_degrees)) % self._columns
+        return row, column
+
+    def build(self, sensors: Iterable[Tuple[str, float, float]]):
+        """Replace the index contents with (sensor_id, latitude, longitude) tuples"""
+        sensors = list(sensors)
+        self._source_count = len(sensors)
+        sensors = [s for s in sensors if s[1] is not None and s[2] is not None]
+        cells = defaultdict(list)
+        for position, (_, lat, lon) in enumerate(sensors):
+            cells[self._cell(lat, lon)].append(position)
+
+        self._ids = [s[0] for s in sensors]
+        self._lat = np.array([s[1] for s in sensors], dtype=float)
+        self._lon = np.array([s[2] for s in sensors], dtype=float)
+        self._cells = {cell: np.array(positions) for cell, positions in cells.items()}
+        self._built_at = time.monotonic()
+        self.rebuilds += 1
+
+    def _candidates(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Positions of sensors in the grid cells overlapping the search circle"""
+        lat_span = radius_km / KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + lat_span, 90.0)))
+        lon_span = radius_km / (KM_PER_DEGREE * cos_lat) if cos_lat > 1e-6 else 360.0
+
+        low_row, low_col = self._cell(max(lat - lat_span, -90.0), lon - min(lon_span, 180.0))
+        high_row, _ = self._cell(min(lat + lat_span, 90.0), lon)
+        column_count = int(math.ceil(2 * min(lon_span, 180.0) / self.cell_degrees)) + 1
+        cell_count = (high_row - low_row + 1) * min(column_count, self._columns)
+
+        if cell_count >= len(self._cells):
+            # Search area covers more cells than are occupied: scan the occupied ones
+            return np.arange(len(self._ids))
+
+        columns = {(low_col + c) % self._columns for c in range(min(column_count, self._columns))}
+        found = [
+            self._cells[(row, column)]
+            for row in range(low_row, high_row + 1)
+            for column in columns
+            if (row, column) in self._cells
+        ]
+        return np.concatenate(found) if found else np.empty(0, dtype=int)
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> List[Tuple[str, float]]:
+        """Sensors within radius_km of a point as (sensor_id, distance_km), nearest first"""
+        if not self._ids:
+            return []
+        candidates = self._candidates(lat, lon, radius_km)
+        if len(candidates) == 0:
+            return []
+
+        distances = haversine_km(lat, lon, self._lat[candidates], self._lon[candidates])
+        inside = distances <= radius_km
+        candidates, distances = candidates[inside], distances[inside]
+        order = np.argsort(distances)
+        return [(self._ids[candidates[i]], float(distances[i])) for i in order]
+
+    def nearest(self, lat: float, lon: float, k: int = 1,
+                max_km: Optional[float] = None) -> List[Tuple[str, float]]:
+        """The k nearest sensors (optionally no farther than max_km), nearest first"""
+        if not self._ids or k <= 0:
+            return []
+        limit = min(max_km, MAX_DISTANCE_KM) if max_km is not None else MAX_DISTANCE_KM
+
+        # Grow the search circle until it holds k sensors or reaches the limit
+        radius = min(self.cell_degrees * KM_PER_DEGREE, limit)
+        while True:
+            found = self.within_radius(lat, lon, radius)
+            if len(found) >= k or radius >= limit:
+                return found[:k]
+            radius = min(radius * 2, limit)
+
+    def invalidate(self):
+        """Force a rebuild on the next refresh()"""
+        self._built_at = None
+
+    async def refresh(self, db: AsyncSession):
+        """Rebuild from the sensors table if stale (TTL, registry size change or invalidated)"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            now = time.monotonic()
+            stale = self._built_at is None or now - self._built_at >= self.ttl
+            if not stale and now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                count = (await db.execute(select(func.count(Sensor.sensor_id)))).scalar()
+                stale = count != self._source_count
+            if not stale:
+                return
+
+            rows = (await db.execute(
+                select(Sensor.sensor_id, Sensor.latitude, Sensor.longitude)
+            )).all()
+            self.build(rows)
+            self._checked_at = now
+
+    def stats(self) -> Dict:
+        return {
+            "sensors": len(self._ids),
+            "occupied_cells": len(self._cells),
+            "cell_degrees": self.cell_degrees,
+            "rebuilds": self.rebuilds,
+            "age_seconds": round(time.monotonic() - self._built_at, 1) if self._built_at else None,
+        }
+
+
+# Process-wide sensor index
+sensor_index = SensorSpatialIndex()
@@ -0,0 +1,199 @@
+"""
+Cache for LLM responses
+Prompts are keyed by a normalized fingerprint: numeric inputs are rounded and
+the current time is reduced to a bucket, so requests over near-identical data
+share one answer. Entries live in an in-memory TTL/LRU map with an optional
+on-disk tier (LLM_CACHE_DIR). Concurrent requests for the same key are
+coalesced into a single model call (single-flight).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "1800"))
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_BUCKET_SECONDS = int(os.getenv("LLM_CACHE_BUCKET_SECONDS", "900"))
+LLM_CACHE_ROUND_DIGITS = int(os.getenv("LLM_CACHE_ROUND_DIGITS", "0"))
+LLM_CACHE_DIR = os.getenv("LLM_CACHE_DIR", "")
+
+
+def _normalize(value: Any, digits: int):
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, float):
+        return round(value, digits)
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, Mapping):
+        return {str(k): _normalize(v, digits) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v, digits) for v in value]
+    return value
+
+
+def fingerprint(kind: str, inputs: Mapping[str, Any],
+                bucket_seconds: int = LLM_CACHE_BUCKET_SECONDS,
+                digits: int = LLM_CACHE_ROUND_DIGITS) -> str:
+    """Stable cache key for a prompt kind and its (rounded) inputs in the current time bucket"""
+    payload = {
+        "kind": kind,
+        "inputs": _normalize(dict(inputs), digits),
+        "bucket": int(time.time() // bucket_seconds) if bucket_seconds else 0,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class LLMCache:
+    """TTL + LRU response cache with optional disk tier and single-flight"""
+
+    def __init__(self, ttl: float = LLM_CACHE_TTL, max_entries: int = LLM_CACHE_MAX_ENTRIES,
+                 disk_dir: Optional[str] = LLM_CACHE_DIR or None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[str]:
+        try:
+            with open(self._disk_path(key), encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get("expires_at", 0) <= now:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+            return None
+        return entry.get("value")
+
+    def _write_disk(self, key: str, value: str, expires_at: float):
+        path = self._disk_path(key)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"⚠️  LLM cache disk write failed: {e}")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.disk_dir:
+            value = self._read_disk(key, now)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._store(key, value, now + self.ttl)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _store(self, key: str, value: str, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def put(self, key: str, value: str):
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._store(key, value, expires_at)
+        if self.disk_dir:
+            self._write_disk(key, value, expires_at)
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[str]]) -> str:
+        """
+        Cached value for key, or the result of compute()
+        Concurrent callers with the same key await one shared computation;
+        failures are propagated to all of them and not cached. If the caller
+        running the computation is cancelled, the others get AIUnavailable.
+        """
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+            self.put(key, value)
+            future.set_result(value)
+            return value
+        except asyncio.CancelledError:
+            # Waiters did not ask to be cancelled; they see the call as unavailable
+            from shared.ai_gateway import AIUnavailable  # ai_gateway imports this module
+            future.set_exception(AIUnavailable("Shared model call was cancelled"))
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an unawaited failure does not log a warning
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    def invalidate(self, key: Optional[str] = None):
+        """Forget one key (or everything when key is None); disk entries otherwise expire on read"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+        if self.disk_dir and key is not None:
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "inflight": len(self._inflight),
+                "hit_ratio": round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                "ttl_seconds": self.ttl,
+                "disk_tier": bool(self.disk_dir),
+            }
+
+
+# Process-wide response cache
+llm_cache = LLMCache()
@@ -0,0 +1,65 @@
+"""
+Swappable text-generation clients
+Services hold one client for their lifetime instead of building a model per
+request. LLM_CLIENT=fake selects a deterministic local client for tests and
+load runs, so no upstream calls are made.
+"""
+import hashlib
+import os
+import threading
+import time
+
+LLM_CLIENT = os.getenv("LLM_CLIENT", "gemini")
+LLM_FAKE_LATENCY = float(os.getenv("LLM_FAKE_LATENCY", "0"))
+
+
+class GeminiClient:
+    """Google Gemini model wrapper (one GenerativeModel per client)"""
+
+    def __init__(self, model_name: str, api_key: str = None):
+        import google.generativeai as genai
+
+        self.model_name = model_name
+        self.api_key = api_key if api_key is not None else os.getenv("GEMINI_API_KEY", "")
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+        self._model = genai.GenerativeModel(model_name)
+
+    @property
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def generate(self, prompt: str) -> str:
+        """Blocking call; run it off the event loop"""
+        return self._model.generate_content(prompt).text
+
+
+class FakeClient:
+    """Deterministic local client: same prompt, same answer"""
+
+    def __init__(self, model_name: str = "fake", latency: float = LLM_FAKE_LATENCY, reply: str = None):
+        self.model_name = model_name
+        self.latency = latency
+        self.reply = reply
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def generate(self, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.reply is not None:
+            return self.reply
+        return f"[{self.model_name}] response {hashlib.sha1(prompt.encode()).hexdigest()[:12]}"
+
+
+def make_client(model_name: str):
+    """Client selected by LLM_CLIENT (gemini | fake)"""
+    if LLM_CLIENT == "fake":
+        return FakeClient(model_name)
+    return GeminiClient(model_name)
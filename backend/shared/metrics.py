@@ -0,0 +1,166 @@
+"""
+Prometheus metrics shared by all services
+MetricsMiddleware times every request per route template and serves /metrics.
+SQLAlchemy engine events count queries and their duration, both globally and
+per request (through a context variable the middleware sets), and the pool
+classes below time connection checkouts. Hot paths (ingestion, model calls,
+the alert monitor) record into the metrics defined here.
+"""
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+METRICS_PATH = "/metrics"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route"],
+    buckets=LATENCY_BUCKETS)
+HTTP_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served")
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request", "SQL statements executed while serving one request", ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100))
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements while serving one request", ["route"],
+    buckets=DB_BUCKETS)
+DB_QUERY_DURATION = Histogram(
+    "db_query_duration_seconds", "SQL statement duration", ["engine", "operation"], buckets=DB_BUCKETS)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time to obtain a pooled connection (including new connects)",
+    ["engine"], buckets=DB_BUCKETS)
+
+INGEST_ROWS = Counter(
+    "ingest_rows_total", "Sensor readings received by transport and outcome", ["transport", "outcome"])
+AI_CALL_DURATION = Histogram(
+    "ai_call_duration_seconds", "Upstream model call latency", ["model", "outcome"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 6, 10, 20, 30, 60))
+AI_CALLS = Counter("ai_calls_total", "Model gateway outcomes", ["model", "outcome"])
+ALERT_MONITOR_RUN = Histogram(
+    "alert_monitor_run_seconds", "Duration of one threshold monitor run", ["outcome"],
+    buckets=LATENCY_BUCKETS)
+ALERT_MONITOR_STALE = Counter(
+    "alert_monitor_stale_readings_total", "Readings older than MONITOR_MAX_LAG_SECONDS when first seen")
+
+# [statement count, seconds] of the request being served (None outside requests)
+_request_db: ContextVar[Optional[list]] = ContextVar("request_db", default=None)
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH"}
+
+
+def _operation(statement: str) -> str:
+    word = statement.lstrip()[:6].upper()
+    return word if word in _OPERATIONS else "OTHER"
+
+
+def instrument_engine(engine, name: str):
+    """Time every statement run on a (sync) engine; pass async_engine.sync_engine for asyncpg"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERY_DURATION.labels(name, _operation(statement)).observe(elapsed)
+        current = _request_db.get()
+        if current is not None:
+            current[0] += 1
+            current[1] += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("query_started") if context.connection else None
+        if started:
+            started.pop()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool recording how long each checkout waited"""
+    metrics_name = "sync"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+
+class TimedAsyncQueuePool(AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT.labels(self.metrics_name).observe(time.perf_counter() - started)
+
+
+def _route_template(scope) -> str:
+    """Path template of the matched route (bounded label cardinality)"""
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+    templates = getattr(app.state, "metrics_routes", None)
+    if templates is None or endpoint not in templates:
+        templates = {getattr(r, "endpoint", None): r.path for r in app.routes}
+        app.state.metrics_routes = templates
+    return templates.get(endpoint, "unmatched")
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware; add it last so it is outermost and times everything"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        if scope["path"] == METRICS_PATH:
+            body = generate_latest()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", CONTENT_TYPE_LATEST.encode()),
+                            (b"content-length", str(len(body)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        db = [0, 0.0]
+        token = _request_db.set(db)
+        HTTP_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_IN_FLIGHT.dec()
+            _request_db.reset(token)
+            route, method = _route_template(scope), scope["method"]
+            HTTP_REQUESTS.labels(method, route, str(status[0])).inc()
+            HTTP_LATENCY.labels(method, route).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(db[0])
+            DB_TIME_PER_REQUEST.labels(route).observe(db[1])
@@ -22,6 +22,8 @@ class SensorData(BaseModel):
     humidity: Optional[float] = Field(None, ge=0, le=100)
     pressure: Optional[float] = None
     extra_data: Optional[Dict[str, Any]] = None
+    # Per-reading key for MQTT and multi-sensor batches (HTTP can use X-API-Key instead)
+    api_key: Optional[str] = Field(None, exclude=True)
 
 
 class SensorRegistration(BaseModel):
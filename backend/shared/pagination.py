@@ -0,0 +1,61 @@
+"""
+Keyset (cursor) pagination helpers
+A cursor is the sort key of the last row of a page, serialized as opaque
+URL-safe base64. The next page continues strictly after that key, so it costs
+one index range scan no matter how deep the client has paged.
+"""
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import tuple_
+
+PAGE_MAX_LIMIT = int(os.getenv("PAGE_MAX_LIMIT", "1000"))
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """Opaque cursor for a sort key (datetimes, ints, strings)"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[type]) -> Tuple:
+    """Sort key from a cursor; raises ValueError when it is malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        if not isinstance(payload, list) or len(payload) != len(types):
+            raise ValueError
+        return tuple(
+            datetime.fromisoformat(v) if t is datetime else t(v)
+            for v, t in zip(payload, types)
+        )
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def clamp_limit(limit: int, maximum: int = PAGE_MAX_LIMIT) -> int:
+    return max(1, min(limit, maximum))
+
+
+def after_key(columns: Sequence, values: Sequence, descending: bool = True):
+    """Row-value comparison selecting rows strictly past the cursor in sort order"""
+    if len(columns) == 1:
+        return columns[0] < values[0] if descending else columns[0] > values[0]
+    if descending:
+        return tuple_(*columns) < tuple_(*values)
+    return tuple_(*columns) > tuple_(*values)
+
+
+def split_page(rows: List, limit: int, key) -> Tuple[List, Optional[str]]:
+    """
+    Trim a limit+1 fetch to one page and build the next cursor
+    `key` maps a row to its sort key tuple.
+    """
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(key(rows[-1]))
@@ -0,0 +1,180 @@
+"""
+In-process pub/sub for live streams (Server-Sent Events)
+Each subscriber gets a bounded buffer; a subscriber that falls behind is evicted
+instead of slowing down publishers or growing memory without limit.
+Publishers running in worker threads use publish_threadsafe().
+"""
+import asyncio
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional, Set, Tuple, Dict, Any
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+
+STREAM_BUFFER_SIZE = int(os.getenv("STREAM_BUFFER_SIZE", "256"))
+STREAM_MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "1000"))
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", "15"))
+
+
+class TooManySubscribers(Exception):
+    """Raised when the broker is at STREAM_MAX_SUBSCRIBERS"""
+
+
+@dataclass(frozen=True)
+class EventFilter:
+    """Optional sensor-id and bounding-box filter for a subscription"""
+    sensor_ids: Optional[Set[str]] = None
+    bbox: Optional[Tuple[float, float, float, float]] = None  # min_lat, min_lon, max_lat, max_lon
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        if self.sensor_ids is not None and event.get("sensor_id") not in self.sensor_ids:
+            return False
+        if self.bbox is not None:
+            lat, lon = event.get("latitude"), event.get("longitude")
+            if lat is None or lon is None:
+                return False
+            min_lat, min_lon, max_lat, max_lon = self.bbox
+            if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+                return False
+        return True
+
+
+def parse_filter(sensor_id: Optional[str] = None, bbox: Optional[str] = None) -> EventFilter:
+    """
+    Build a filter from query parameters
+    sensor_id: comma-separated ids; bbox: "min_lat,min_lon,max_lat,max_lon"
+    """
+    sensor_ids = None
+    if sensor_id:
+        sensor_ids = {s.strip() for s in sensor_id.split(",") if s.strip()}
+
+    box = None
+    if bbox:
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in bbox.split(","))
+        except ValueError:
+            raise ValueError("bbox must be min_lat,min_lon,max_lat,max_lon")
+        if min_lat > max_lat or min_lon > max_lon:
+            raise ValueError("bbox minimums must not exceed maximums")
+        box = (min_lat, min_lon, max_lat, max_lon)
+
+    return EventFilter(sensor_ids=sensor_ids, bbox=box)
+
+
+class Subscription:
+    """One client's bounded event buffer"""
+
+    def __init__(self, event_filter: EventFilter, buffer_size: int):
+        self.filter = event_filter
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self.evicted = False
+
+
+class EventBroker:
+    """Fans events out to subscribers on the service's event loop"""
+
+    def __init__(self, buffer_size: int = STREAM_BUFFER_SIZE,
+                 max_subscribers: int = STREAM_MAX_SUBSCRIBERS):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscribers: Set[Subscription] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self.published = 0
+        self.evictions = 0
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop):
+        """Remember the event loop that owns the subscriber queues (call on startup)"""
+        self._loop = loop
+
+    def subscribe(self, event_filter: EventFilter) -> Subscription:
+        if len(self._subscribers) >= self.max_subscribers:
+            raise TooManySubscribers()
+        subscription = Subscription(event_filter, self.buffer_size)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def publish(self, event: Dict[str, Any]):
+        """Deliver an event to matching subscribers (must run on the bound loop)"""
+        self.published += 1
+        for subscription in list(self._subscribers):
+            if not subscription.filter.matches(event):
+                continue
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                self._evict(subscription)
+
+    def _evict(self, subscription: Subscription):
+        """Drop a slow consumer: discard its backlog and wake it with a close marker"""
+        self.evictions += 1
+        subscription.evicted = True
+        self._subscribers.discard(subscription)
+        while not subscription.queue.empty():
+            subscription.queue.get_nowait()
+        subscription.queue.put_nowait(None)
+
+    def publish_threadsafe(self, event: Dict[str, Any]):
+        """Publish from any thread; a no-op until a loop is bound"""
+        loop = self._loop
+        if loop is None or not self._subscribers:
+            return
+        try:
+            loop.call_soon_threadsafe(self.publish, event)
+        except RuntimeError:
+            # Loop already closed during shutdown
+            pass
+
+    def stats(self) -> Dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "evictions": self.evictions,
+            "buffer_size": self.buffer_size,
+            "max_subscribers": self.max_subscribers,
+        }
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+async def _event_stream(broker: EventBroker, subscription: Subscription,
+                        request: Request, event_name: str):
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), STREAM_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keepalive\n\n"
+                continue
+
+            if event is None:
+                yield "event: evicted\ndata: {\"reason\": \"slow consumer\"}\n\n"
+                break
+
+            event_id = event.get("id")
+            prefix = f"id: {event_id}\n" if event_id is not None else ""
+            yield f"{prefix}event: {event_name}\ndata: {json.dumps(event, default=_json_default)}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+def sse_response(broker: EventBroker, subscription: Subscription,
+                 request: Request, event_name: str) -> StreamingResponse:
+    """Stream a subscription to the client as text/event-stream"""
+    return StreamingResponse(
+        _event_stream(broker, subscription, request, event_name),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
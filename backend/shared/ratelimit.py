@@ -0,0 +1,391 @@
+"""
+Token-bucket rate limiting and admission control (ASGI middleware)
+Each rule maps matching requests to a bucket key (sensor id, API key, user or
+client IP) and refills that bucket at `rate` tokens per second up to `burst`.
+Buckets live in an LRU-bounded in-process map; with RATE_LIMIT_REDIS_URL set
+they are kept in Redis instead so limits hold across replicas (falling back
+to the local map if Redis is unreachable). Rejected requests get 429 with
+Retry-After. Separately, RATE_LIMIT_MAX_IN_FLIGHT caps concurrent requests
+per process and sheds the excess with 503.
+"""
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_MAX_IN_FLIGHT = int(os.getenv("RATE_LIMIT_MAX_IN_FLIGHT", "0"))  # 0 = unlimited
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() in ("1", "true", "yes")
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "")
+
+# Bodies larger than this are not inspected for a sensor_id
+SENSOR_ID_PEEK_BYTES = 64 * 1024
+EXEMPT_PATHS = ("/health", "/metrics")
+# Long-lived responses (SSE) are not counted against the in-flight cap
+ADMISSION_EXEMPT_PREFIXES = ("/stream/",)
+
+_PERIODS = {"s": 1, "sec": 1, "second": 1, "m": 60, "min": 60, "minute": 60, "h": 3600, "hour": 3600}
+_SENSOR_ID = re.compile(rb'"sensor_id"\s*:\s*"((?:[^"\\]|\\.){1,128})"')
+_API_KEY = re.compile(rb'"api_key"\s*:\s*"((?:[^"\\]|\\.){1,256})"')
+
+
+def parse_limit(spec: str) -> Optional[Tuple[float, float]]:
+    """
+    "<count>/<period>[,burst=<n>]" -> (tokens per second, burst), None when off
+    e.g. "2/s,burst=10" or "30/minute" (burst defaults to count).
+    """
+    if not spec or spec.strip().lower() in ("off", "none", "0"):
+        return None
+    rate_part, _, burst_part = spec.partition(",")
+    count, _, period = rate_part.strip().partition("/")
+    try:
+        count = float(count)
+        seconds = _PERIODS[period.strip().lower() or "s"]
+        burst = float(burst_part.split("=", 1)[1]) if burst_part else count
+    except (ValueError, KeyError, IndexError):
+        raise ValueError(f"Invalid rate limit: {spec!r}")
+    return count / seconds, max(1.0, burst)
+
+
+@dataclass
+class RateLimitRule:
+    """
+    Bucket per `key` for requests whose path matches `path`
+    `path` ending in "*" is a prefix match. `key` is one of "sensor_id",
+    "api_key", "user" or "ip"; requests without that identity fall back to
+    their IP (except for "sensor_id", which then does not apply). A presented
+    API key only gets its own bucket once the limiter's key_verifier accepts
+    it for the reading's sensor; unverified keys share one bucket per sensor
+    ("sensor_id" rules) or per IP ("api_key" rules), so neither spoofing a
+    sensor_id nor rotating random keys gets a fresh bucket.
+    """
+    name: str
+    path: str
+    key: str
+    limit: str
+    methods: Optional[Sequence[str]] = None
+
+    def __post_init__(self):
+        if self.key not in ("sensor_id", "api_key", "user", "ip"):
+            raise ValueError(f"Unknown rate limit key: {self.key}")
+        parsed = parse_limit(self.limit)
+        self.enabled = parsed is not None
+        self.rate, self.burst = parsed or (0.0, 0.0)
+
+    def matches(self, method: str, path: str) -> bool:
+        if not self.enabled or (self.methods and method not in self.methods):
+            return False
+        if self.path.endswith("*"):
+            return path.startswith(self.path[:-1])
+        return path == self.path
+
+
+class LocalBucketStore:
+    """Thread-safe token buckets in an LRU-bounded map (per process)"""
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take `cost` tokens; returns (allowed, seconds until they would be available)"""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                # An evicted bucket comes back full, the same as one idle long enough to refill
+                bucket = [burst, now]
+                self._buckets[key] = bucket
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True, 0.0
+            return False, (cost - bucket[0]) / rate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {"backend": "local", "buckets": len(self._buckets),
+                    "max_keys": self.max_keys, "evictions": self.evictions}
+
+
+class RedisBucketStore:
+    """
+    Token buckets shared across replicas in Redis
+    One Lua script reads, refills and debits a bucket atomically using the
+    Redis server clock. Errors fall back to a local store so a Redis outage
+    degrades to per-replica limits instead of failing requests.
+    """
+
+    _SCRIPT = """
+    local rate, burst, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local t = redis.call('TIME')
+    local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+    local tokens, updated = tonumber(state[1]), tonumber(state[2])
+    if tokens == nil then
+        tokens, updated = burst, now
+    end
+    tokens = math.min(burst, tokens + (now - updated) * rate)
+    local allowed, wait = 0, 0
+    if tokens >= cost then
+        tokens = tokens - cost
+        allowed = 1
+    else
+        wait = (cost - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return {allowed, tostring(wait)}
+    """
+
+    def __init__(self, url: str, prefix: str = "ratelimit:", fallback: Optional[LocalBucketStore] = None):
+        import redis.asyncio as redis  # optional dependency, only needed for a shared store
+
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.05)
+        self.script = self.client.register_script(self._SCRIPT)
+        self.prefix = prefix
+        self.fallback = fallback or LocalBucketStore()
+        self.errors = 0
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        try:
+            allowed, wait = await self.script(keys=[self.prefix + key], args=[rate, burst, cost])
+            return bool(allowed), float(wait)
+        except Exception:
+            self.errors += 1
+            return await self.fallback.take(key, rate, burst, cost)
+
+    def stats(self) -> Dict:
+        return {"backend": "redis", "errors": self.errors, "fallback": self.fallback.stats()}
+
+
+def make_store():
+    """Redis store when RATE_LIMIT_REDIS_URL is set (and redis is installed), else local"""
+    if RATE_LIMIT_REDIS_URL:
+        try:
+            return RedisBucketStore(RATE_LIMIT_REDIS_URL)
+        except ImportError:
+            print("⚠️  RATE_LIMIT_REDIS_URL set but the redis package is missing; using local buckets")
+    return LocalBucketStore()
+
+
+class RateLimiter:
+    """Rules plus bucket store; shared by the middleware and the stats endpoint"""
+
+    def __init__(self, rules: Sequence[RateLimitRule], store=None,
+                 max_in_flight: int = RATE_LIMIT_MAX_IN_FLIGHT,
+                 enabled: bool = RATE_LIMIT_ENABLED,
+                 key_verifier: Optional[Callable[[str, str], bool]] = None):
+        self.rules = [r for r in rules if r.enabled]
+        self.store = store or make_store()
+        # (sensor_id, api_key) -> True only for a key known to belong to that sensor;
+        # runs on the event loop, so it must not block (cache lookups only)
+        self.key_verifier = key_verifier
+        self.max_in_flight = max_in_flight
+        self.enabled = enabled
+        self.in_flight = 0
+        self.counters = {"allowed": 0, "limited": 0, "shed": 0}
+        self.limited_by_rule = {r.name: 0 for r in self.rules}
+
+    async def check(self, method: str, path: str, identities: Dict[str, Optional[str]]) -> Optional[Tuple[str, float]]:
+        """Debit every matching rule; returns (rule name, retry after) when one is exhausted"""
+        denied = None
+        for rule in self.rules:
+            if not rule.matches(method, path):
+                continue
+            identity = identities.get(rule.key)
+            if identity is None:
+                if rule.key == "sensor_id":
+                    continue
+                identity = identities["ip"]
+            allowed, wait = await self.store.take(f"{rule.name}:{identity}", rule.rate, rule.burst)
+            if not allowed and (denied is None or wait > denied[1]):
+                denied = (rule.name, wait)
+        if denied is None:
+            self.counters["allowed"] += 1
+        else:
+            self.counters["limited"] += 1
+            self.limited_by_rule[denied[0]] += 1
+        return denied
+
+    def needs(self, key: str, method: str, path: str) -> bool:
+        return any(r.key == key and r.matches(method, path) for r in self.rules)
+
+    def stats(self) -> Dict:
+        return {
+            **self.counters,
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "limited_by_rule": dict(self.limited_by_rule),
+            "rules": [
+                {"name": r.name, "path": r.path, "key": r.key,
+                 "rate_per_second": round(r.rate, 4), "burst": r.burst}
+                for r in self.rules
+            ],
+            "store": self.store.stats(),
+        }
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", ()):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _client_ip(scope) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = _header(scope, b"x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+_verifier = None
+_verifier_loaded = False
+
+
+def _token_verifier():
+    """shared.auth's verifier, or None in services without python-jose"""
+    global _verifier, _verifier_loaded
+    if not _verifier_loaded:
+        try:
+            from shared.auth import token_verifier
+            _verifier = token_verifier
+        except ImportError:
+            _verifier = None
+        _verifier_loaded = True
+    return _verifier
+
+
+def _digest(value: str) -> str:
+    return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+
+def _user_identity(scope) -> Optional[str]:
+    """
+    Verified user id, or None (the rule then keys on the client IP)
+    Unverifiable tokens never get their own bucket, otherwise sending a
+    random bearer string per request would bypass the limit.
+    """
+    authorization = _header(scope, b"authorization")
+    if not authorization or not authorization.lower().startswith("bearer "):
+        return None
+    token = authorization[7:].strip()
+    verifier = _token_verifier()
+    if verifier is None:
+        return None
+    try:
+        return f"user:{verifier.verify(token).id}"
+    except Exception:
+        return None
+
+
+async def _send_error(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class RateLimitMiddleware:
+    """Pure ASGI middleware (does not buffer responses, so streaming is unaffected)"""
+
+    def __init__(self, app, limiter: RateLimiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiter
+        if scope["type"] != "http" or not limiter.enabled or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        if method != "OPTIONS":
+            identities = {"ip": _client_ip(scope), "api_key": None, "user": None, "sensor_id": None}
+            if limiter.needs("user", method, path):
+                identities["user"] = _user_identity(scope)
+            needs_sensor = limiter.needs("sensor_id", method, path)
+            if needs_sensor or (limiter.key_verifier and limiter.needs("api_key", method, path)):
+                sensor_id, body_key, receive = await self._peek_sensor_id(receive)
+                presented = _header(scope, b"x-api-key") or body_key
+                verified = bool(
+                    sensor_id and presented and limiter.key_verifier
+                    and limiter.key_verifier(sensor_id, presented)
+                )
+                if verified:
+                    identities["api_key"] = _digest(presented)
+                if sensor_id is not None and needs_sensor:
+                    identities["sensor_id"] = f"{sensor_id}:{identities['api_key'] or 'unverified'}"
+
+            denied = await limiter.check(method, path, identities)
+            if denied is not None:
+                await _send_error(send, 429, f"Rate limit exceeded ({denied[0]})", denied[1])
+                return
+
+        if limiter.max_in_flight and not path.startswith(ADMISSION_EXEMPT_PREFIXES):
+            if limiter.in_flight >= limiter.max_in_flight:
+                limiter.counters["shed"] += 1
+                await _send_error(send, 503, "Server busy, retry shortly", 1)
+                return
+            limiter.in_flight += 1
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                limiter.in_flight -= 1
+            return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _peek_sensor_id(receive):
+        """Read the (small) request body, find sensor_id and api_key, and replay the body downstream"""
+        messages = []
+        size = 0
+        more = True
+        while more and size <= SENSOR_ID_PEEK_BYTES:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            more = message.get("more_body", False)
+
+        body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.request")
+        match = _SENSOR_ID.search(body) if not more else None
+        sensor_id = match.group(1).decode("utf-8", "replace") if match else None
+        match = _API_KEY.search(body) if sensor_id is not None else None
+        api_key = match.group(1).decode("utf-8", "replace") if match else None
+
+        async def replay():
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        return sensor_id, api_key, replay
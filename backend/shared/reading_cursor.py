@@ -0,0 +1,118 @@
+"""
+Commit-safe tail of sensor_readings
+Reading ids are drawn from a sequence when a row is inserted, not when its
+transaction commits, so with several concurrent writers (HTTP, batch, MQTT) a
+lower id can become visible after a higher one. A plain "id > last seen" mark
+would skip it. ReadingCursor keeps a settled mark (every id at or below it was
+processed or will never appear) plus the id ranges already processed above it,
+and each fetch asks only for the gaps. The mark moves up to the highest id that
+was visible at least READING_CURSOR_SETTLE_SECONDS ago: an id below it that was
+still invisible then belonged to an open ingestion transaction, which has
+committed or rolled back since.
+"""
+import os
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import and_, or_
+
+from shared.database import SensorReading
+
+# Upper bound on how long an ingestion transaction stays open
+READING_CURSOR_SETTLE_SECONDS = float(os.getenv("READING_CURSOR_SETTLE_SECONDS", "120"))
+# How far back (reading timestamp) late rows are looked for; keeping this below
+# COMPRESS_AFTER means tailing never touches compressed chunks
+READING_CURSOR_LOOKBACK_SECONDS = int(os.getenv("READING_CURSOR_LOOKBACK_SECONDS", str(6 * 86400)))
+
+
+class ReadingCursor:
+    """Settled id mark plus processed ranges above it (persisted in monitor_state)"""
+
+    def __init__(self, mark: int = 0, settle_seconds: float = READING_CURSOR_SETTLE_SECONDS):
+        self.mark = mark
+        self.settle_seconds = settle_seconds
+        self.seen: List[List[int]] = []  # sorted, disjoint [first, last] ranges above the mark
+        self.frontiers: List[List[float]] = []  # [epoch seconds, highest id visible then]
+
+    def condition(self, now: datetime):
+        """WHERE clause for readings not processed yet, within the lookback window"""
+        column = SensorReading.id
+        gaps = []
+        low = self.mark
+        for first, last in self.seen:
+            if first > low + 1:
+                gaps.append(and_(column > low, column < first))
+            low = last
+        gaps.append(column > low)
+        return and_(
+            or_(*gaps),
+            SensorReading.timestamp >= now - timedelta(seconds=READING_CURSOR_LOOKBACK_SECONDS),
+        )
+
+    def advance(self, rows: Iterable, started: Optional[float] = None) -> List:
+        """
+        Record one fetch (rows ordered by id) and move the settled mark
+        `started` is the epoch time the fetch began. Returns the rows that had
+        not been processed before (deduplicated on reading id).
+        """
+        started = time.time() if started is None else started
+        fresh = [row for row in rows if self._add(row.id)]
+
+        if self.seen and (not self.frontiers or self.seen[-1][1] > self.frontiers[-1][1]):
+            self.frontiers.append([started, self.seen[-1][1]])
+
+        settled = self.mark
+        while self.frontiers and self.frontiers[0][0] <= started - self.settle_seconds:
+            settled = max(settled, int(self.frontiers.pop(0)[1]))
+        if settled > self.mark:
+            self.mark = settled
+            self.seen = [[max(first, settled + 1), last] for first, last in self.seen if last > settled]
+        return fresh
+
+    def _add(self, reading_id: int) -> bool:
+        if reading_id <= self.mark:
+            return False
+        seen = self.seen
+        index = bisect_left(seen, [reading_id + 1])  # ranges starting at or below reading_id
+        left = seen[index - 1] if index else None
+        if left is not None and left[1] >= reading_id:
+            return False
+        right = seen[index] if index < len(seen) and seen[index][0] == reading_id + 1 else None
+
+        if left is not None and left[1] == reading_id - 1:
+            if right is not None:
+                left[1] = right[1]
+                del seen[index]
+            else:
+                left[1] = reading_id
+        elif right is not None:
+            right[0] = reading_id
+        else:
+            seen.insert(index, [reading_id, reading_id])
+        return True
+
+    @property
+    def high_water(self) -> int:
+        """Highest reading id processed so far"""
+        return self.seen[-1][1] if self.seen else self.mark
+
+    def to_state(self) -> Dict:
+        return {"seen": self.seen, "frontiers": self.frontiers}
+
+    @classmethod
+    def from_state(cls, mark: int, state: Optional[Dict], **kwargs) -> "ReadingCursor":
+        cursor = cls(mark or 0, **kwargs)
+        if state:
+            cursor.seen = [[max(first, cursor.mark + 1), last]
+                           for first, last in state.get("seen", []) if last > cursor.mark]
+            cursor.frontiers = [list(f) for f in state.get("frontiers", [])]
+        return cursor
+
+    def stats(self) -> Dict:
+        return {
+            "settled_reading_id": self.mark,
+            "last_reading_id": self.high_water,
+            "unsettled_ranges": len(self.seen),
+        }
@@ -0,0 +1,152 @@
+"""
+In-process sensor registry cache
+Avoids a `sensors` lookup on every ingested reading. Entries expire after a TTL
+and can be invalidated explicitly (e.g. on registration or key rotation). The
+cached API key hash is what ingestion authenticates against. Unknown sensor ids are
+cached as negative entries so unregistered devices cannot hammer the database.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Dict, Iterable
+
+from sqlalchemy.orm import Session
+
+from shared.database import Sensor
+
+SENSOR_CACHE_TTL = float(os.getenv("SENSOR_CACHE_TTL", "300"))
+SENSOR_CACHE_NEGATIVE_TTL = float(os.getenv("SENSOR_CACHE_NEGATIVE_TTL", "30"))
+SENSOR_CACHE_MAX_ENTRIES = int(os.getenv("SENSOR_CACHE_MAX_ENTRIES", "100000"))
+
+
+@dataclass(frozen=True)
+class CachedSensor:
+    """Immutable snapshot of the registry fields needed on the ingestion path"""
+    sensor_id: str
+    name: str
+    latitude: float
+    longitude: float
+    status: Optional[str]
+    api_key_hash: Optional[str] = None
+
+
+class SensorRegistryCache:
+    """Thread-safe TTL + LRU cache of sensor registry rows keyed by sensor_id"""
+
+    def __init__(self, ttl: float = SENSOR_CACHE_TTL,
+                 negative_ttl: float = SENSOR_CACHE_NEGATIVE_TTL,
+                 max_entries: int = SENSOR_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # sensor_id -> (expires_at, CachedSensor | None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _snapshot(sensor: Sensor) -> CachedSensor:
+        return CachedSensor(
+            sensor_id=sensor.sensor_id,
+            name=sensor.name,
+            latitude=sensor.latitude,
+            longitude=sensor.longitude,
+            status=sensor.status,
+            api_key_hash=sensor.api_key_hash,
+        )
+
+    def _store(self, sensor_id: str, value: Optional[CachedSensor], now: float):
+        ttl = self.ttl if value is not None else self.negative_ttl
+        self._entries[sensor_id] = (now + ttl, value)
+        self._entries.move_to_end(sensor_id)
+        # Least recently used first, so a flood of unknown ids cannot flush the fleet
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _lookup_cached(self, sensor_id: str, now: float):
+        """Return (found, value) for a fresh cached entry"""
+        entry = self._entries.get(sensor_id)
+        if entry is None or entry[0] <= now:
+            return False, None
+        self._entries.move_to_end(sensor_id)
+        return True, entry[1]
+
+    def get(self, db: Session, sensor_id: str) -> Optional[CachedSensor]:
+        """Return the cached sensor, loading it from the database on a miss"""
+        return self.get_many(db, [sensor_id]).get(sensor_id)
+
+    def get_many(self, db: Session, sensor_ids: Iterable[str]) -> Dict[str, CachedSensor]:
+        """
+        Resolve many sensor ids at once; misses are loaded with a single query
+        Returns only the sensors that exist
+        """
+        now = time.monotonic()
+        found = {}
+        missing = []
+
+        with self._lock:
+            for sensor_id in set(sensor_ids):
+                cached, value = self._lookup_cached(sensor_id, now)
+                if not cached:
+                    self.misses += 1
+                    missing.append(sensor_id)
+                elif value is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                    found[sensor_id] = value
+
+        if missing:
+            loaded = {
+                s.sensor_id: self._snapshot(s)
+                for s in db.query(Sensor).filter(Sensor.sensor_id.in_(missing)).all()
+            }
+            with self._lock:
+                for sensor_id in missing:
+                    self._store(sensor_id, loaded.get(sensor_id), now)
+            found.update(loaded)
+
+        return found
+
+    def peek(self, sensor_id: str) -> Optional[CachedSensor]:
+        """Fresh cached entry, or None; never queries the database (safe on the event loop)"""
+        with self._lock:
+            return self._lookup_cached(sensor_id, time.monotonic())[1]
+
+    def put(self, sensor: Sensor):
+        """Insert or replace an entry from a freshly written Sensor row"""
+        with self._lock:
+            self._store(sensor.sensor_id, self._snapshot(sensor), time.monotonic())
+
+    def invalidate(self, sensor_id: Optional[str] = None):
+        """Forget one sensor (or everything when sensor_id is None)"""
+        with self._lock:
+            if sensor_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(sensor_id, None)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for monitoring"""
+        with self._lock:
+            lookups = self.hits + self.misses + self.negative_hits
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.hits + self.negative_hits) / lookups, 4) if lookups else None,
+                "ttl_seconds": self.ttl,
+                "negative_ttl_seconds": self.negative_ttl,
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+            }
+
+
+# Process-wide registry cache
+sensor_cache = SensorRegistryCache()
@@ -0,0 +1,308 @@
+"""
+TimescaleDB schema management for sensor_readings
+Continuous aggregates (hourly/daily, per sensor and city-wide) and their
+refresh policies. Aggregates store sums and counts rather than averages so
+buckets can be combined exactly (e.g. city-wide from per-sensor rows).
+Also manages chunk sizing, native compression and retention policies.
+
+Run `python -m shared.timescale` from backend/ to print chunk and compression stats.
+"""
+import json
+import os
+import re
+from typing import List, Dict, Optional
+
+from sqlalchemy import table, column, text
+
+# Columns rolled up by the continuous aggregates
+AGGREGATED_COLUMNS = ["pm25", "pm10", "no2", "co", "o3", "so2", "temperature", "humidity"]
+
+# Refresh policy windows
+CAGG_HOURLY_START_OFFSET = os.getenv("CAGG_HOURLY_START_OFFSET", "3 days")
+CAGG_HOURLY_SCHEDULE = os.getenv("CAGG_HOURLY_SCHEDULE", "15 minutes")
+CAGG_DAILY_START_OFFSET = os.getenv("CAGG_DAILY_START_OFFSET", "7 days")
+CAGG_DAILY_SCHEDULE = os.getenv("CAGG_DAILY_SCHEDULE", "1 hour")
+
+# Storage policies
+CHUNK_TIME_INTERVAL = os.getenv("CHUNK_TIME_INTERVAL", "1 day")
+COMPRESS_AFTER = os.getenv("COMPRESS_AFTER", "7 days")
+RAW_RETENTION = os.getenv("RAW_RETENTION", "90 days")
+HOURLY_RETENTION = os.getenv("HOURLY_RETENTION", "2 years")
+DAILY_RETENTION = os.getenv("DAILY_RETENTION", "")  # empty = keep forever
+
+HOURLY_VIEW = "sensor_readings_hourly"
+DAILY_VIEW = "sensor_readings_daily"
+CITY_HOURLY_VIEW = "city_readings_hourly"
+CITY_DAILY_VIEW = "city_readings_daily"
+
+
+def _aggregate_columns():
+    cols = [column("bucket"), column("samples")]
+    for name in AGGREGATED_COLUMNS:
+        cols += [
+            column(f"sum_{name}"), column(f"n_{name}"),
+            column(f"min_{name}"), column(f"max_{name}"),
+        ]
+    return cols
+
+
+# Lightweight Core handles for querying the aggregates
+sensor_hourly = table(HOURLY_VIEW, column("sensor_id"), *_aggregate_columns())
+sensor_daily = table(DAILY_VIEW, column("sensor_id"), *_aggregate_columns())
+city_hourly = table(CITY_HOURLY_VIEW, *_aggregate_columns())
+city_daily = table(CITY_DAILY_VIEW, *_aggregate_columns())
+
+
+def _raw_rollup_sql() -> str:
+    parts = ["count(*) AS samples"]
+    for name in AGGREGATED_COLUMNS:
+        parts += [
+            f"sum({name}) AS sum_{name}",
+            f"count({name}) AS n_{name}",
+            f"min({name}) AS min_{name}",
+            f"max({name}) AS max_{name}",
+        ]
+    return ",\n       ".join(parts)
+
+
+def _rollup_sql() -> str:
+    """Re-aggregate rows that already hold sums/counts/min/max"""
+    parts = ["sum(samples)::bigint AS samples"]
+    for name in AGGREGATED_COLUMNS:
+        parts += [
+            f"sum(sum_{name}) AS sum_{name}",
+            f"sum(n_{name})::bigint AS n_{name}",
+            f"min(min_{name}) AS min_{name}",
+            f"max(max_{name}) AS max_{name}",
+        ]
+    return ",\n       ".join(parts)
+
+
+def continuous_aggregate_ddl() -> List[str]:
+    """DDL for the continuous aggregates and their refresh policies"""
+    options = "timescaledb.continuous, timescaledb.materialized_only = true"
+    return [
+        # Per-sensor hourly, directly over the hypertable
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {HOURLY_VIEW}
+        WITH ({options}) AS
+        SELECT time_bucket(INTERVAL '1 hour', timestamp) AS bucket,
+               sensor_id,
+               {_raw_rollup_sql()}
+        FROM sensor_readings
+        GROUP BY bucket, sensor_id
+        WITH NO DATA
+        """,
+        # Higher levels are hierarchical aggregates over the hourly one
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {DAILY_VIEW}
+        WITH ({options}) AS
+        SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+               sensor_id,
+               {_rollup_sql()}
+        FROM {HOURLY_VIEW}
+        GROUP BY 1, sensor_id
+        WITH NO DATA
+        """,
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {CITY_HOURLY_VIEW}
+        WITH ({options}) AS
+        SELECT time_bucket(INTERVAL '1 hour', bucket) AS bucket,
+               {_rollup_sql()}
+        FROM {HOURLY_VIEW}
+        GROUP BY 1
+        WITH NO DATA
+        """,
+        f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {CITY_DAILY_VIEW}
+        WITH ({options}) AS
+        SELECT time_bucket(INTERVAL '1 day', bucket) AS bucket,
+               {_rollup_sql()}
+        FROM {DAILY_VIEW}
+        GROUP BY 1
+        WITH NO DATA
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{HOURLY_VIEW}',
+            start_offset => INTERVAL '{CAGG_HOURLY_START_OFFSET}',
+            end_offset => INTERVAL '1 minute',
+            schedule_interval => INTERVAL '{CAGG_HOURLY_SCHEDULE}',
+            if_not_exists => TRUE)
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{CITY_HOURLY_VIEW}',
+            start_offset => INTERVAL '{CAGG_HOURLY_START_OFFSET}',
+            end_offset => INTERVAL '1 minute',
+            schedule_interval => INTERVAL '{CAGG_HOURLY_SCHEDULE}',
+            if_not_exists => TRUE)
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{DAILY_VIEW}',
+            start_offset => INTERVAL '{CAGG_DAILY_START_OFFSET}',
+            end_offset => INTERVAL '1 hour',
+            schedule_interval => INTERVAL '{CAGG_DAILY_SCHEDULE}',
+            if_not_exists => TRUE)
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{CITY_DAILY_VIEW}',
+            start_offset => INTERVAL '{CAGG_DAILY_START_OFFSET}',
+            end_offset => INTERVAL '1 hour',
+            schedule_interval => INTERVAL '{CAGG_DAILY_SCHEDULE}',
+            if_not_exists => TRUE)
+        """,
+    ]
+
+
+def run_ddl(conn, statements: List[str]) -> int:
+    """
+    Execute DDL statements one by one on an AUTOCOMMIT connection
+    Failures are reported and skipped so one bad step does not block the rest
+    """
+    failures = 0
+    for statement in statements:
+        try:
+            conn.execute(text(statement))
+        except Exception as e:
+            failures += 1
+            first_line = statement.strip().splitlines()[0]
+            print(f"⚠️  TimescaleDB step skipped ({first_line[:60]}...): {e}")
+    return failures
+
+
+def setup_continuous_aggregates(conn) -> int:
+    """Create the continuous aggregates and refresh policies (idempotent)"""
+    return run_ddl(conn, continuous_aggregate_ddl())
+
+
+_UNIT_SECONDS = {
+    "second": 1, "minute": 60, "hour": 3600, "day": 86400,
+    "week": 7 * 86400, "month": 30 * 86400, "year": 365 * 86400,
+}
+
+
+def interval_seconds(interval: str) -> float:
+    """Approximate length of a simple PostgreSQL interval such as '90 days'"""
+    total = 0.0
+    for amount, unit in re.findall(r"(\d+(?:\.\d+)?)\s*([a-z]+?)s?\b", interval.lower()):
+        if unit not in _UNIT_SECONDS:
+            raise ValueError(f"Unsupported interval unit in {interval!r}")
+        total += float(amount) * _UNIT_SECONDS[unit]
+    if total <= 0:
+        raise ValueError(f"Invalid interval: {interval!r}")
+    return total
+
+
+def effective_retention() -> Dict[str, Optional[str]]:
+    """
+    Retention windows adjusted to stay consistent with the rollups
+    Raw data must outlive every refresh window that reads it, otherwise a refresh
+    over dropped chunks would erase already materialized buckets. The same holds
+    for the hourly aggregate, which feeds the daily ones.
+    """
+    raw = RAW_RETENTION
+    raw_floor = max(CAGG_HOURLY_START_OFFSET, CAGG_DAILY_START_OFFSET, key=interval_seconds)
+    if interval_seconds(raw) <= interval_seconds(raw_floor):
+        print(f"⚠️  RAW_RETENTION ({raw}) must exceed the aggregate refresh window "
+              f"({raw_floor}); using {raw_floor} + 1 day")
+        raw = f"{raw_floor} 1 day"
+
+    hourly = HOURLY_RETENTION or None
+    if hourly and interval_seconds(hourly) <= interval_seconds(CAGG_DAILY_START_OFFSET):
+        print(f"⚠️  HOURLY_RETENTION ({hourly}) must exceed the daily refresh window "
+              f"({CAGG_DAILY_START_OFFSET}); using {CAGG_DAILY_START_OFFSET} + 1 day")
+        hourly = f"{CAGG_DAILY_START_OFFSET} 1 day"
+
+    return {"raw": raw, "hourly": hourly, "daily": DAILY_RETENTION or None}
+
+
+def storage_policy_ddl(compression_enabled: bool) -> List[str]:
+    """DDL for chunk sizing, compression and retention policies"""
+    retention = effective_retention()
+    statements = [
+        f"SELECT set_chunk_time_interval('sensor_readings', INTERVAL '{CHUNK_TIME_INTERVAL}')",
+    ]
+    if not compression_enabled:
+        statements.append(
+            "ALTER TABLE sensor_readings SET ("
+            "timescaledb.compress, "
+            "timescaledb.compress_segmentby = 'sensor_id', "
+            "timescaledb.compress_orderby = 'timestamp DESC')"
+        )
+    statements += [
+        f"SELECT add_compression_policy('sensor_readings', INTERVAL '{COMPRESS_AFTER}', "
+        f"if_not_exists => TRUE)",
+        f"SELECT add_retention_policy('sensor_readings', INTERVAL '{retention['raw']}', "
+        f"if_not_exists => TRUE)",
+    ]
+    for view, keep in ((HOURLY_VIEW, retention["hourly"]), (CITY_HOURLY_VIEW, retention["hourly"]),
+                       (DAILY_VIEW, retention["daily"]), (CITY_DAILY_VIEW, retention["daily"])):
+        if keep:
+            statements.append(
+                f"SELECT add_retention_policy('{view}', INTERVAL '{keep}', if_not_exists => TRUE)"
+            )
+    return statements
+
+
+def setup_storage_policies(conn) -> int:
+    """Configure chunk interval, compression and retention (idempotent)"""
+    # Re-enabling compression on a hypertable with compressed chunks fails, so check first
+    enabled = conn.execute(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = 'sensor_readings'"
+    )).scalar()
+    return run_ddl(conn, storage_policy_ddl(bool(enabled)))
+
+
+def storage_stats(conn) -> Dict:
+    """Chunk, compression and background job statistics for sensor_readings"""
+    chunks = conn.execute(text(
+        "SELECT count(*) AS total, "
+        "count(*) FILTER (WHERE is_compressed) AS compressed, "
+        "min(range_start) AS oldest, max(range_end) AS newest "
+        "FROM timescaledb_information.chunks WHERE hypertable_name = 'sensor_readings'"
+    )).mappings().first()
+
+    size = conn.execute(text(
+        "SELECT table_bytes, index_bytes, toast_bytes, total_bytes "
+        "FROM hypertable_detailed_size('sensor_readings')"
+    )).mappings().first()
+
+    compression = conn.execute(text(
+        "SELECT total_chunks, number_compressed_chunks, "
+        "before_compression_total_bytes, after_compression_total_bytes "
+        "FROM hypertable_compression_stats('sensor_readings')"
+    )).mappings().first()
+
+    jobs = conn.execute(text(
+        "SELECT j.job_id, j.proc_name, j.hypertable_name, j.schedule_interval::text AS schedule, "
+        "j.config, s.last_run_status, s.last_run_started_at, s.next_start "
+        "FROM timescaledb_information.jobs j "
+        "LEFT JOIN timescaledb_information.job_stats s USING (job_id) "
+        "WHERE j.hypertable_name IN ('sensor_readings', :h, :d, :ch, :cd) "
+        "ORDER BY j.job_id"
+    ), {"h": HOURLY_VIEW, "d": DAILY_VIEW, "ch": CITY_HOURLY_VIEW, "cd": CITY_DAILY_VIEW}).mappings().all()
+
+    before = compression["before_compression_total_bytes"] if compression else None
+    after = compression["after_compression_total_bytes"] if compression else None
+
+    return {
+        "chunks": dict(chunks) if chunks else None,
+        "size": dict(size) if size else None,
+        "compression": {
+            **(dict(compression) if compression else {}),
+            "ratio": round(before / after, 2) if before and after else None,
+        },
+        "jobs": [dict(j) for j in jobs],
+        "config": {
+            "chunk_time_interval": CHUNK_TIME_INTERVAL,
+            "compress_after": COMPRESS_AFTER,
+            "retention": effective_retention(),
+        },
+    }
+
+
+if __name__ == "__main__":
+    from shared.database import engine
+
+    with engine.connect() as connection:
+        print(json.dumps(storage_stats(connection), indent=2, default=str))
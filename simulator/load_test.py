@@ -0,0 +1,316 @@
+"""
+Load-generating mode for the sensor simulator
+Creates N synthetic sensors around PAVLODAR_CENTER and sends readings at a
+fixed target rate (open loop) over HTTP single, HTTP batch or MQTT. Latency is
+measured from each request's scheduled send time, so a slow server shows up
+as latency instead of silently lowering the offered load. The run ends with a
+JSON report: achieved throughput, p50/p95/p99 latency and errors by kind.
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+KEYS_BATCH = 200  # concurrent registrations
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(math.ceil(pct / 100.0 * len(values))) - 1)
+    return values[max(0, index)]
+
+
+def synthetic_sensors(count: int, center: Dict, radius: float, seed: int = 42) -> List[Dict]:
+    """Sensors spread uniformly over a disc around the center, each with a pollution profile"""
+    rng = random.Random(seed)
+    sensors = []
+    for i in range(count):
+        distance = radius * math.sqrt(rng.random())
+        angle = rng.uniform(0, 2 * math.pi)
+        sensors.append({
+            "sensor_id": f"LOAD_{i:06d}",
+            "name": f"Нагрузочный датчик {i}",
+            "lat": round(center["lat"] + distance * math.sin(angle), 6),
+            "lon": round(center["lon"] + distance * math.cos(angle), 6),
+            "base_pm25": rng.uniform(8, 60),
+        })
+    return sensors
+
+
+def reading(sensor: Dict, api_key: Optional[str] = None) -> Dict:
+    pm25 = max(0.0, random.gauss(sensor["base_pm25"], sensor["base_pm25"] * 0.2))
+    data = {
+        "sensor_id": sensor["sensor_id"],
+        "latitude": sensor["lat"],
+        "longitude": sensor["lon"],
+        "pm25": round(pm25, 2),
+        "pm10": round(pm25 * random.uniform(1.3, 1.9), 2),
+        "no2": round(random.uniform(10, 80), 2),
+        "co": round(random.uniform(0.2, 2.0), 3),
+        "temperature": round(random.uniform(5, 25), 1),
+        "humidity": round(random.uniform(30, 70), 1),
+    }
+    if api_key:
+        data["api_key"] = api_key
+    return data
+
+
+class Results:
+    """Latencies and outcome counts of one run"""
+
+    def __init__(self):
+        self.latencies: List[float] = []   # scheduled send -> response (seconds)
+        self.service_times: List[float] = []  # actual send -> response
+        self.readings_ok = 0
+        self.readings_failed = 0
+        self.requests = 0
+        self.errors = Counter()
+        self.late = 0  # requests that started more than 100 ms behind schedule
+
+    def record(self, scheduled: float, started: float, finished: float, ok_rows: int, failed_rows: int,
+               error: Optional[str] = None):
+        self.requests += 1
+        self.latencies.append(finished - scheduled)
+        self.service_times.append(finished - started)
+        self.readings_ok += ok_rows
+        self.readings_failed += failed_rows
+        if started - scheduled > 0.1:
+            self.late += 1
+        if error:
+            self.errors[error] += 1
+
+
+async def register_sensors(client: httpx.AsyncClient, sensors: List[Dict], api_keys: Dict[str, str]):
+    """Register sensors that have no stored key yet, a few hundred at a time"""
+    pending = [s for s in sensors if s["sensor_id"] not in api_keys]
+    existing = 0
+    failed = 0
+
+    async def register(sensor):
+        nonlocal existing, failed
+        try:
+            response = await client.post("/sensor/register", json={
+                "sensor_id": sensor["sensor_id"],
+                "name": sensor["name"],
+                "latitude": sensor["lat"],
+                "longitude": sensor["lon"],
+                "location_description": "Синтетический датчик нагрузочного теста",
+                "sensor_type": "stationary",
+            })
+            if response.status_code == 200:
+                api_keys[sensor["sensor_id"]] = response.json()["api_key"]
+            elif response.status_code == 400:
+                existing += 1
+            else:
+                failed += 1
+        except httpx.HTTPError:
+            failed += 1
+
+    for i in range(0, len(pending), KEYS_BATCH):
+        await asyncio.gather(*(register(s) for s in pending[i:i + KEYS_BATCH]))
+    print(f"📡 Датчиков: {len(sensors)}, новых: {len(pending) - existing - failed}, "
+          f"уже было: {existing}, ошибок: {failed}")
+
+
+async def _send_http(client, results: Results, scheduled: float, payload, path: str, batch: bool):
+    started = time.perf_counter()
+    rows = len(payload) if batch else 1
+    try:
+        response = await client.post(path, json=payload)
+    except httpx.TimeoutException:
+        results.record(scheduled, started, time.perf_counter(), 0, rows, "timeout")
+        return
+    except httpx.HTTPError as e:
+        results.record(scheduled, started, time.perf_counter(), 0, rows, type(e).__name__)
+        return
+    finished = time.perf_counter()
+
+    if response.status_code != 200:
+        results.record(scheduled, started, finished, 0, rows, f"http_{response.status_code}")
+    elif batch:
+        body = response.json()
+        error = "rejected_rows" if body["rejected"] else None
+        results.record(scheduled, started, finished, body["accepted"], body["rejected"], error)
+    else:
+        results.record(scheduled, started, finished, 1, 0)
+
+
+class MQTTSender:
+    """paho-mqtt publisher; latency runs from scheduled time to PUBACK (QoS 1)"""
+
+    def __init__(self, host: str, port: int, results: Results):
+        import paho.mqtt.client as mqtt
+
+        self.results = results
+        self.pending: Dict[int, tuple] = {}
+        # PUBACK may be handled on the network thread before publish() returns the mid;
+        # paho holds its own locks in callbacks, so ours is never held across a paho call
+        self.early_acks: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self.client = mqtt.Client(client_id=f"load-test-{os.getpid()}", clean_session=True)
+        self.client.max_inflight_messages_set(1000)
+        self.client.max_queued_messages_set(0)
+        self.client.on_publish = self._on_publish
+        self.client.connect(host, port, keepalive=60)
+        self.client.loop_start()
+
+    def _on_publish(self, client, userdata, mid):
+        acked = time.perf_counter()
+        with self._lock:
+            entry = self.pending.pop(mid, None)
+            if entry is None:
+                self.early_acks[mid] = acked
+        if entry is not None:
+            self.results.record(entry[0], entry[1], acked, 1, 0)
+
+    def send(self, scheduled: float, payload: Dict):
+        started = time.perf_counter()
+        info = self.client.publish(f"sensors/{payload['sensor_id']}/data", json.dumps(payload), qos=1)
+        if info.rc != 0:
+            self.results.record(scheduled, started, time.perf_counter(), 0, 1, f"mqtt_rc_{info.rc}")
+            return
+        with self._lock:
+            acked = self.early_acks.pop(info.mid, None)
+            if acked is None:
+                self.pending[info.mid] = (scheduled, started)
+        if acked is not None:
+            self.results.record(scheduled, started, acked, 1, 0)
+
+    def close(self, wait: float = 5.0):
+        deadline = time.monotonic() + wait
+        while self.pending and time.monotonic() < deadline:
+            time.sleep(0.05)
+        with self._lock:
+            for scheduled, started in self.pending.values():
+                self.results.record(scheduled, started, time.perf_counter(), 0, 1, "no_puback")
+            self.pending.clear()
+        self.client.loop_stop()
+        self.client.disconnect()
+
+
+async def run_load(args) -> Dict:
+    sensors = synthetic_sensors(args.sensors, args.center, args.radius)
+    api_keys: Dict[str, str] = args.api_keys
+    results = Results()
+
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=timeout) as client:
+        if not args.skip_register:
+            await register_sensors(client, sensors, api_keys)
+
+        batch_size = args.batch_size if args.transport == "batch" else 1
+        requests_per_second = args.rate / batch_size
+        interval = 1.0 / requests_per_second
+        total_requests = int(args.duration * requests_per_second)
+
+        mqtt_sender = MQTTSender(args.mqtt_host, args.mqtt_port, results) if args.transport == "mqtt" else None
+        in_flight = asyncio.Semaphore(args.max_in_flight)
+        tasks = set()
+
+        async def guarded(coro):
+            try:
+                await coro
+            finally:
+                in_flight.release()
+
+        print(f"🚀 {args.transport}: {args.rate:g} показаний/с ({requests_per_second:g} запросов/с), "
+              f"{args.duration:g} с, {args.sensors} датчиков")
+        started = time.perf_counter()
+        cursor = 0
+        for n in range(total_requests):
+            scheduled = started + n * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            payload = []
+            for _ in range(batch_size):
+                sensor = sensors[cursor % len(sensors)]
+                cursor += 1
+                payload.append(reading(sensor, api_keys.get(sensor["sensor_id"])))
+
+            if mqtt_sender:
+                mqtt_sender.send(scheduled, payload[0])
+                continue
+
+            # Bounded in-flight work; waiting here shows up as latency (scheduled time is kept)
+            await in_flight.acquire()
+            if args.transport == "batch":
+                coro = _send_http(client, results, scheduled, payload, "/sensor/data/batch", True)
+            else:
+                coro = _send_http(client, results, scheduled, payload[0], "/sensor/data", False)
+            task = asyncio.create_task(guarded(coro))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        if tasks:
+            await asyncio.gather(*tasks)
+        if mqtt_sender:
+            await asyncio.to_thread(mqtt_sender.close)
+        elapsed = time.perf_counter() - started
+
+    return build_report(args, results, elapsed)
+
+
+def build_report(args, results: Results, elapsed: float) -> Dict:
+    def ms(values, pct):
+        value = percentile(values, pct)
+        return round(value * 1000, 2) if value is not None else None
+
+    total_rows = results.readings_ok + results.readings_failed
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "url": args.url if args.transport != "mqtt" else f"mqtt://{args.mqtt_host}:{args.mqtt_port}",
+            "transport": args.transport,
+            "sensors": args.sensors,
+            "target_readings_per_second": args.rate,
+            "duration_seconds": args.duration,
+            "batch_size": args.batch_size if args.transport == "batch" else 1,
+            "connections": args.connections,
+            "max_in_flight": args.max_in_flight,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "requests": results.requests,
+        "readings_ok": results.readings_ok,
+        "readings_failed": results.readings_failed,
+        "achieved_readings_per_second": round(results.readings_ok / elapsed, 1) if elapsed else None,
+        "achieved_requests_per_second": round(results.requests / elapsed, 1) if elapsed else None,
+        "error_rate": round(results.readings_failed / total_rows, 4) if total_rows else None,
+        "errors": dict(results.errors),
+        "late_requests": results.late,
+        "latency_ms": {
+            **{f"p{p}": ms(results.latencies, p) for p in (50, 95, 99)},
+            "max": ms(results.latencies, 100),
+        },
+        "service_time_ms": {f"p{p}": ms(results.service_times, p) for p in (50, 95, 99)},
+    }
+
+
+def run(args) -> Dict:
+    """Run one load test, print a summary and write the JSON report"""
+    report = asyncio.run(run_load(args))
+
+    output = args.output or f"load_report_{args.transport}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = report["latency_ms"]
+    print(f"✅ {report['achieved_readings_per_second']} показаний/с "
+          f"(цель {args.rate:g}), ошибок: {report['error_rate']}")
+    print(f"   задержка p50={latency['p50']} мс, p95={latency['p95']} мс, p99={latency['p99']} мс")
+    if report["errors"]:
+        print(f"   ошибки: {report['errors']}")
+    print(f"📄 Отчет: {output}")
+    return report
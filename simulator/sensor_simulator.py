@@ -2,16 +2,21 @@
 IoT Sensor Simulator
 Simulates multiple environmental sensors sending data to the IoT Service
 """
+import argparse
 import requests
 import random
 import time
 from datetime import datetime
 import json
+import os
 
 # Configuration
 IOT_API_URL = "http://localhost:8001"
 NUM_SENSORS = 5
 
+# API keys issued at registration (shown only once by the IoT Service)
+KEYS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".sensor_keys.json")
+
 # Pavlodar area coordinates
 PAVLODAR_CENTER = {"lat": 52.2873, "lon": 76.9674}
 RADIUS = 0.05  # ~5km radius
@@ -61,6 +66,21 @@ SENSOR_LOCATIONS = [
 ]
 
 
+def load_api_keys():
+    if os.path.exists(KEYS_FILE):
+        with open(KEYS_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def save_api_keys(keys):
+    with open(KEYS_FILE, "w") as f:
+        json.dump(keys, f, indent=2)
+
+
+API_KEYS = load_api_keys()
+
+
 def register_sensors():
     """Register all sensors in the system"""
     print("📡 Регистрация датчиков...")
@@ -80,6 +100,8 @@ def register_sensors():
             )
 
             if response.status_code == 200:
+                API_KEYS[sensor["sensor_id"]] = response.json()["api_key"]
+                save_api_keys(API_KEYS)
                 print(f"   ✅ {sensor['name']} зарегистрирован")
             elif response.status_code == 400:
                 print(f"   ℹ️  {sensor['name']} уже существует")
@@ -191,7 +213,8 @@ def send_sensor_data():
             # Send to IoT Service
             response = requests.post(
                 f"{IOT_API_URL}/sensor/data",
-                json=data
+                json=data,
+                headers={"X-API-Key": API_KEYS.get(sensor["sensor_id"], "")}
             )
 
             if response.status_code == 200:
@@ -211,8 +234,48 @@ def send_sensor_data():
     print()
 
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="IoT Sensor Simulator")
+    parser.add_argument("--url", default=IOT_API_URL, help="IoT Service URL")
+    parser.add_argument("--load", action="store_true",
+                        help="нагрузочный тест: N синтетических датчиков с заданной частотой")
+    parser.add_argument("--sensors", type=int, default=10000, help="число синтетических датчиков")
+    parser.add_argument("--rate", type=float, default=1000, help="целевая частота, показаний/с")
+    parser.add_argument("--duration", type=float, default=60, help="длительность теста, с")
+    parser.add_argument("--transport", choices=["http", "batch", "mqtt"], default="http")
+    parser.add_argument("--batch-size", type=int, default=100, help="показаний в одном batch-запросе")
+    parser.add_argument("--connections", type=int, default=100, help="размер пула HTTP-соединений")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="максимум одновременных запросов")
+    parser.add_argument("--timeout", type=float, default=10, help="таймаут запроса, с")
+    parser.add_argument("--radius", type=float, default=RADIUS * 3, help="радиус размещения датчиков, градусы")
+    parser.add_argument("--mqtt-host", default="localhost")
+    parser.add_argument("--mqtt-port", type=int, default=1883)
+    parser.add_argument("--skip-register", action="store_true", help="не регистрировать датчики")
+    parser.add_argument("--output", help="файл JSON-отчета (по умолчанию load_report_<transport>_<время>.json)")
+    return parser.parse_args()
+
+
+def run_load_test(args):
+    """Load-generating mode (see load_test.py)"""
+    from load_test import run
+
+    args.center = PAVLODAR_CENTER
+    args.api_keys = API_KEYS
+    try:
+        run(args)
+    finally:
+        save_api_keys(API_KEYS)
+
+
 def main():
     """Main simulation loop"""
+    global IOT_API_URL
+    args = parse_args()
+    IOT_API_URL = args.url
+    if args.load:
+        run_load_test(args)
+        return
+
     print("=" * 60)
     print("🌍 IoT Sensor Simulator - Pavlodar Environmental Monitoring")
     print("=" * 60)